@@ -1,23 +1,25 @@
-from lib.display import *
-from lib.network.microWebSrv import MicroWebSrv
-from lib.wireless import *
-import machine
-import json
+from lib.display import *
+from lib.network.microWebSrv import MicroWebSrv
+from lib.wireless import *
+from lib.motion import CommandQueue
+from lib import protocol
+import machine
+import json
 import webrepl
 import network
 import time
 import json
 import gc
 import _thread
-
-ring = LEDRing()
-matrix = Matrix()
-ring.reset()
-matrix.reset()
-wifi = None
-ap = None
-last_wifi_ap_list = None
-last_wifi_ap_scan_time = None
+
+ring = LEDRing()
+matrix = Matrix()
+ring.reset()
+matrix.reset()
+wifi = None
+ap = None
+last_wifi_ap_list = None
+last_wifi_ap_scan_time = None
 mPlayer = None
 
 # -----------------------------------------------------------------------------
@@ -26,22 +28,52 @@ mPlayer = None
 
 _crawler = None
 _crawler_error = None
+# Held while the Crawler is built, so threads asking at once share one.
+_crawler_lock = _thread.allocate_lock()
 
 _motion_lock = _thread.allocate_lock()
-_motion_queue = []  # (cmd:str, steps:int, hold:bool)
+# Ring buffer of (cmd:str, steps:int, hold:bool, queued_at:ticks_us). Repeats of
+# the newest command are merged into it; center/all_off use the priority lane.
+_motion_queue = CommandQueue(24, max_steps=20)
 _motion_busy = False
 _motion_last = None
 _motion_stop = False
 _motion_thread_started = False
-
-_CRAWLER_ALLOWED_CMDS = (
-    "forward",
-    "backward",
-    "rotate_left",
-    "rotate_right",
-    "lateral_left",
-    "lateral_right",
-)
+# Held by whoever writes to the PCA: the worker while it runs a command or a
+# stop, or _request_stop() when it finds the bus free.
+_bus_lock = _thread.allocate_lock()
+
+# Worker wake-up signal: held while there is nothing to do. The worker blocks
+# acquiring it; _motion_wake() releases it.
+_motion_signal = _thread.allocate_lock()
+_motion_signal.acquire()
+
+# Pickup latency: time from a command being runnable (queued, or the previous
+# command finishing) to the worker starting it.
+_PICKUP_BUCKETS_US = (100, 250, 500, 1000, 2500, 5000, 10000, 25000)
+_pickup_counts = [0] * (len(_PICKUP_BUCKETS_US) + 1)
+_pickup_max_us = 0
+_pickup_last_us = 0
+_GC_MIN_FREE = 16 * 1024  # collect between queued commands only below this
+
+# Binary commands (lib/protocol.py). HTTP requests share one receive buffer
+# and decoded command, taken under _cmd_lock (the server runs worker threads).
+_cmd_lock = _thread.allocate_lock()
+_cmd_buf = bytearray(protocol.MAX_FRAME)
+_cmd_frame = protocol.Command()
+# Latest OP_JOINTS move, run by the worker as "_joints"; a newer one replaces
+# it before it starts.
+_joints_move = protocol.Command()
+
+# /api/crawler/status: the static part (pins, offsets, validation) is kept
+# serialized and rebuilt only on config changes; the dynamic part carries a
+# version that moves when its content does.
+_status_static = None
+_status_static_key = None
+_status_static_version = 0
+_status_dynamic = None
+_status_version = 0
+_status_lock = _thread.allocate_lock()
 
 
 def _cors_headers():
@@ -71,7 +103,10 @@ def _get_crawler():
     global _crawler, _crawler_error
     if _crawler is not None:
         return _crawler
+    _crawler_lock.acquire()
     try:
+        if _crawler is not None:
+            return _crawler
         from lib.kinematics import Crawler
 
         _crawler = Crawler()
@@ -81,6 +116,16 @@ def _get_crawler():
         _crawler = None
         _crawler_error = str(e)
         return None
+    finally:
+        _crawler_lock.release()
+
+
+def _crawler_has_gait(bot, cmd):
+    # Gait commands come from the crawler's gait library (robot-config.json "gaits").
+    try:
+        return cmd in bot.gaits
+    except:
+        return False
 
 
 def _bot_request_abort(bot):
@@ -107,6 +152,16 @@ def _bot_clear_abort(bot):
         pass
 
 
+def _bot_outputs_off(bot):
+    # Single-write all off; also records the stop latency on current libraries.
+    try:
+        bot.outputsOff()
+        return
+    except AttributeError:
+        pass
+    bot.pca.all_off()
+
+
 def _bot_should_abort(bot):
     try:
         return bot._should_abort()
@@ -118,87 +173,69 @@ def _bot_should_abort(bot):
         return False
 
 
-def _crawler_debug_snapshot():
-    bot = _get_crawler()
-    if bot is None:
-        return {
-            "ok": False,
-            "error": _crawler_error,
-        }
+def _bot_driving(bot):
+    # True while a velocity stream is running or still settling back to center.
+    try:
+        return bot.velocityActive()
+    except:
+        return False
 
-    legs = [bot.leg0, bot.leg1, bot.leg2, bot.leg3]
 
-    pins = {}
-    orientation = {}
-    offsets = {}
-    angles = {}
+def _bot_clear_velocity(bot):
+    try:
+        bot.clearVelocity()
+    except:
+        pass
 
-    joints = []  # (joint_name, channel)
 
-    for i, leg in enumerate(legs):
-        leg_name = "leg{}".format(i)
-        pins[leg_name] = {
-            "upper": leg.upperServo,
-            "lower": leg.lowerServo,
-        }
-        orientation[leg_name] = {
-            "upper": leg.upperOrientationWRTHead,
-            "lower": leg.lowerOrientationWRTHead,
-        }
-        offsets[leg_name] = {
-            "upper": leg.centerOffsetUpper,
-            "lower": leg.centerOffsetLower,
-        }
-        angles[leg_name] = {
-            "upper": leg.currentAngleUpper,
-            "lower": leg.currentAngleLower,
-        }
+def _joint_put(tree, name, value):
+    # "leg0.upper" goes to tree["leg0"]["upper"], a plain joint name to tree[name].
+    group, dot, part = name.rpartition(".")
+    if dot:
+        tree.setdefault(group, {})[part] = value
+    else:
+        tree[name] = value
+
 
-        joints.append(("{}.upper".format(leg_name), leg.upperServo))
-        joints.append(("{}.lower".format(leg_name), leg.lowerServo))
+def _crawler_static_snapshot(bot):
+    # Pins, orientation, offsets and their validation, for every joint of the
+    # robot's topology (bot.joints): only change when the config is
+    # (re)loaded, see _crawler_static_json().
+    joints = bot.joints
 
+    pins = {}
+    orientation = {}
+    offsets = {}
     warnings = []
     seen = {}
 
-    for joint_name, ch in joints:
-        try:
-            ch_i = int(ch)
-        except Exception:
-            warnings.append({"type": "pin_invalid", "joint": joint_name, "value": ch})
-            continue
-
-        if ch_i < 0 or ch_i > 15:
-            warnings.append({"type": "pin_out_of_range", "joint": joint_name, "channel": ch_i})
-
-        if ch_i in seen:
-            warnings.append(
-                {"type": "pin_duplicate", "channel": ch_i, "joints": [seen[ch_i], joint_name]}
-            )
+    for j in range(joints.n):
+        name = joints.names[j]
+        ch = joints.channel[j]
+        ori = joints.orientation[j]
+        off = joints.offset[j]
+        _joint_put(pins, name, ch)
+        _joint_put(orientation, name, ori)
+        _joint_put(offsets, name, off)
+
+        if ch > 15:
+            warnings.append({"type": "pin_out_of_range", "joint": name, "channel": ch})
+        if ch in seen:
+            warnings.append({"type": "pin_duplicate", "channel": ch, "joints": [seen[ch], name]})
         else:
-            seen[ch_i] = joint_name
-
-    for leg_name in ("leg0", "leg1", "leg2", "leg3"):
-        for joint in ("upper", "lower"):
-            ori = orientation[leg_name][joint]
-            if ori not in (-1, 1):
-                warnings.append(
-                    {"type": "orientation_unusual", "joint": "{}.{}".format(leg_name, joint), "value": ori}
-                )
-            off = offsets[leg_name][joint]
-            try:
-                if abs(float(off)) > 90:
-                    warnings.append(
-                        {"type": "offset_large", "joint": "{}.{}".format(leg_name, joint), "value": off}
-                    )
-            except Exception:
-                warnings.append(
-                    {"type": "offset_invalid", "joint": "{}.{}".format(leg_name, joint), "value": off}
-                )
+            seen[ch] = name
+        if ori not in (-1, 1):
+            warnings.append({"type": "orientation_unusual", "joint": name, "value": ori})
+        if abs(off) > 90:
+            warnings.append({"type": "offset_large", "joint": name, "value": off})
 
     # Best-effort PCA parameters.
     pca = None
     try:
-        pca = {"minPulse": bot.pca._min, "maxPulse": bot.pca._max}
+        pca = {
+            "minPulse": bot.pca._min,
+            "maxPulse": bot.pca._max,
+        }
     except Exception:
         pca = None
 
@@ -207,12 +244,147 @@ def _crawler_debug_snapshot():
         "pins": pins,
         "orientation": orientation,
         "offsets": offsets,
-        "angles": angles,
         "pca": pca,
+        "legs": len(bot._legs),
+        "gaits": list(getattr(bot, "gaits", ())),
         "warnings": warnings,
     }
 
 
+def _crawler_dynamic_snapshot(bot):
+    joints = bot.joints
+    angles = {}
+    for j in range(joints.n):
+        _joint_put(angles, joints.names[j], joints.current[j])
+
+    pca = None
+    try:
+        pca = {
+            "cacheHits": bot.pca.cache_hits,
+            "cacheMisses": bot.pca.cache_misses,
+        }
+    except Exception:
+        pca = None
+
+    motion = None
+    try:
+        motion = bot.motionStats()
+    except Exception:
+        motion = None
+
+    velocity = None
+    try:
+        velocity = list(bot.velocity())
+    except Exception:
+        velocity = None
+
+    return {
+        "angles": angles,
+        "pcaCache": pca,
+        "motion": motion,
+        "velocity": velocity,
+    }
+
+
+def _crawler_static_json(bot):
+    # (json, version) of the pre-serialized static snapshot, rebuilt when the
+    # robot's config version moves (offsets, gaits reloaded) or the robot is
+    # re-created. Both are read under _status_lock so they always match.
+    global _status_static, _status_static_key, _status_static_version
+    try:
+        key = (id(bot), bot.configVersion)
+    except:
+        key = (id(bot), 0)
+    _status_lock.acquire()
+    try:
+        if _status_static is None or key != _status_static_key:
+            _status_static = json.dumps(_crawler_static_snapshot(bot))
+            _status_static_key = key
+            _status_static_version += 1
+        return _status_static, _status_static_version
+    finally:
+        _status_lock.release()
+
+
+def _json_merge(*texts):
+    # One JSON object with the members of the serialized objects in texts,
+    # joined as text rather than parsed and re-serialized. Empty ones are
+    # skipped, so the result is valid whatever they hold.
+    bodies = [t[1:-1].strip() for t in texts]
+    return "{" + ", ".join([b for b in bodies if b]) + "}"
+
+
+def _crawler_status(since=None):
+    # Dynamic status, with "version" bumped whenever its content changes, and
+    # the static part's version. If since is the current version, only the
+    # versions are returned ("changed": False).
+    global _status_dynamic, _status_version
+    _ensure_motion_thread()
+    _motion_lock.acquire()
+    try:
+        qstats = _motion_queue.stats()
+        busy = _motion_busy
+        last = _motion_last
+        stop = _motion_stop
+    finally:
+        _motion_lock.release()
+
+    bot = _get_crawler()
+    dynamic = {
+        "ok": True,
+        "ip": _get_ip_address(),
+        "queueLen": qstats["len"],
+        "queue": qstats,
+        "busy": busy,
+        "stopRequested": stop,
+        "last": last,
+        "pickup": _pickup_stats(),
+        "error": _crawler_error,
+        "crawler": _crawler_dynamic_snapshot(bot) if bot is not None else None,
+        "http": _http_stats(),
+    }
+    static_version = _crawler_static_json(bot)[1] if bot is not None else None
+    # HTTP workers and the telemetry thread build statuses concurrently.
+    _status_lock.acquire()
+    try:
+        if dynamic != _status_dynamic:
+            _status_dynamic = dynamic
+            _status_version += 1
+        version = _status_version
+        if static_version is None:
+            static_version = _status_static_version
+    finally:
+        _status_lock.release()
+    if since == version:
+        return {
+            "ok": True,
+            "changed": False,
+            "version": version,
+            "staticVersion": static_version,
+        }
+    status = dict(dynamic)
+    status["version"] = version
+    status["staticVersion"] = static_version
+    return status
+
+
+def _http_stats():
+    # Connection queue of the web server. Only the fields that move under
+    # load: a per-request counter would bump the status version every poll.
+    try:
+        stats = srv.GetStats()
+    except Exception:
+        stats = None
+    if not stats:
+        return None
+    return {
+        "workers": stats["workers"],
+        "queued": stats["queued"],
+        "maxQueued": stats["maxQueued"],
+        "rejected": stats["rejected"],
+    }
+
+
 def _ensure_motion_thread():
     global _motion_thread_started
     if _motion_thread_started:
@@ -225,24 +397,66 @@ def _ensure_motion_thread():
         _motion_thread_started = False
 
 
+def _motion_wake():
+    # Wake the worker. Releasing an unlocked lock raises, which just means it
+    # is already awake.
+    try:
+        _motion_signal.release()
+    except RuntimeError:
+        pass
+
+
+def _record_pickup(us):
+    global _pickup_max_us, _pickup_last_us
+    i = 0
+    while i < len(_PICKUP_BUCKETS_US) and us > _PICKUP_BUCKETS_US[i]:
+        i += 1
+    _pickup_counts[i] += 1
+    _pickup_last_us = us
+    if us > _pickup_max_us:
+        _pickup_max_us = us
+
+
+def _pickup_stats():
+    return {
+        "bucketsUs": list(_PICKUP_BUCKETS_US),
+        "counts": list(_pickup_counts),
+        "lastUs": _pickup_last_us,
+        "maxUs": _pickup_max_us,
+    }
+
+
 def _request_stop():
     global _motion_stop
     _ensure_motion_thread()
     _motion_lock.acquire()
     try:
         _motion_stop = True
-        _motion_queue[:] = []
+        _motion_queue.clear()
     finally:
         _motion_lock.release()
     bot = _get_crawler()
     if bot is not None:
         try:
+            _bot_clear_velocity(bot)
             _bot_request_abort(bot)
         except:
             pass
+        # A running move pre-empts itself within a frame slice and turns the
+        # outputs off. With the bus free (the worker idle, or still building
+        # the Crawler), do it here rather than wait for the worker; never in
+        # the middle of the worker's own write.
+        if _bus_lock.acquire(0):
+            try:
+                _bot_outputs_off(bot)
+            except:
+                pass
+            finally:
+                _bus_lock.release()
+    _motion_wake()
 
 
-def _enqueue_motion(cmd, steps=1, hold=False):
+def _enqueue_motion(cmd, steps=1, hold=False, priority=False, replace=False):
     _ensure_motion_thread()
     try:
         steps = int(steps)
@@ -255,33 +469,103 @@ def _enqueue_motion(cmd, steps=1, hold=False):
 
     _motion_lock.acquire()
     try:
-        if len(_motion_queue) >= 24:
+        if not _motion_queue.put(cmd, steps, hold is True, time.ticks_us(), priority, replace):
             return False
-        _motion_queue.append((cmd, steps, hold is True))
-        return True
     finally:
         _motion_lock.release()
+    _motion_wake()
+    return True
+
+
+def _motion_reset(cmd):
+    # Abort current motion and clear queue, then run cmd (center/all_off).
+    global _motion_stop
+    bot = _get_crawler()
+    if bot is not None:
+        try:
+            _bot_request_abort(bot)
+        except:
+            pass
+
+    _motion_lock.acquire()
+    try:
+        _motion_queue.clear()
+        _motion_stop = False
+    finally:
+        _motion_lock.release()
+
+    return _enqueue_motion(cmd, steps=1, hold=True, priority=True, replace=True)
+
+
+def _crawler_run_frame(frame):
+    # Carry out a decoded protocol.Command. Returns 0, or the HTTP status to
+    # report: 400 for a command this robot can't run, 429 for a full queue.
+    op = frame.op
+    if op == protocol.OP_STOP:
+        _request_stop()
+        return 0
+    if op == protocol.OP_VELOCITY:
+        v = frame.velocity
+        _drive_set(v[0], v[1], v[2])
+        return 0
+    if op == protocol.OP_CENTER:
+        return 0 if _motion_reset("center") else 429
+    if op == protocol.OP_ALL_OFF:
+        return 0 if _motion_reset("all_off") else 429
+
+    bot = _get_crawler()
+    if bot is None:
+        return 400
+    hold = frame.flags & protocol.FLAG_HOLD != 0
+    replace = frame.flags & protocol.FLAG_REPLACE != 0
+    if op == protocol.OP_GAIT:
+        try:
+            cmd = frame.gait()
+        except ValueError:
+            return 400
+        if not _crawler_has_gait(bot, cmd):
+            return 400
+        return 0 if _enqueue_motion(cmd, frame.steps, hold, replace=replace) else 429
+
+    # OP_JOINTS
+    if frame.flags & protocol.FLAG_OFF or frame.mask >> len(bot.joints):
+        return 400
+    _motion_lock.acquire()
+    try:
+        n = frame.count
+        _joints_move.count = n
+        _joints_move.duration_ms = frame.duration_ms
+        for i in range(n):
+            _joints_move.indexes[i] = frame.indexes[i]
+            _joints_move.tenths[i] = frame.tenths[i]
+    finally:
+        _motion_lock.release()
+    return 0 if _enqueue_motion("_joints", 1, hold, replace=replace) else 429
 
 
 def _motion_worker():
     global _motion_busy, _motion_last, _motion_stop, _crawler_error
+    free_at = time.ticks_us()  # when the worker last finished something
     while True:
         # Emergency stop gets priority.
         if _motion_stop:
             bot = _get_crawler()
             if bot is not None:
+                _bus_lock.acquire()
                 try:
                     _bot_request_abort(bot)
-                    bot.pca.all_off()
+                    _bot_outputs_off(bot)
                     _bot_clear_abort(bot)
                 except Exception as e:
                     _crawler_error = str(e)
+                finally:
+                    _bus_lock.release()
             _motion_lock.acquire()
             try:
                 _motion_stop = False
             finally:
                 _motion_lock.release()
-            time.sleep_ms(20)
+            free_at = time.ticks_us()
             continue
 
         cmd = None
@@ -289,8 +573,13 @@ def _motion_worker():
         hold = False
         _motion_lock.acquire()
         try:
-            if _motion_queue:
-                cmd, steps, hold = _motion_queue.pop(0)
+            if len(_motion_queue):
+                cmd, steps, hold, queued_at = _motion_queue.get()
+                now = time.ticks_us()
+                if time.ticks_diff(queued_at, free_at) > 0:
+                    _record_pickup(time.ticks_diff(now, queued_at))
+                else:
+                    _record_pickup(time.ticks_diff(now, free_at))
                 _motion_busy = True
                 _motion_last = {
                     "cmd": cmd,
@@ -298,13 +587,27 @@ def _motion_worker():
                     "hold": hold,
                     "t": time.ticks_ms(),
                 }
+            elif _crawler is not None and not _motion_stop and _bot_driving(_crawler):
+                # Velocity stream (/ws/crawler/drive): one gait phase at a time
+                # while nothing is queued.
+                cmd = "_drive"
+                _motion_busy = True
             else:
                 _motion_busy = False
+            # Cleared under the lock so a stop right after pickup is not lost.
+            if cmd is not None and _crawler is not None:
+                _bot_clear_abort(_crawler)
         finally:
             _motion_lock.release()
 
         if cmd is None:
-            time.sleep_ms(30)
+            # Idle: tidy the heap now, off the command path, then block until
+            # _motion_wake().
+            try:
+                gc.collect()
+            except:
+                pass
+            _motion_signal.acquire()
             continue
 
         bot = _get_crawler()
@@ -312,10 +615,23 @@ def _motion_worker():
             time.sleep_ms(200)
             continue
 
+        _bus_lock.acquire()
         try:
-            _bot_clear_abort(bot)
-
-            if cmd == "center":
+            if cmd == "_drive":
+                bot.velocityStep()
+            elif cmd == "_joints":
+                _motion_lock.acquire()
+                try:
+                    n = _joints_move.count
+                    indexes = list(_joints_move.indexes[:n])
+                    angles = [_joints_move.angle(k) for k in range(n)]
+                    duration_ms = _joints_move.duration_ms or None
+                finally:
+                    _motion_lock.release()
+                bot.moveJoints(indexes, angles, duration_ms)
+                if not hold:
+                    bot.pca.all_off()
+            elif cmd == "center":
                 bot.center()
                 # center() ends with all_off() in current library.
             elif cmd == "all_off":
@@ -324,7 +640,7 @@ def _motion_worker():
                 _bot_request_abort(bot)
                 bot.stop()
                 _bot_clear_abort(bot)
-            elif cmd in _CRAWLER_ALLOWED_CMDS:
+            elif _crawler_has_gait(bot, cmd):
                 for i in range(steps):
                     if _bot_should_abort(bot):
                         break
@@ -340,296 +656,302 @@ def _motion_worker():
                 bot.pca.all_off()
             except:
                 pass
+        finally:
+            _bus_lock.release()
 
+        free_at = time.ticks_us()
+        # More commands waiting: only collect if memory is getting short, the
+        # idle branch above does the routine collection.
         try:
-            gc.collect()
+            if len(_motion_queue) and gc.mem_free() < _GC_MIN_FREE:
+                gc.collect()
         except:
             pass
 
-def startup():
-    global mPlayer
-
-    from audio import player
-    mPlayer = player(None)
-    mPlayer.set_vol(100)
-
-    try:
-        with open("/sdcard/config/robot-config.json") as file:
-            content = json.loads(file.read())
-        startup_sound = content["startup"]["sound"]
-        startup_text = content["startup"]["text"]
-        if startup_sound != "":
-            mPlayer.play(startup_sound)
-        else:
-            mPlayer.play('file://sdcard/lib/data/robot-on.wav')
-        if startup_text != "":    
-            matrix.scroll(startup_text, red=150, green=10, blue=40, speed=0.05)
-    except Exception as e:
-        print("Startup error:", e)
-
-    for i in range(12):
-        ring.set_manual(i, (0, 100, 0))
-        time.sleep(0.05)
-    ring.reset()
-
-    while mPlayer.get_state()['status'] == player.STATUS_RUNNING:
-        time.sleep(1)
-
-def test_connect_wifi():
-    global wifi
-    global mPlayer
-
-    wifi = WiFi()
-
-    try:
-        with open("/sdcard/config/robot-config.json") as file:
-            content = json.loads(file.read())
-        if content["wifi"]["ssid"] != "":
-            if mPlayer is None:
-                from audio import player
-                mPlayer = player(None)
-                mPlayer.set_vol(100)
-            mPlayer.play('file://sdcard/lib/data/wifi-connecting.wav')
-            print("Connecting to WiFi:", content["wifi"]["ssid"], content["wifi"]["password"])
-            wifi.connect(content["wifi"]["ssid"], content["wifi"]["password"], verbose=True)
-    except Exception as e:
-        print("WiFi check and connect error:", e)
-        pass
-
-    if wifi.wlan.isconnected():
-        if mPlayer is None:
-            from audio import player
-            mPlayer = player(None)
-            mPlayer.set_vol(100)
-        mPlayer.play('file://sdcard/lib/data/wifi-connected.wav')
-        time.sleep(2)
-
-def check_and_connect_wifi():
-    global wifi
-
-    wifi = WiFi()
-
-    try:
-        with open("/sdcard/config/robot-config.json") as file:
-            content = json.loads(file.read())
-        if content["wifi"]["ssid"] != "":
-            print("Connecting to WiFi:", content["wifi"]["ssid"], content["wifi"]["password"])
-            wifi.connect(content["wifi"]["ssid"], content["wifi"]["password"], verbose=True)
-    except Exception as e:
-        print("WiFi check and connect error:", e)
-        pass
-
-    if wifi.wlan.isconnected():
-        with open("/sdcard/config/portal-config.json") as file:
-            content = json.loads(file.read())
-        content["pythonWebREPL"]["endpoint"] = "ws://{}:8266".format(wifi.wlan.ifconfig()[0])
-        content["onboarding"]["hasProvidedWifiCredentials"] = True
-        
-        with open("/sdcard/config/portal-config.json", "w") as outfile:
-            outfile.write(json.dumps(content))
-    else:
-        with open("/sdcard/config/portal-config.json") as file:
-            content = json.loads(file.read())
-        content["pythonWebREPL"]["endpoint"] = "ws://192.168.4.1:8266"
-        content["onboarding"]["hasProvidedWifiCredentials"] = False
-        
-        with open("/sdcard/config/portal-config.json", "w") as outfile:
-            outfile.write(json.dumps(content))
-
-def init_ap():
-    global ap
-
-    ssid = 'CYOBot'
-    ap = network.WLAN(network.AP_IF)
-    ap.active(True)
-
-    while ap.active() == False:
-        time.sleep(0.01)
-
-    ap.config(essid=ssid, pm=network.WLAN.PM_PERFORMANCE, txpower=20, channel=6)
-
-    print('Access point created successfully')
-    print(ap.config('essid'), ap.ifconfig())
-
-def start_dns():
-    global wifi
-
-    if not wifi.wlan.isconnected():
-        from lib.network.microDNSSrv import MicroDNSSrv
-        if MicroDNSSrv.Create({"portal.cyobot.com": "192.168.4.1"}):
-            print("MicroDNSSrv started.")
-        else :
-            print("Error to starts MicroDNSSrv...")
-
-def getWiFiAPList():
-    global wifi
-    global ap
-
-    def signal_strength(x):
-        if x < -80:
-            return 0
-        elif x < -60:
-            return 1
-        elif x < -40:
-            return 2
-        else:
-            return 3
-    
-    try:
-        ap_list = wifi.wlan.scan()
-    except:
-        try:
-            ap_list = ap.scan()
-        except:
-            pass
-    content = [{"ssid": x[0].decode('ascii'), "strength": signal_strength(x[3])} for x in ap_list]
-    return content
-
-@MicroWebSrv.route('/api/config')
-def _httpHandlerGetConfig(httpClient, httpResponse):
-    httpResponse.WriteResponseFile("/sdcard/config/portal-config.json", contentType="application/json", headers={
-        'Access-Control-Allow-Origin': '*',
-        'Access-Control-Allow-Methods': '*',
-        'Access-Control-Allow-Headers': '*'
-    })
-
-@MicroWebSrv.route('/api/internet')
-def _httpHandlerGetWiFiConnectivity(httpClient, httpResponse):
-    if wifi.wlan.isconnected():
-        httpResponse.WriteResponseJSONOk(obj=json.loads('{"status": "connected"}'), headers={
-            'Access-Control-Allow-Origin': '*',
-            'Access-Control-Allow-Methods': '*',
-            'Access-Control-Allow-Headers': '*'
-        })
-    else:
-        httpResponse.WriteResponseJSONOk(obj=json.loads('{"status": "disconnected"}'), headers={
-            'Access-Control-Allow-Origin': '*',
-            'Access-Control-Allow-Methods': '*',
-            'Access-Control-Allow-Headers': '*'
-        })
-
-@MicroWebSrv.route('/api/wifi')
-def _httpHandlerGetWiFi(httpClient, httpResponse):
-    global last_wifi_ap_list
-    global last_wifi_ap_scan_time
-    if time.time() - last_wifi_ap_scan_time > 10:
-        last_wifi_ap_list = getWiFiAPList()
-        last_wifi_ap_scan_time = time.time()
-    httpResponse.WriteResponseJSONOk(obj=last_wifi_ap_list, headers={
-        'Access-Control-Allow-Origin': '*',
-        'Access-Control-Allow-Methods': '*',
-        'Access-Control-Allow-Headers': '*'
-    })
-
-@MicroWebSrv.route('/api/wifi', method='OPTIONS')
-def _httpHandlerOptionWiFiCredential(httpClient, httpResponse):
-    httpResponse.WriteResponseOk(headers={
-        'Access-Control-Allow-Origin': '*',
-        'Access-Control-Allow-Methods': '*',
-        'Access-Control-Allow-Headers': '*'
-    })
-
-@MicroWebSrv.route('/api/wifi', 'POST')
-def _httpHandlerPostWiFiCredential(httpClient, httpResponse):
-    # receive credentials from portal
-    # attempt to connect
-    # if successful, update config.json (pythonwebrepl --> ws://<NEW IP>:8266) AND onboarding.hasProvidedWifiCredentials --> True
-    # if not, do not need to update
-    # return "success" or "fail" to client
-    data = httpClient.ReadRequestContentAsJSON()
-    global mPlayer
-
-    # try 4 times (5 seconds/time)
-    if mPlayer is None:
-        from audio import player
-        mPlayer = player(None)
-        mPlayer.set_vol(100)
-    mPlayer.play('file://sdcard/lib/data/wifi-connecting.wav')
-    for i in range(4):
-        wifi.connect(data["ssid"], data["password"], verbose=True)
-        if wifi.wlan.isconnected():
-            mPlayer.play('file://sdcard/lib/data/wifi-connected.wav')
-            time.sleep(2)
-            break
-
-    #! TODO: also store this credential in INTERNAL config so that we can connect in the future auto
-    if wifi.wlan.isconnected():
-        with open("/sdcard/config/portal-config.json") as file:
-            content = json.loads(file.read())
-        content["pythonWebREPL"]["endpoint"] = "ws://{}:8266".format(wifi.wlan.ifconfig()[0])
-        content["onboarding"]["hasProvidedWifiCredentials"] = True
-        
-        with open("/sdcard/config/portal-config.json", "w") as outfile:
-            outfile.write(json.dumps(content))
-
-        with open("/sdcard/config/robot-config.json") as file:
-            content = json.loads(file.read())
-        content["wifi"]["ssid"] = data["ssid"]
-        content["wifi"]["password"] = data["password"]
-
-        with open("/sdcard/config/robot-config.json", "w") as outfile:
-            outfile.write(json.dumps(content))
-
-        httpResponse.WriteResponseJSONOk(obj=json.dumps("success"), headers={
-            'Access-Control-Allow-Origin': '*',
-            'Access-Control-Allow-Methods': '*',
-            'Access-Control-Allow-Headers': '*'
-        })
-        
-        time.sleep(2)
-        with open("state", "w") as file:
-            file.write("2")
-        import machine
-        machine.reset()
-
-    else:
-        httpResponse.WriteResponseJSONOk(obj=json.dumps("fail"), headers={
-            'Access-Control-Allow-Origin': '*',
-            'Access-Control-Allow-Methods': '*',
-            'Access-Control-Allow-Headers': '*'
-        })
-
-@MicroWebSrv.route('/api/config', 'POST')
-def _httpHandlerPostConfig(httpClient, httpResponse):
-    data = httpClient.ReadRequestContentAsJSON()
-    print(data)
-    
-    try:
-        with open("/sdcard/config/portal-config.json") as file:
-            content = json.loads(file.read())
-        content["pythonWebREPL"]["endpoint"] = data["wsEndpoint"]
-        
-        with open("/sdcard/config/portal-config.json", "w") as outfile:
-            outfile.write(json.dumps(content))
-        
-        httpResponse.WriteResponseOk(headers={
-            'Access-Control-Allow-Origin': '*',
-            'Access-Control-Allow-Methods': '*',
-            'Access-Control-Allow-Headers': '*'
-        })
-    except Exception as e:
-        print(e)
-        httpResponse.WriteReponseError(500, headers={
-            'Access-Control-Allow-Origin': '*',
-            'Access-Control-Allow-Methods': '*',
-            'Access-Control-Allow-Headers': '*'
-        })
-
+def startup():
+    global mPlayer
+
+    from audio import player
+    mPlayer = player(None)
+    mPlayer.set_vol(100)
+
+    try:
+        with open("/sdcard/config/robot-config.json") as file:
+            content = json.loads(file.read())
+        startup_sound = content["startup"]["sound"]
+        startup_text = content["startup"]["text"]
+        if startup_sound != "":
+            mPlayer.play(startup_sound)
+        else:
+            mPlayer.play('file://sdcard/lib/data/robot-on.wav')
+        if startup_text != "":    
+            matrix.scroll(startup_text, red=150, green=10, blue=40, speed=0.05)
+    except Exception as e:
+        print("Startup error:", e)
+
+    for i in range(12):
+        ring.set_manual(i, (0, 100, 0))
+        time.sleep(0.05)
+    ring.reset()
+
+    while mPlayer.get_state()['status'] == player.STATUS_RUNNING:
+        time.sleep(1)
+
+def test_connect_wifi():
+    global wifi
+    global mPlayer
+
+    wifi = WiFi()
+
+    try:
+        with open("/sdcard/config/robot-config.json") as file:
+            content = json.loads(file.read())
+        if content["wifi"]["ssid"] != "":
+            if mPlayer is None:
+                from audio import player
+                mPlayer = player(None)
+                mPlayer.set_vol(100)
+            mPlayer.play('file://sdcard/lib/data/wifi-connecting.wav')
+            print("Connecting to WiFi:", content["wifi"]["ssid"], content["wifi"]["password"])
+            wifi.connect(content["wifi"]["ssid"], content["wifi"]["password"], verbose=True)
+    except Exception as e:
+        print("WiFi check and connect error:", e)
+        pass
+
+    if wifi.wlan.isconnected():
+        if mPlayer is None:
+            from audio import player
+            mPlayer = player(None)
+            mPlayer.set_vol(100)
+        mPlayer.play('file://sdcard/lib/data/wifi-connected.wav')
+        time.sleep(2)
+
+def check_and_connect_wifi():
+    global wifi
+
+    wifi = WiFi()
+
+    try:
+        with open("/sdcard/config/robot-config.json") as file:
+            content = json.loads(file.read())
+        if content["wifi"]["ssid"] != "":
+            print("Connecting to WiFi:", content["wifi"]["ssid"], content["wifi"]["password"])
+            wifi.connect(content["wifi"]["ssid"], content["wifi"]["password"], verbose=True)
+    except Exception as e:
+        print("WiFi check and connect error:", e)
+        pass
+
+    if wifi.wlan.isconnected():
+        with open("/sdcard/config/portal-config.json") as file:
+            content = json.loads(file.read())
+        content["pythonWebREPL"]["endpoint"] = "ws://{}:8266".format(wifi.wlan.ifconfig()[0])
+        content["onboarding"]["hasProvidedWifiCredentials"] = True
+        
+        with open("/sdcard/config/portal-config.json", "w") as outfile:
+            outfile.write(json.dumps(content))
+    else:
+        with open("/sdcard/config/portal-config.json") as file:
+            content = json.loads(file.read())
+        content["pythonWebREPL"]["endpoint"] = "ws://192.168.4.1:8266"
+        content["onboarding"]["hasProvidedWifiCredentials"] = False
+        
+        with open("/sdcard/config/portal-config.json", "w") as outfile:
+            outfile.write(json.dumps(content))
+
+def init_ap():
+    global ap
+
+    ssid = 'CYOBot'
+    ap = network.WLAN(network.AP_IF)
+    ap.active(True)
+
+    while ap.active() == False:
+        time.sleep(0.01)
+
+    ap.config(essid=ssid, pm=network.WLAN.PM_PERFORMANCE, txpower=20, channel=6)
+
+    print('Access point created successfully')
+    print(ap.config('essid'), ap.ifconfig())
+
+def start_dns():
+    global wifi
+
+    if not wifi.wlan.isconnected():
+        from lib.network.microDNSSrv import MicroDNSSrv
+        if MicroDNSSrv.Create({"portal.cyobot.com": "192.168.4.1"}):
+            print("MicroDNSSrv started.")
+        else :
+            print("Error to starts MicroDNSSrv...")
+
+def getWiFiAPList():
+    global wifi
+    global ap
+
+    def signal_strength(x):
+        if x < -80:
+            return 0
+        elif x < -60:
+            return 1
+        elif x < -40:
+            return 2
+        else:
+            return 3
+    
+    try:
+        ap_list = wifi.wlan.scan()
+    except:
+        try:
+            ap_list = ap.scan()
+        except:
+            pass
+    content = [{"ssid": x[0].decode('ascii'), "strength": signal_strength(x[3])} for x in ap_list]
+    return content
+
+@MicroWebSrv.route('/api/config')
+def _httpHandlerGetConfig(httpClient, httpResponse):
+    httpResponse.WriteResponseFile("/sdcard/config/portal-config.json", contentType="application/json", headers={
+        'Access-Control-Allow-Origin': '*',
+        'Access-Control-Allow-Methods': '*',
+        'Access-Control-Allow-Headers': '*'
+    })
+
+@MicroWebSrv.route('/api/internet')
+def _httpHandlerGetWiFiConnectivity(httpClient, httpResponse):
+    if wifi.wlan.isconnected():
+        httpResponse.WriteResponseJSONOk(obj=json.loads('{"status": "connected"}'), headers={
+            'Access-Control-Allow-Origin': '*',
+            'Access-Control-Allow-Methods': '*',
+            'Access-Control-Allow-Headers': '*'
+        })
+    else:
+        httpResponse.WriteResponseJSONOk(obj=json.loads('{"status": "disconnected"}'), headers={
+            'Access-Control-Allow-Origin': '*',
+            'Access-Control-Allow-Methods': '*',
+            'Access-Control-Allow-Headers': '*'
+        })
+
+@MicroWebSrv.route('/api/wifi')
+def _httpHandlerGetWiFi(httpClient, httpResponse):
+    global last_wifi_ap_list
+    global last_wifi_ap_scan_time
+    if time.time() - last_wifi_ap_scan_time > 10:
+        last_wifi_ap_list = getWiFiAPList()
+        last_wifi_ap_scan_time = time.time()
+    httpResponse.WriteResponseJSONOk(obj=last_wifi_ap_list, headers={
+        'Access-Control-Allow-Origin': '*',
+        'Access-Control-Allow-Methods': '*',
+        'Access-Control-Allow-Headers': '*'
+    })
+
+@MicroWebSrv.route('/api/wifi', method='OPTIONS')
+def _httpHandlerOptionWiFiCredential(httpClient, httpResponse):
+    httpResponse.WriteResponseOk(headers={
+        'Access-Control-Allow-Origin': '*',
+        'Access-Control-Allow-Methods': '*',
+        'Access-Control-Allow-Headers': '*'
+    })
+
+@MicroWebSrv.route('/api/wifi', 'POST')
+def _httpHandlerPostWiFiCredential(httpClient, httpResponse):
+    # receive credentials from portal
+    # attempt to connect
+    # if successful, update config.json (pythonwebrepl --> ws://<NEW IP>:8266) AND onboarding.hasProvidedWifiCredentials --> True
+    # if not, do not need to update
+    # return "success" or "fail" to client
+    data = httpClient.ReadRequestContentAsJSON()
+    global mPlayer
+
+    # try 4 times (5 seconds/time)
+    if mPlayer is None:
+        from audio import player
+        mPlayer = player(None)
+        mPlayer.set_vol(100)
+    mPlayer.play('file://sdcard/lib/data/wifi-connecting.wav')
+    for i in range(4):
+        wifi.connect(data["ssid"], data["password"], verbose=True)
+        if wifi.wlan.isconnected():
+            mPlayer.play('file://sdcard/lib/data/wifi-connected.wav')
+            time.sleep(2)
+            break
+
+    #! TODO: also store this credential in INTERNAL config so that we can connect in the future auto
+    if wifi.wlan.isconnected():
+        with open("/sdcard/config/portal-config.json") as file:
+            content = json.loads(file.read())
+        content["pythonWebREPL"]["endpoint"] = "ws://{}:8266".format(wifi.wlan.ifconfig()[0])
+        content["onboarding"]["hasProvidedWifiCredentials"] = True
+        
+        with open("/sdcard/config/portal-config.json", "w") as outfile:
+            outfile.write(json.dumps(content))
+
+        with open("/sdcard/config/robot-config.json") as file:
+            content = json.loads(file.read())
+        content["wifi"]["ssid"] = data["ssid"]
+        content["wifi"]["password"] = data["password"]
+
+        with open("/sdcard/config/robot-config.json", "w") as outfile:
+            outfile.write(json.dumps(content))
+
+        httpResponse.WriteResponseJSONOk(obj=json.dumps("success"), headers={
+            'Access-Control-Allow-Origin': '*',
+            'Access-Control-Allow-Methods': '*',
+            'Access-Control-Allow-Headers': '*'
+        })
+        
+        time.sleep(2)
+        with open("state", "w") as file:
+            file.write("2")
+        import machine
+        machine.reset()
+
+    else:
+        httpResponse.WriteResponseJSONOk(obj=json.dumps("fail"), headers={
+            'Access-Control-Allow-Origin': '*',
+            'Access-Control-Allow-Methods': '*',
+            'Access-Control-Allow-Headers': '*'
+        })
+
+@MicroWebSrv.route('/api/config', 'POST')
+def _httpHandlerPostConfig(httpClient, httpResponse):
+    data = httpClient.ReadRequestContentAsJSON()
+    print(data)
+    
+    try:
+        with open("/sdcard/config/portal-config.json") as file:
+            content = json.loads(file.read())
+        content["pythonWebREPL"]["endpoint"] = data["wsEndpoint"]
+        
+        with open("/sdcard/config/portal-config.json", "w") as outfile:
+            outfile.write(json.dumps(content))
+        
+        httpResponse.WriteResponseOk(headers={
+            'Access-Control-Allow-Origin': '*',
+            'Access-Control-Allow-Methods': '*',
+            'Access-Control-Allow-Headers': '*'
+        })
+    except Exception as e:
+        print(e)
+        httpResponse.WriteReponseError(500, headers={
+            'Access-Control-Allow-Origin': '*',
+            'Access-Control-Allow-Methods': '*',
+            'Access-Control-Allow-Headers': '*'
+        })
+
 @MicroWebSrv.route('/api/deploy', 'POST')
 def _httpHandlerPostConfig(httpClient, httpResponse):
-    data = httpClient.ReadRequestContentAsJSON()
-    with open("/sdcard/main.py", "w") as outfile:
-        outfile.write(data["code"])
-    import machine
-    machine.reset()
-    try:
-        httpResponse.WriteResponseOk(headers={
-            'Access-Control-Allow-Origin': '*',
-            'Access-Control-Allow-Methods': '*',
-            'Access-Control-Allow-Headers': '*'
-        })
-    except Exception as e:
-        print(e)
+    data = httpClient.ReadRequestContentAsJSON()
+    with open("/sdcard/main.py", "w") as outfile:
+        outfile.write(data["code"])
+    import machine
+    machine.reset()
+    try:
+        httpResponse.WriteResponseOk(headers={
+            'Access-Control-Allow-Origin': '*',
+            'Access-Control-Allow-Methods': '*',
+            'Access-Control-Allow-Headers': '*'
+        })
+    except Exception as e:
+        print(e)
         httpResponse.WriteReponseError(500, headers={
             'Access-Control-Allow-Origin': '*',
             'Access-Control-Allow-Methods': '*',
@@ -650,28 +972,40 @@ def _httpHandlerCrawlerControlPage(httpClient, httpResponse):
 
 @MicroWebSrv.route('/api/crawler/status')
 def _httpHandlerCrawlerStatus(httpClient, httpResponse):
-    _ensure_motion_thread()
-    _motion_lock.acquire()
-    try:
-        qlen = len(_motion_queue)
-        busy = _motion_busy
-        last = _motion_last
-        stop = _motion_stop
-    finally:
-        _motion_lock.release()
+    # ?since=<version>: dynamic part only, or just the versions if unchanged.
+    # Without it, the full snapshot as before, static part included.
+    since = httpClient.GetRequestQueryParams().get("since", None)
+    if since is not None:
+        try:
+            since = int(since)
+        except:
+            since = -1
+        httpResponse.WriteResponseJSONOk(obj=_crawler_status(since), headers=_cors_headers())
+        return
 
-    crawler = _crawler_debug_snapshot()
+    status = _crawler_status()
+    bot = _get_crawler()
+    if bot is None:
+        status["crawler"] = {"ok": False, "error": _crawler_error}
+        httpResponse.WriteResponseJSONOk(obj=status, headers=_cors_headers())
+        return
+    # Splice the cached static JSON into the crawler object rather than
+    # rebuilding and re-serializing it.
+    crawler = status.pop("crawler")
+    static = _crawler_static_json(bot)[0]
+    content = _json_merge(json.dumps(status), '{"crawler": ' + _json_merge(static, json.dumps(crawler)) + "}")
+    httpResponse.WriteResponseOk(headers=_cors_headers(), contentType="application/json", contentCharset="UTF-8", content=content)
 
-    httpResponse.WriteResponseJSONOk(obj={
-        "ok": True,
-        "ip": _get_ip_address(),
-        "queueLen": qlen,
-        "busy": busy,
-        "stopRequested": stop,
-        "last": last,
-        "error": _crawler_error,
-        "crawler": crawler,
-    }, headers=_cors_headers())
+
+@MicroWebSrv.route('/api/crawler/status/static')
+def _httpHandlerCrawlerStatusStatic(httpClient, httpResponse):
+    bot = _get_crawler()
+    if bot is None:
+        httpResponse.WriteResponseJSONError(500, obj={"error": _crawler_error})
+        return
+    static, version = _crawler_static_json(bot)
+    content = _json_merge(static, '{{"staticVersion": {}}}'.format(version))
+    httpResponse.WriteResponseOk(headers=_cors_headers(), contentType="application/json", contentCharset="UTF-8", content=content)
 
 
 @MicroWebSrv.route('/api/crawler/cmd', method='OPTIONS')
@@ -681,6 +1015,10 @@ def _httpHandlerCrawlerCmdOptions(httpClient, httpResponse):
 
 @MicroWebSrv.route('/api/crawler/cmd', 'POST')
 def _httpHandlerCrawlerCmd(httpClient, httpResponse):
+    if httpClient.GetRequestContentType() == "application/octet-stream":
+        _httpHandlerCrawlerCmdBinary(httpClient, httpResponse)
+        return
+
     data = httpClient.ReadRequestContentAsJSON()
     if not isinstance(data, dict):
         httpResponse.WriteResponseJSONError(400, obj={"error": "Invalid JSON body"})
@@ -689,17 +1027,20 @@ def _httpHandlerCrawlerCmd(httpClient, httpResponse):
     cmd = data.get("cmd", "")
     steps = data.get("steps", 1)
     hold = data.get("hold", False)
+    # replace: drop pending commands first (joystick-style, latest wins).
+    replace = data.get("replace", False)
 
     if cmd == "stop":
         _request_stop()
         httpResponse.WriteResponseJSONOk(obj={"ok": True}, headers=_cors_headers())
         return
 
-    if cmd not in _CRAWLER_ALLOWED_CMDS:
+    bot = _get_crawler()
+    if bot is None or not _crawler_has_gait(bot, cmd):
         httpResponse.WriteResponseJSONError(400, obj={"error": "Invalid cmd"},)
         return
 
-    ok = _enqueue_motion(cmd, steps=steps, hold=hold is True)
+    ok = _enqueue_motion(cmd, steps=steps, hold=hold is True, replace=replace is True)
     if not ok:
         httpResponse.WriteResponseJSONError(429, obj={"error": "Queue full"})
         return
@@ -707,6 +1048,61 @@ def _httpHandlerCrawlerCmd(httpClient, httpResponse):
     httpResponse.WriteResponseJSONOk(obj={"ok": True}, headers=_cors_headers())
 
 
+def _httpHandlerCrawlerCmdBinary(httpClient, httpResponse):
+    if httpClient.GetRequestContentLength() > protocol.MAX_FRAME:
+        httpResponse.WriteResponseJSONError(400, obj={"error": "Frame too long"})
+        return
+    _cmd_lock.acquire()
+    try:
+        n = httpClient.ReadRequestContentInto(_cmd_buf)
+        try:
+            _cmd_frame.parse(_cmd_buf, n)
+        except ValueError as e:
+            httpResponse.WriteResponseJSONError(400, obj={"error": str(e)})
+            return
+        code = _crawler_run_frame(_cmd_frame)
+    finally:
+        _cmd_lock.release()
+    if code == 429:
+        httpResponse.WriteResponseJSONError(429, obj={"error": "Queue full"})
+    elif code:
+        httpResponse.WriteResponseJSONError(400, obj={"error": "Invalid cmd"})
+    else:
+        httpResponse.WriteResponseJSONOk(obj={"ok": True}, headers=_cors_headers())
+
+
+@MicroWebSrv.route('/api/crawler/gaits')
+def _httpHandlerCrawlerGaits(httpClient, httpResponse):
+    bot = _get_crawler()
+    if bot is None:
+        httpResponse.WriteResponseJSONError(500, obj={"error": _crawler_error})
+        return
+    gaits = {}
+    for name, spec in bot.gaits.items():
+        gaits[name] = spec.to_dict()
+    httpResponse.WriteResponseJSONOk(obj={"ok": True, "gaits": gaits}, headers=_cors_headers())
+
+
+@MicroWebSrv.route('/api/crawler/gaits/reload', method='OPTIONS')
+def _httpHandlerCrawlerGaitsReloadOptions(httpClient, httpResponse):
+    httpResponse.WriteResponseOk(headers=_cors_headers())
+
+
+@MicroWebSrv.route('/api/crawler/gaits/reload', 'POST')
+def _httpHandlerCrawlerGaitsReload(httpClient, httpResponse):
+    # Re-read the "gaits" section of robot-config.json, no reset needed.
+    bot = _get_crawler()
+    if bot is None:
+        httpResponse.WriteResponseJSONError(500, obj={"error": _crawler_error})
+        return
+    try:
+        names = bot.loadGaits()
+    except Exception as e:
+        httpResponse.WriteResponseJSONError(400, obj={"error": str(e)})
+        return
+    httpResponse.WriteResponseJSONOk(obj={"ok": True, "gaits": names}, headers=_cors_headers())
+
+
 @MicroWebSrv.route('/api/crawler/stop', method='OPTIONS')
 def _httpHandlerCrawlerStopOptions(httpClient, httpResponse):
     httpResponse.WriteResponseOk(headers=_cors_headers())
@@ -725,24 +1121,7 @@ def _httpHandlerCrawlerCenterOptions(httpClient, httpResponse):
 
 @MicroWebSrv.route('/api/crawler/center', 'POST')
 def _httpHandlerCrawlerCenter(httpClient, httpResponse):
-    global _motion_stop
-    # Abort current motion and clear queue, then center.
-    bot = _get_crawler()
-    if bot is not None:
-        try:
-            _bot_request_abort(bot)
-        except:
-            pass
-
-    _motion_lock.acquire()
-    try:
-        _motion_queue[:] = []
-        _motion_stop = False
-    finally:
-        _motion_lock.release()
-
-    ok = _enqueue_motion("center", steps=1, hold=True)
-    if not ok:
+    if not _motion_reset("center"):
         httpResponse.WriteResponseJSONError(429, obj={"error": "Queue full"})
         return
     httpResponse.WriteResponseJSONOk(obj={"ok": True}, headers=_cors_headers())
@@ -755,120 +1134,346 @@ def _httpHandlerCrawlerAllOffOptions(httpClient, httpResponse):
 
 @MicroWebSrv.route('/api/crawler/all_off', 'POST')
 def _httpHandlerCrawlerAllOff(httpClient, httpResponse):
-    global _motion_stop
-    # Abort current motion and clear queue, then all_off.
+    if not _motion_reset("all_off"):
+        httpResponse.WriteResponseJSONError(429, obj={"error": "Queue full"})
+        return
+    httpResponse.WriteResponseJSONOk(obj={"ok": True}, headers=_cors_headers())
+
+
+# -----------------------------------------------------------------------------
+# Crawler velocity streaming over WebSocket: ws://<ip>/ws/crawler/drive
+#
+# Binary frames are lib/protocol.py frames: OP_VELOCITY ('<Bbbb': opcode, vx
+# forward, vy left, wz counter-clockwise, -100..100) or any command frame.
+# Text frames take {"vx": .., "vy": .., "wz": ..} in -1..1, or "stop".
+# Send at 20-50 Hz; the crawler settles if nothing arrives for 500 ms.
+# -----------------------------------------------------------------------------
+
+
+def _drive_set(vx, vy, wz):
     bot = _get_crawler()
-    if bot is not None:
+    if bot is None:
+        return
+    try:
+        bot.setVelocity(vx, vy, wz)
+    except:
+        return
+    _ensure_motion_thread()
+    _motion_wake()
+
+
+def _wsDriveRecvText(webSocket, msg):
+    if msg.strip() == "stop":
+        _request_stop()
+        return
+    try:
+        data = json.loads(msg)
+        _drive_set(float(data.get("vx", 0)), float(data.get("vy", 0)), float(data.get("wz", 0)))
+    except:
+        pass
+
+
+def _wsDriveClosed(webSocket):
+    # Lost client: let the crawler settle rather than walk on until the deadman.
+    _drive_set(0, 0, 0)
+
+
+# -----------------------------------------------------------------------------
+# Crawler telemetry over WebSocket: ws://<ip>/ws/crawler/telemetry[?hz=10]
+#
+# Pushes the dynamic part of /api/crawler/status (angles, queue, last command,
+# pickup latency, motion stats) as JSON text messages: first
+# {"full": true, "state": {...}}, then {"delta": {...}} with only what changed
+# (nested objects diffed the same way, removed keys as null). "heap" rides
+# along at most once a second. One status build per tick serves every client,
+# and nothing is sent while nothing changes. Sends block, so a client slower
+# than its rate is served less often and its next delta covers everything it
+# missed. Send {"hz": n} to change the rate.
+# -----------------------------------------------------------------------------
+
+_TELEMETRY_HZ = 10
+_TELEMETRY_MAX_HZ = 50
+_TELEMETRY_HEAP_MS = 1000
+
+_telemetry_lock = _thread.allocate_lock()
+# [webSocket, period_ms, due_ms, last_state, heap_due_ms] per client.
+_telemetry_clients = []
+_telemetry_started = False
+
+
+def _telemetry_period(hz):
+    try:
+        hz = int(hz)
+    except:
+        hz = _TELEMETRY_HZ
+    if hz < 1:
+        hz = 1
+    if hz > _TELEMETRY_MAX_HZ:
+        hz = _TELEMETRY_MAX_HZ
+    return 1000 // hz
+
+
+def _status_delta(old, new):
+    # Keys of new whose values differ from old; dicts are diffed recursively.
+    delta = {}
+    for key in new:
+        value = new[key]
+        prev = old.get(key, None)
+        if value == prev and key in old:
+            continue
+        if isinstance(value, dict) and isinstance(prev, dict):
+            value = _status_delta(prev, value)
+        delta[key] = value
+    for key in old:
+        if key not in new:
+            delta[key] = None
+    return delta
+
+
+def _telemetry_send(client, status, now):
+    # Push one update to a client; False if it's gone.
+    webSocket, period, due, last, heap_due = client
+    if last is None:
+        msg = {"full": True, "state": status}
+    else:
+        delta = _status_delta(last, status)
+        msg = {"delta": delta} if delta else {}
+    if time.ticks_diff(now, heap_due) >= 0:
         try:
-            _bot_request_abort(bot)
+            msg["heap"] = {"free": gc.mem_free(), "alloc": gc.mem_alloc()}
         except:
             pass
+        client[4] = time.ticks_add(now, _TELEMETRY_HEAP_MS)
+    if msg:
+        if not webSocket.SendText(json.dumps(msg)):
+            return False
+        client[3] = status
+    # A client that took longer than its period to take the message is next
+    # served a period after the send finished, not at its usual slot.
+    took = time.ticks_diff(time.ticks_ms(), now)
+    client[2] = time.ticks_add(now, period if took < period else took + period)
+    return True
 
-    _motion_lock.acquire()
+
+def _telemetry_worker():
+    global _telemetry_started
+    while True:
+        _telemetry_lock.acquire()
+        try:
+            clients = list(_telemetry_clients)
+            if not clients:
+                _telemetry_started = False
+                return
+        finally:
+            _telemetry_lock.release()
+
+        now = time.ticks_ms()
+        status = None
+        for client in clients:
+            if time.ticks_diff(client[2], now) > 0:
+                continue
+            if status is None:
+                status = _crawler_status()
+            try:
+                ok = _telemetry_send(client, status, now)
+            except:
+                ok = False
+            if not ok:
+                _telemetry_remove(client[0])
+
+        wait = 1000
+        now = time.ticks_ms()
+        for client in clients:
+            left = time.ticks_diff(client[2], now)
+            if left < wait:
+                wait = left
+        if wait > 0:
+            time.sleep_ms(wait)
+
+
+def _telemetry_add(webSocket, period):
+    # Register a client, starting the push thread if it isn't running. The
+    # thread is started under the lock, so it can't see the list before the
+    # client is in it. Returns False, with nothing registered, if it can't be
+    # started.
+    global _telemetry_started
+    _telemetry_lock.acquire()
     try:
-        _motion_queue[:] = []
-        _motion_stop = False
+        if not _telemetry_started:
+            _thread.start_new_thread(_telemetry_worker, ())
+            _telemetry_started = True
+        now = time.ticks_ms()
+        _telemetry_clients.append([webSocket, period, now, None, now])
+        return True
+    except Exception:
+        return False
     finally:
-        _motion_lock.release()
+        _telemetry_lock.release()
 
-    ok = _enqueue_motion("all_off", steps=1, hold=True)
-    if not ok:
-        httpResponse.WriteResponseJSONError(429, obj={"error": "Queue full"})
+
+def _telemetry_remove(webSocket):
+    _telemetry_lock.acquire()
+    try:
+        for i in range(len(_telemetry_clients)):
+            if _telemetry_clients[i][0] is webSocket:
+                _telemetry_clients.pop(i)
+                break
+    finally:
+        _telemetry_lock.release()
+
+
+def _wsTelemetryRecvText(webSocket, msg):
+    try:
+        period = _telemetry_period(json.loads(msg)["hz"])
+    except:
         return
-    httpResponse.WriteResponseJSONOk(obj={"ok": True}, headers=_cors_headers())
+    _telemetry_lock.acquire()
+    try:
+        for client in _telemetry_clients:
+            if client[0] is webSocket:
+                client[1] = period
+    finally:
+        _telemetry_lock.release()
+
+
+def _wsTelemetryClosed(webSocket):
+    _telemetry_remove(webSocket)
+
+
+def _wsAccept(webSocket, httpClient):
+    path = httpClient.GetRequestPath()
+    if path == "/ws/crawler/telemetry":
+        webSocket.RecvTextCallback = _wsTelemetryRecvText
+        webSocket.ClosedCallback = _wsTelemetryClosed
+        if not _telemetry_add(webSocket, _telemetry_period(httpClient.GetRequestQueryParams().get("hz", _TELEMETRY_HZ))):
+            webSocket.Close()
+        return
+    if path != "/ws/crawler/drive":
+        webSocket.Close()
+        return
+    # Each connection runs in its own thread: give it its own decoded command.
+    frame = protocol.Command()
+
+    def _wsDriveRecvBinary(webSocket, data):
+        # A frame that can't be read stops the crawler: it may have been
+        # meant as one. Errors go back to the client as {"error": ...}.
+        try:
+            frame.parse(data)
+        except ValueError as e:
+            _request_stop()
+            webSocket.SendText(json.dumps({"error": str(e), "stopped": True}))
+            return
+        code = _crawler_run_frame(frame)
+        if code:
+            webSocket.SendText(json.dumps({"error": "Queue full" if code == 429 else "Invalid cmd"}))
+
+    webSocket.RecvBinaryCallback = _wsDriveRecvBinary
+    webSocket.RecvTextCallback = _wsDriveRecvText
+    webSocket.ClosedCallback = _wsDriveClosed
 
 
 srv = MicroWebSrv(webPath='/sdcard/portal/')
+# Two workers for ordinary requests, and a lane of its own for stop and the
+# other short crawler commands so they never queue behind a slow transfer.
+srv.WorkerThreads = 2
+srv.FastLanePaths = (
+    "/api/crawler/stop",
+    "/api/crawler/center",
+    "/api/crawler/all_off",
+    "/api/crawler/status",
+)
+srv.AcceptWebSocketCallback = _wsAccept
+srv.MaxWebSocketRecvLen = 256
 srv.Start(threaded=True)
 
 def wait_for_websocket():
-    global wifi
-    global matrix
-    global ring
-
-    if wifi.wlan.isconnected():
-        # display IP address on screen
-        left = machine.Pin(4, machine.Pin.IN)
-        right = machine.Pin(38, machine.Pin.IN)
-        ip_address = wifi.wlan.ifconfig()[0]
-        character_list = [char for char in ip_address]
-        offset_list = [(-7*i) for i in range(len(character_list))]
-        
-        matrix.reset()
-        for i in range(len(character_list)):
-            if offset_list[i] <= 6 and offset_list[i] >=-6:
-                matrix.set_character(character_list[i], offset = offset_list[i] // 1, multiplex = True, blue = 100)
-        matrix.np.write()
-        
-        redraw = False
-        
-        while webrepl.client_s is None:
-            redraw = False
-
-            if left.value() != 0 and right.value() == 0:
-                for i in range(len(offset_list)):
-                    offset_list.append(offset_list.pop(0) + 0.1)
-                redraw = True
-            elif right.value() != 0 and left.value() == 0:
-                for i in range(len(offset_list)):
-                    offset_list.append(offset_list.pop(0) - 0.1)
-                redraw = True
-            
-            if redraw:
-                matrix.reset()
-                for i in range(len(character_list)):
-                    if offset_list[i] <= 6 and offset_list[i] >=-6:
-                        matrix.set_character(character_list[i], offset = offset_list[i] // 1, multiplex = True, blue = 100)
-                matrix.np.write()
-            else:
-                time.sleep(1.0)
-    else:
-        on=True
-        while webrepl.client_s is None:
-            if on:
-                matrix.reset()
-                on = False
-            else:
-                matrix.set_manual(16, (100, 0, 100))
-                on = True
-            time.sleep(1.0)
-
-    matrix.reset()
-
-with open("state") as file:
-    state = file.read()
-
-if state == "0": # startup sequence
-    with open("state", "w") as file:
-        file.write("1")
-    
-    startup()
-    machine.reset()
-
-elif state == "1": # AP mode
-    with open("state", "w") as file:
-        file.write("0")
-    
-    # check_and_connect_wifi()
-    test_connect_wifi()
-    if wifi.wlan.isconnected():
-        with open("state", "w") as file:
-            file.write("2")
-        machine.reset()
-    
-    init_ap()
-    start_dns()
-    last_wifi_ap_list = getWiFiAPList()
-    last_wifi_ap_scan_time = time.time()
-    wait_for_websocket()
-
-elif state == "2": # WiFi mode
-    with open("state", "w") as file:
-        file.write("0")
-    
-    check_and_connect_wifi()
-    init_ap()
-    start_dns()
-    last_wifi_ap_list = getWiFiAPList()
-    last_wifi_ap_scan_time = time.time()
+    global wifi
+    global matrix
+    global ring
+
+    if wifi.wlan.isconnected():
+        # display IP address on screen
+        left = machine.Pin(4, machine.Pin.IN)
+        right = machine.Pin(38, machine.Pin.IN)
+        ip_address = wifi.wlan.ifconfig()[0]
+        character_list = [char for char in ip_address]
+        offset_list = [(-7*i) for i in range(len(character_list))]
+        
+        matrix.reset()
+        for i in range(len(character_list)):
+            if offset_list[i] <= 6 and offset_list[i] >=-6:
+                matrix.set_character(character_list[i], offset = offset_list[i] // 1, multiplex = True, blue = 100)
+        matrix.np.write()
+        
+        redraw = False
+        
+        while webrepl.client_s is None:
+            redraw = False
+
+            if left.value() != 0 and right.value() == 0:
+                for i in range(len(offset_list)):
+                    offset_list.append(offset_list.pop(0) + 0.1)
+                redraw = True
+            elif right.value() != 0 and left.value() == 0:
+                for i in range(len(offset_list)):
+                    offset_list.append(offset_list.pop(0) - 0.1)
+                redraw = True
+            
+            if redraw:
+                matrix.reset()
+                for i in range(len(character_list)):
+                    if offset_list[i] <= 6 and offset_list[i] >=-6:
+                        matrix.set_character(character_list[i], offset = offset_list[i] // 1, multiplex = True, blue = 100)
+                matrix.np.write()
+            else:
+                time.sleep(1.0)
+    else:
+        on=True
+        while webrepl.client_s is None:
+            if on:
+                matrix.reset()
+                on = False
+            else:
+                matrix.set_manual(16, (100, 0, 100))
+                on = True
+            time.sleep(1.0)
+
+    matrix.reset()
+
+with open("state") as file:
+    state = file.read()
+
+if state == "0": # startup sequence
+    with open("state", "w") as file:
+        file.write("1")
+    
+    startup()
+    machine.reset()
+
+elif state == "1": # AP mode
+    with open("state", "w") as file:
+        file.write("0")
+    
+    # check_and_connect_wifi()
+    test_connect_wifi()
+    if wifi.wlan.isconnected():
+        with open("state", "w") as file:
+            file.write("2")
+        machine.reset()
+    
+    init_ap()
+    start_dns()
+    last_wifi_ap_list = getWiFiAPList()
+    last_wifi_ap_scan_time = time.time()
+    wait_for_websocket()
+
+elif state == "2": # WiFi mode
+    with open("state", "w") as file:
+        file.write("0")
+    
+    check_and_connect_wifi()
+    init_ap()
+    start_dns()
+    last_wifi_ap_list = getWiFiAPList()
+    last_wifi_ap_scan_time = time.time()
     wait_for_websocket()
@@ -10,20 +10,35 @@ Web UI:
 API:
   - GET  /api/status
   - POST /api/servo    {"channel":0-15, "angle":-90..90} OR {"channel":0-15, "off":true}
+                       or a lib/protocol.py frame (Content-Type application/octet-stream)
+  - POST /api/servo/batch
+                       {"updates":[{"channel":0-15, "angle":-90..90 | "pulse":500..2500 us | "off":true}, ...]}
   - POST /api/center
   - POST /api/all_off
+  - WS   /ws/servo     lib/protocol.py frames as binary messages
+
+Servo writes are staged per channel and sent in as few bus writes as possible;
+a channel updated again before its write went out only sends the latest value.
+
+Binary frames: OP_JOINTS sets the channels in the mask to the given angles (or
+turns them off with FLAG_OFF); OP_CENTER, OP_ALL_OFF and OP_STOP (all off) work
+as the matching routes.
 """
 
 import gc
 import json
 import network
 import time
+import _thread
 
 from lib.network.microWebSrv import MicroWebSrv
+from lib import protocol
 
 
 AP_SSID = "CYOBot"
 NUM_CHANNELS = 16
+PULSE_MIN_US = 500   # batch "pulse" range; servos don't take wider pulses
+PULSE_MAX_US = 2500
 
 
 def _cors_headers():
@@ -115,8 +130,137 @@ except Exception as e:
     PCA_INIT_ERROR = str(e)
 
 angles = [0 for _ in range(NUM_CHANNELS)]
+pulses = [None for _ in range(NUM_CHANNELS)]
 is_off = [False for _ in range(NUM_CHANNELS)]
 
+# --- Coalesced servo writes ---
+# Updates are staged here (last write wins per channel) and flushed by
+# whichever thread gets the bus; the others leave theirs for it to pick up.
+_pending_lock = _thread.allocate_lock()
+_bus_lock = _thread.allocate_lock()
+_pending_ticks = [0 for _ in range(NUM_CHANNELS)]
+_pending_mask = 0
+write_stats = {"updates": 0, "coalesced": 0, "flushes": 0, "channels": 0}
+
+
+def _stage_ticks(ch, ticks):
+    # Call with _pending_lock held.
+    global _pending_mask
+    bit = 1 << ch
+    if _pending_mask & bit:
+        write_stats["coalesced"] += 1
+    _pending_ticks[ch] = ticks
+    _pending_mask |= bit
+    write_stats["updates"] += 1
+
+
+def _stage_update(ch, angle=None, pulse=None, off=False):
+    # Stage one channel and record it in angles/pulses/is_off. Call with
+    # _pending_lock held.
+    if off:
+        _stage_ticks(ch, 0)
+        is_off[ch] = True
+    elif pulse is not None:
+        _stage_ticks(ch, pca.pulse_us_to_ticks(pulse))
+        angles[ch] = None
+        pulses[ch] = pulse
+        is_off[ch] = False
+    else:
+        angle = _clamp_angle(angle)
+        _stage_ticks(ch, pca.angle_to_ticks(angle))
+        angles[ch] = angle
+        pulses[ch] = None
+        is_off[ch] = False
+
+
+def _flush_pending():
+    # Write everything staged, adjacent channels in one burst. Returns at once
+    # if another thread is writing: it sees our updates before it lets go.
+    global _pending_mask
+    while True:
+        if not _bus_lock.acquire(0):
+            return
+        try:
+            while True:
+                _pending_lock.acquire()
+                try:
+                    mask = _pending_mask
+                    _pending_mask = 0
+                    channels = [ch for ch in range(NUM_CHANNELS) if mask & (1 << ch)]
+                    ticks = [_pending_ticks[ch] for ch in channels]
+                finally:
+                    _pending_lock.release()
+                if not mask:
+                    break
+                try:
+                    pca.set_pwm_many(channels, ticks)
+                except Exception:
+                    # Put them back (newer values staged meanwhile win) so
+                    # the next flush retries them.
+                    _pending_lock.acquire()
+                    _pending_mask |= mask
+                    _pending_lock.release()
+                    raise
+                write_stats["flushes"] += 1
+                write_stats["channels"] += len(channels)
+        finally:
+            _bus_lock.release()
+        if not _pending_mask:
+            return
+
+# Binary requests are handled one at a time by the server thread.
+_frame_buf = bytearray(protocol.MAX_FRAME)
+_frame = protocol.Command()
+
+
+def _all_off():
+    # Pending updates are dropped so none of them turns a servo back on.
+    global _pending_mask
+    _pending_lock.acquire()
+    try:
+        _pending_mask = 0
+        for i in range(NUM_CHANNELS):
+            is_off[i] = True
+    finally:
+        _pending_lock.release()
+    _bus_lock.acquire()
+    try:
+        pca.all_off()
+    finally:
+        _bus_lock.release()
+
+
+def _center():
+    _pending_lock.acquire()
+    try:
+        for ch in range(NUM_CHANNELS):
+            _stage_update(ch, 0)
+    finally:
+        _pending_lock.release()
+    _flush_pending()
+
+
+def _run_frame(frame):
+    # Apply a decoded protocol.Command to the servos. Returns an error message
+    # or None.
+    op = frame.op
+    if op == protocol.OP_STOP or op == protocol.OP_ALL_OFF:
+        _all_off()
+    elif op == protocol.OP_CENTER:
+        _center()
+    elif op == protocol.OP_JOINTS:
+        off = frame.flags & protocol.FLAG_OFF
+        _pending_lock.acquire()
+        try:
+            for k in range(frame.count):
+                _stage_update(frame.indexes[k], frame.angle(k), off=off)
+        finally:
+            _pending_lock.release()
+        _flush_pending()
+    else:
+        return "Unsupported opcode"
+    return None
+
 
 # --- API routes ---
 
@@ -136,7 +280,9 @@ def _api_status(httpClient, httpResponse):
             "ip": ip,
             "channels": NUM_CHANNELS,
             "angles": angles,
+            "pulses": pulses,
             "off": is_off,
+            "writes": write_stats,
             "labels": _load_labels(),
         },
     )
@@ -153,6 +299,10 @@ def _api_servo(httpClient, httpResponse):
         _json_err(httpResponse, 500, "PCA9685 init failed: {}".format(PCA_INIT_ERROR))
         return
 
+    if httpClient.GetRequestContentType() == "application/octet-stream":
+        _api_servo_binary(httpClient, httpResponse)
+        return
+
     data = httpClient.ReadRequestContentAsJSON()
     if not isinstance(data, dict):
         _json_err(httpResponse, 400, "Invalid JSON body")
@@ -170,8 +320,12 @@ def _api_servo(httpClient, httpResponse):
 
     if data.get("off") is True:
         try:
-            pca.off(ch)
-            is_off[ch] = True
+            _pending_lock.acquire()
+            try:
+                _stage_update(ch, off=True)
+            finally:
+                _pending_lock.release()
+            _flush_pending()
             _json_ok(httpResponse, {"channel": ch, "off": True})
         except Exception as e:
             _json_err(httpResponse, 500, str(e))
@@ -185,14 +339,84 @@ def _api_servo(httpClient, httpResponse):
 
     angle = _clamp_angle(angle)
     try:
-        pca.set_angle(ch, angle)
-        angles[ch] = angle
-        is_off[ch] = False
+        _pending_lock.acquire()
+        try:
+            _stage_update(ch, angle)
+        finally:
+            _pending_lock.release()
+        _flush_pending()
         _json_ok(httpResponse, {"channel": ch, "angle": angle})
     except Exception as e:
         _json_err(httpResponse, 500, str(e))
 
 
+def _api_servo_binary(httpClient, httpResponse):
+    if httpClient.GetRequestContentLength() > protocol.MAX_FRAME:
+        _json_err(httpResponse, 400, "Frame too long")
+        return
+    n = httpClient.ReadRequestContentInto(_frame_buf)
+    try:
+        _frame.parse(_frame_buf, n)
+        error = _run_frame(_frame)
+    except Exception as e:
+        error = str(e)
+    if error:
+        _json_err(httpResponse, 400, error)
+        return
+    _json_ok(httpResponse, {"ok": True})
+
+
+@MicroWebSrv.route("/api/servo/batch", method="OPTIONS")
+def _api_servo_batch_options(httpClient, httpResponse):
+    httpResponse.WriteResponseOk(headers=_cors_headers())
+
+
+@MicroWebSrv.route("/api/servo/batch", "POST")
+def _api_servo_batch(httpClient, httpResponse):
+    if pca is None:
+        _json_err(httpResponse, 500, "PCA9685 init failed: {}".format(PCA_INIT_ERROR))
+        return
+
+    data = httpClient.ReadRequestContentAsJSON()
+    if isinstance(data, dict):
+        data = data.get("updates")
+    if not isinstance(data, list):
+        _json_err(httpResponse, 400, "Expected {\"updates\": [...]}")
+        return
+
+    # Validate everything first so a bad entry applies nothing.
+    updates = []
+    for item in data:
+        try:
+            ch = int(item["channel"])
+            if ch < 0 or ch >= NUM_CHANNELS:
+                raise ValueError()
+            if item.get("off") is True:
+                updates.append((ch, None, None, True))
+            elif item.get("pulse") is not None:
+                pulse = int(item["pulse"])
+                if pulse < PULSE_MIN_US or pulse > PULSE_MAX_US:
+                    raise ValueError()
+                updates.append((ch, None, pulse, False))
+            else:
+                updates.append((ch, float(item["angle"]), None, False))
+        except Exception:
+            _json_err(httpResponse, 400, "Invalid update: {}".format(json.dumps(item)))
+            return
+
+    try:
+        _pending_lock.acquire()
+        try:
+            for ch, angle, pulse, off in updates:
+                _stage_update(ch, angle, pulse, off)
+        finally:
+            _pending_lock.release()
+        _flush_pending()
+        _json_ok(httpResponse, {"ok": True, "count": len(updates)})
+    except Exception as e:
+        _json_err(httpResponse, 500, str(e))
+
+
 @MicroWebSrv.route("/api/center", method="OPTIONS")
 def _api_center_options(httpClient, httpResponse):
     httpResponse.WriteResponseOk(headers=_cors_headers())
@@ -205,10 +429,7 @@ def _api_center(httpClient, httpResponse):
         return
 
     try:
-        for i in range(NUM_CHANNELS):
-            pca.set_angle(i, 0)
-            angles[i] = 0
-            is_off[i] = False
+        _center()
         _json_ok(httpResponse, {"ok": True})
     except Exception as e:
         _json_err(httpResponse, 500, str(e))
@@ -226,9 +447,7 @@ def _api_all_off(httpClient, httpResponse):
         return
 
     try:
-        pca.all_off()
-        for i in range(NUM_CHANNELS):
-            is_off[i] = True
+        _all_off()
         _json_ok(httpResponse, {"ok": True})
     except Exception as e:
         _json_err(httpResponse, 500, str(e))
@@ -244,7 +463,28 @@ try:
 except Exception:
     pass
 
+def _ws_accept(webSocket, httpClient):
+    if pca is None or httpClient.GetRequestPath() != "/ws/servo":
+        webSocket.Close()
+        return
+    # Each connection runs in its own thread: give it its own decoded command.
+    frame = protocol.Command()
+
+    def _ws_recv_binary(webSocket, data):
+        try:
+            frame.parse(data)
+            error = _run_frame(frame)
+        except Exception as e:
+            error = str(e)
+        if error:
+            webSocket.SendText(json.dumps({"error": error}))
+
+    webSocket.RecvBinaryCallback = _ws_recv_binary
+
+
 srv = MicroWebSrv(webPath="/sdcard/servo-test")
+srv.AcceptWebSocketCallback = _ws_accept
+srv.MaxWebSocketRecvLen = protocol.MAX_FRAME
 srv.Start(threaded=True)
 
 while True:
@@ -0,0 +1,136 @@
+from array import array
+import json
+from .motion import Trajectory, EASINGS, get_easing
+
+def _clamp(angle):
+    return min(90, max(-90, angle))
+
+class GaitSpec:
+    # A gait as stored in the "gaits" section of robot-config.json:
+    #   keyframes     (upper, lower) angle pairs, one pair per phase
+    #   order         per-leg multiplier of the upper joint (-1 reverses a leg)
+    #   phaseOffsets  per-leg phase shift into the keyframes
+    #   durationMs    length of each phase move, null for the robot default
+    #   easing        name from motion.EASINGS, null for the robot default
+    def __init__(self, keyframes, order=(1.0, 1.0, 1.0, 1.0), phase_offsets=(0, 2, 0, 2), duration_ms=None, easing=None):
+        if len(keyframes) < 2 or len(keyframes) % 2:
+            raise ValueError("keyframes must hold (upper, lower) pairs")
+        if len(order) != len(phase_offsets):
+            raise ValueError("order and phaseOffsets need one entry per leg")
+        if duration_ms is not None and duration_ms <= 0:
+            raise ValueError("durationMs must be positive")
+        if easing is not None and not callable(easing) and easing not in EASINGS:
+            raise ValueError("unknown easing: {}".format(easing))
+        self.keyframes = [float(a) for a in keyframes]
+        self.order = [float(o) for o in order]
+        self.phase_offsets = [int(p) for p in phase_offsets]
+        self.duration_ms = duration_ms
+        self.easing = easing
+
+    def phases(self):
+        return len(self.keyframes) // 2
+
+    def to_dict(self):
+        return {
+            "keyframes": self.keyframes,
+            "order": self.order,
+            "phaseOffsets": self.phase_offsets,
+            "durationMs": self.duration_ms,
+            "easing": self.easing if not callable(self.easing) else None,
+        }
+
+def parse_gaits(section):
+    # {name: {...}} from the config file -> {name: GaitSpec}. Raises ValueError
+    # naming the bad gait, so a typo never half-loads a library.
+    gaits = {}
+    for name, cfg in section.items():
+        try:
+            gaits[name] = GaitSpec(
+                cfg["keyframes"],
+                cfg.get("order", (1.0, 1.0, 1.0, 1.0)),
+                cfg.get("phaseOffsets", (0, 2, 0, 2)),
+                cfg.get("durationMs"),
+                cfg.get("easing"),
+            )
+        except Exception as e:
+            raise ValueError("gait {}: {}".format(name, e))
+    return gaits
+
+def load_gaits(path):
+    # Gait library from a config file, or None if it has no "gaits" section.
+    with open(path) as file:
+        section = json.load(file).get("gaits")
+    if section is None:
+        return None
+    return parse_gaits(section)
+
+def gait_poses(joints, legs, spec):
+    # The phase poses of a gait, one angle per joint of a kinematics.JointState.
+    # Leg n shows keyframe pair (phase + phaseOffsets[n]) and its upper joint is
+    # multiplied by order[n]; joints that are not part of a leg stay centered.
+    if len(spec.order) != len(legs):
+        raise ValueError("gait is for {} legs, robot has {}".format(len(spec.order), len(legs)))
+    nphase = spec.phases()
+    gait = spec.keyframes
+    poses = []
+    for i in range(nphase):
+        pose = array('f', joints.offset)
+        for n in range(len(legs)):
+            j = legs[n].base
+            k = ((i + spec.phase_offsets[n]) % nphase) * 2
+            pose[j] = _clamp(joints.offset[j] + spec.order[n] * joints.orientation[j] * gait[k])
+            pose[j + 1] = _clamp(joints.offset[j + 1] + joints.orientation[j + 1] * gait[k + 1])
+        poses.append(pose)
+    return poses
+
+class CompiledGait:
+    # A cyclic sequence of poses plus, for every phase, the servo ticks of each
+    # frame of the move into that phase from the one before it. Only joints
+    # that change in a phase are kept: with m = len(channels[phase]), running it
+    # streams ticks[k * m:(k + 1) * m] to those channels.
+    # Poses are kept as array('f') so they compare equal to JointState.current.
+    def __init__(self, pca, channels, poses, duration_ms, frame_us, easing="linear"):
+        self.poses = [array('f', pose) for pose in poses]
+        self.duration_ms = duration_ms
+        self.duration_us = int(duration_ms * 1000)
+        self.frame_us = frame_us
+        self.easing = easing
+        self.joints = len(poses[0])
+        self.nframes = max(1, (self.duration_us + frame_us - 1) // frame_us)
+        ease = get_easing(easing)
+
+        poses = self.poses
+        self.channels = []
+        self.frames = []
+        for p in range(len(poses)):
+            a = poses[p - 1]
+            b = poses[p]
+            moving = [j for j in range(self.joints) if a[j] != b[j]]
+            m = len(moving)
+            traj = Trajectory([a[j] for j in moving], [b[j] for j in moving], duration_ms, ease)
+            angles = array('f', bytes(4 * m))
+            ticks = array('H', bytes(2 * m * self.nframes))
+            for k in range(self.nframes):
+                traj.sample(self.frame_time(k), angles)
+                for j in range(m):
+                    ticks[k * m + j] = pca.angle_to_ticks(angles[j])
+            self.channels.append(array('B', [channels[j] for j in moving]))
+            self.frames.append(ticks)
+
+    def frame_time(self, k):
+        # Frame k is shown at the (k + 1)th scheduler deadline.
+        t = (k + 1) * self.frame_us
+        return t if t < self.duration_us else self.duration_us
+
+    def frame_index(self, t_us):
+        k = (t_us + self.frame_us - 1) // self.frame_us - 1
+        if k < 0:
+            return 0
+        if k >= self.nframes:
+            return self.nframes - 1
+        return k
+
+    def pose_at(self, phase, k, out):
+        # Joint angles shown by frame k of a phase, for when a move is cut short.
+        traj = Trajectory(self.poses[phase - 1], self.poses[phase], self.duration_ms, self.easing)
+        return traj.sample(self.frame_time(k), out)
@@ -1,14 +1,96 @@
+from array import array
 from .pca9685 import PCA9685
+from .motion import FrameScheduler, Trajectory
+from .gait import CompiledGait, GaitSpec, gait_poses, load_gaits
 import time
 import json
 import os
 
+class JointState:
+    # Flat per-joint arrays for a robot, in the joint order of its topology
+    # (see joint_topology). The move and servo write paths walk these directly,
+    # so any body of up to 16 servos uses the same code.
+    def __init__(self, n):
+        self.n = n
+        self.names = [""] * n
+        self.current = array('f', bytes(4 * n))
+        self.target = array('f', bytes(4 * n))
+        self.offset = array('f', bytes(4 * n))
+        self.orientation = array('f', bytes(4 * n))
+        self.channel = array('B', bytes(n))
+
+    def __len__(self):
+        return self.n
+
+    def index(self, name):
+        return self.names.index(name)
+
+# 4-leg crawler used when there is no config file.
+_DEFAULT_TOPOLOGY = (
+    ("leg0.upper", 4, -1, 0), ("leg0.lower", 5, 1, 0),
+    ("leg1.upper", 6, -1, 0), ("leg1.lower", 7, 1, 0),
+    ("leg2.upper", 11, 1, 0), ("leg2.lower", 10, 1, 0),
+    ("leg3.upper", 0, 1, 0), ("leg3.lower", 1, 1, 0),
+)
+
+def joint_topology(config):
+    # (name, pin, orientation, offset) per joint, in joint order, from the
+    # parsed robot-config.json. A "joints" list describes any body, e.g.
+    #   "joints": [{"name": "arm0.shoulder", "pin": 2, "orientation": 1, "offset": 0}, ...]
+    # otherwise the "motor" section (leg0..legN, each with upper and lower) is
+    # read as leg0.upper, leg0.lower, leg1.upper, ...
+    if config is None:
+        return _DEFAULT_TOPOLOGY
+    topology = []
+    if "joints" in config:
+        for joint in config["joints"]:
+            topology.append((joint["name"], joint["pin"], joint.get("orientation", 1), joint.get("offset", 0)))
+    else:
+        motor = config["motor"]
+        for k in range(len(motor)):
+            leg = motor["leg{}".format(k)]
+            for part in ("upper", "lower"):
+                topology.append(("leg{}.{}".format(k, part), leg[part]["pin"], leg[part]["orientation"], leg[part]["offset"]))
+    if len(topology) > 16:
+        raise ValueError("at most 16 joints, got {}".format(len(topology)))
+    pins = []
+    for name, pin, orientation, offset in topology:
+        if pin < 0 or pin > 15 or pin in pins:
+            raise ValueError("joint {}: bad or duplicate pin {}".format(name, pin))
+        pins.append(pin)
+    return topology
+
+def _copy(dst, src):
+    for i in range(len(src)):
+        dst[i] = src[i]
+
+def _jointField(field, joint):
+    # Leg attribute that reads and writes one slot of its JointState.
+    def get(self):
+        return getattr(self._state, field)[self.base + joint]
+    def set(self, value):
+        getattr(self._state, field)[self.base + joint] = value
+    return property(get, set)
+
 class Leg:
+    upperServo = _jointField("channel", 0)
+    lowerServo = _jointField("channel", 1)
+    currentAngleUpper = _jointField("current", 0)
+    currentAngleLower = _jointField("current", 1)
+    centerOffsetUpper = _jointField("offset", 0)
+    centerOffsetLower = _jointField("offset", 1)
+    upperOrientationWRTHead = _jointField("orientation", 0)
+    lowerOrientationWRTHead = _jointField("orientation", 1)
+
     def __init__(self, parent, upperServo, lowerServo, upperOrientationWRTHead = 1, lowerOrientationWRTHead = 1, centerOffsetUpper = 0, centerOffsetLower = 0):
         # the PCA
         if not isinstance(parent, PCA9685):
             raise TypeError("parent must be PCA9685 object")
         self.parent = parent
+        # A leg keeps its own two joints until a Robot moves them into its
+        # JointState; base is the index of its upper joint there.
+        self._state = JointState(2)
+        self.base = 0
         self.upperServo = upperServo
         self.lowerServo = lowerServo
         self.centerOffsetUpper = centerOffsetUpper
@@ -17,6 +99,21 @@ class Leg:
         self.currentAngleUpper = 0
         self.upperOrientationWRTHead = upperOrientationWRTHead
         self.lowerOrientationWRTHead = lowerOrientationWRTHead
+        # Robot this leg belongs to, told when offsets change so compiled gaits are rebuilt.
+        self.owner = None
+
+    def bind(self, state, base):
+        # Copy this leg's joints into slots base and base + 1 of state and use
+        # those from now on.
+        old, j = self._state, self.base
+        for i in range(2):
+            state.current[base + i] = old.current[j + i]
+            state.target[base + i] = old.current[j + i]
+            state.offset[base + i] = old.offset[j + i]
+            state.orientation[base + i] = old.orientation[j + i]
+            state.channel[base + i] = old.channel[j + i]
+        self._state = state
+        self.base = base
 
     def setCurrentAngle(self, currentAngleLower, currentAngleUpper):
         self.currentAngleLower = currentAngleLower
@@ -25,10 +122,11 @@ class Leg:
     def setOffset(self, centerOffsetUpper, centerOffsetLower):
         self.centerOffsetUpper = centerOffsetUpper
         self.centerOffsetLower = centerOffsetLower
+        if self.owner is not None:
+            self.owner.invalidateGaits()
 
     def updateServoState(self):
-        self.parent.set_angle(self.upperServo, self.currentAngleUpper)
-        self.parent.set_angle(self.lowerServo, self.currentAngleLower)
+        self.parent.set_angles((self.upperServo, self.lowerServo), (self.currentAngleUpper, self.currentAngleLower))
 
 def constrain(val, min_val, max_val):
     return min(max_val, max(min_val, val))
@@ -38,203 +136,512 @@ class Robot:
         # External code (e.g. web control panel) can set this to True to request
         # motion loops to stop as soon as possible.
         self._abort = False
+        # ticks_us of the pending request_abort(), and the measured time from
+        # request to outputs off (see outputsOff).
+        self._abortAt = None
+        self.abortCount = 0
+        self.abortLastUs = 0
+        self.abortMaxUs = 0
         self.pca = PCA9685(SDA=SDA, SCL=SCL)
+        config = None
         if "robot-config.json" in os.listdir("/sdcard/config"):
             print("config file found, loading...")
             with open("/sdcard/config/robot-config.json") as file:
-                config = json.load(file)["motor"]
-            self.leg0 = Leg(self.pca, 
-                config["leg0"]["upper"]["pin"], config["leg0"]["lower"]["pin"],
-                config["leg0"]["upper"]["orientation"], config["leg0"]["lower"]["orientation"],
-                config["leg0"]["upper"]["offset"], config["leg0"]["lower"]["offset"]
-            )
-            self.leg1 = Leg(self.pca, 
-                config["leg1"]["upper"]["pin"], config["leg1"]["lower"]["pin"],
-                config["leg1"]["upper"]["orientation"], config["leg1"]["lower"]["orientation"],
-                config["leg1"]["upper"]["offset"], config["leg1"]["lower"]["offset"]
-            )
-            self.leg2 = Leg(self.pca, 
-                config["leg2"]["upper"]["pin"], config["leg2"]["lower"]["pin"],
-                config["leg2"]["upper"]["orientation"], config["leg2"]["lower"]["orientation"],
-                config["leg2"]["upper"]["offset"], config["leg2"]["lower"]["offset"]
-            )
-            self.leg3 = Leg(self.pca, 
-                config["leg3"]["upper"]["pin"], config["leg3"]["lower"]["pin"],
-                config["leg3"]["upper"]["orientation"], config["leg3"]["lower"]["orientation"],
-                config["leg3"]["upper"]["offset"], config["leg3"]["lower"]["offset"]
-            )
-            del config
+                config = json.load(file)
         else:
             print("WARNING: no config file found for this robot, use default setting. This can affect your robot's performance. Please refer to the official tutorial to calibrate your robot before using")
-            self.leg0 = Leg(self.pca, 4, 5, -1, 1, 0, 0)
-            self.leg1 = Leg(self.pca, 6, 7, -1, 1, 0, 0)
-            self.leg2 = Leg(self.pca, 11, 10, 1, 1, 0, 0)
-            self.leg3 = Leg(self.pca, 0, 1, 1, 1, 0, 0)
-        self.DELAY_TIME = 0.002
+        topology = joint_topology(config)
+        del config
+        # All joint state lives in self.joints, in topology order.
+        self.joints = JointState(len(topology))
+        joints = self.joints
+        for i in range(len(topology)):
+            name, pin, orientation, offset = topology[i]
+            joints.names[i] = name
+            joints.channel[i] = pin
+            joints.orientation[i] = orientation
+            joints.offset[i] = offset
+        # legN.upper followed by legN.lower becomes self.legN, a view into joints.
+        legs = []
+        while "leg{}.upper".format(len(legs)) in joints.names:
+            k = len(legs)
+            base = joints.index("leg{}.upper".format(k))
+            if base + 1 >= joints.n or joints.names[base + 1] != "leg{}.lower".format(k):
+                raise ValueError("leg{}.lower must follow leg{}.upper".format(k, k))
+            leg = Leg(self.pca, joints.channel[base], joints.channel[base + 1],
+                joints.orientation[base], joints.orientation[base + 1],
+                joints.offset[base], joints.offset[base + 1])
+            leg.bind(joints, base)
+            leg.owner = self
+            setattr(self, "leg{}".format(k), leg)
+            legs.append(leg)
+        self._legs = tuple(legs)
+        # Moves are paced by absolute frame deadlines: a move of MOVE_MS takes
+        # MOVE_MS however long each bus write takes; late frames are dropped.
+        self.FRAME_US = 4000
+        self.MOVE_MS = 200
+        self.EASING = "linear"  # see motion.EASINGS
+        # Frame waits are sliced so an abort pre-empts a move mid-frame.
+        self.scheduler = FrameScheduler(self.FRAME_US, self._should_abort)
+        self._gaitCache = {}
+        self.configVersion = 0  # bumped by invalidateGaits(), for status caches
 
     def request_abort(self):
+        if not self._abort:
+            self._abortAt = time.ticks_us()
         self._abort = True
 
     def clear_abort(self):
         self._abort = False
+        self._abortAt = None
+
+    def outputsOff(self):
+        # Every servo off in a single write. Completes a pending abort and
+        # records how long it took from request_abort() to outputs off.
+        self.pca.all_off()
+        if self._abortAt is not None:
+            us = time.ticks_diff(time.ticks_us(), self._abortAt)
+            self._abortAt = None
+            self.abortCount += 1
+            self.abortLastUs = us
+            if us > self.abortMaxUs:
+                self.abortMaxUs = us
 
     def _should_abort(self):
         return self._abort is True
 
     def updateServoState(self):
-        self.leg0.updateServoState()
-        self.leg1.updateServoState()
-        self.leg2.updateServoState()
-        self.leg3.updateServoState()
+        # One burst per run of adjacent channels instead of one write per joint.
+        self.pca.set_angles(self.joints.channel, self.joints.current)
 
-    def dynamicServoAssignment(self,
-        leg0NewUpper, leg0NewLower,
-        leg1NewUpper, leg1NewLower,
-        leg2NewUpper, leg2NewLower,
-        leg3NewUpper, leg3NewLower):
-        leg0UpperDiff = self.leg0.currentAngleUpper - leg0NewUpper
-        leg0LowerDiff = self.leg0.currentAngleLower - leg0NewLower
-        leg1UpperDiff = self.leg1.currentAngleUpper - leg1NewUpper
-        leg1LowerDiff = self.leg1.currentAngleLower - leg1NewLower
-        leg2UpperDiff = self.leg2.currentAngleUpper - leg2NewUpper
-        leg2LowerDiff = self.leg2.currentAngleLower - leg2NewLower
-        leg3UpperDiff = self.leg3.currentAngleUpper - leg3NewUpper
-        leg3LowerDiff = self.leg3.currentAngleLower - leg3NewLower
-
-        leg0CurrentUpper = self.leg0.currentAngleUpper
-        leg0CurrentLower = self.leg0.currentAngleLower
-        leg1CurrentUpper = self.leg1.currentAngleUpper
-        leg1CurrentLower = self.leg1.currentAngleLower
-        leg2CurrentUpper = self.leg2.currentAngleUpper
-        leg2CurrentLower = self.leg2.currentAngleLower
-        leg3CurrentUpper = self.leg3.currentAngleUpper
-        leg3CurrentLower = self.leg3.currentAngleLower
-
-        for i in range(50):
-            if self._should_abort():
-                break
-            self.leg0.currentAngleLower = constrain(leg0CurrentLower - i*0.02*leg0LowerDiff, -90, 90)
-            self.leg0.currentAngleUpper = constrain(leg0CurrentUpper - i*0.02*leg0UpperDiff, -90, 90)
-            self.leg1.currentAngleLower = constrain(leg1CurrentLower - i*0.02*leg1LowerDiff, -90, 90)
-            self.leg1.currentAngleUpper = constrain(leg1CurrentUpper - i*0.02*leg1UpperDiff, -90, 90)
-            self.leg2.currentAngleLower = constrain(leg2CurrentLower - i*0.02*leg2LowerDiff, -90, 90)
-            self.leg2.currentAngleUpper = constrain(leg2CurrentUpper - i*0.02*leg2UpperDiff, -90, 90)
-            self.leg3.currentAngleLower = constrain(leg3CurrentLower - i*0.02*leg3LowerDiff, -90, 90)
-            self.leg3.currentAngleUpper = constrain(leg3CurrentUpper - i*0.02*leg3UpperDiff, -90, 90)
-            self.updateServoState()
-            time.sleep(self.DELAY_TIME)
+    def motionStats(self):
+        stats = self.scheduler.stats()
+        stats["abort"] = {
+            "count": self.abortCount,
+            "lastUs": self.abortLastUs,
+            "maxUs": self.abortMaxUs,
+            "pending": self._abortAt is not None,
+        }
+        return stats
 
-        if self._should_abort():
-            self.pca.all_off()
-            return
-    
-    def dynamicSingleServoAssignment(self, leg_index, new_upper, new_lower):
-        legs = [self.leg0, self.leg1, self.leg2, self.leg3]
+    def jointIndex(self, name):
+        return self.joints.index(name)
 
-        legUpperDiff = legs[leg_index].currentAngleUpper - new_upper
-        legLowerDiff = legs[leg_index].currentAngleLower - new_lower
+    def moveTo(self, pose, duration_ms=None, easing=None):
+        # Move every joint to pose, a sequence of absolute angles in joint order.
+        if len(pose) != self.joints.n:
+            raise ValueError("pose needs {} angles, got {}".format(self.joints.n, len(pose)))
+        self._runMove(pose, duration_ms, easing)
 
-        legCurrentUpper = legs[leg_index].currentAngleUpper
-        legCurrentLower = legs[leg_index].currentAngleLower
+    def moveCentered(self, pose, duration_ms=None, easing=None):
+        # Like moveTo, with angles relative to each joint's center and orientation.
+        if len(pose) != self.joints.n:
+            raise ValueError("pose needs {} angles, got {}".format(self.joints.n, len(pose)))
+        joints = self.joints
+        target = joints.target
+        for i in range(joints.n):
+            target[i] = joints.offset[i] + joints.orientation[i] * pose[i]
+        self._runMove(target, duration_ms, easing)
 
-        for i in range(50):
+    def moveJoints(self, indexes, angles, duration_ms=None, easing=None):
+        # Move only the joints in indexes to the matching absolute angles; the
+        # rest hold their pose.
+        target = self.joints.target
+        _copy(target, self.joints.current)
+        for i in range(len(indexes)):
+            target[indexes[i]] = angles[i]
+        self._runMove(target, duration_ms, easing)
+
+    def _runMove(self, targets, duration_ms=None, easing=None):
+        # targets is in joint order (may be self.joints.target itself). Only the
+        # joints that change are interpolated and written each frame; frames are
+        # sampled at the times handed out by the scheduler and the last one is
+        # the target.
+        if duration_ms is None:
+            duration_ms = self.MOVE_MS
+        if easing is None:
+            easing = self.EASING
+        joints = self.joints
+        current = joints.current
+        target = joints.target
+        moving = []
+        for i in range(joints.n):
+            current[i] = constrain(current[i], -90, 90)
+            target[i] = constrain(targets[i], -90, 90)
+            if target[i] != current[i]:
+                moving.append(i)
+        m = len(moving)
+        channels = array('B', bytes(m))
+        angles = array('f', bytes(4 * m))
+        end = array('f', bytes(4 * m))
+        for j in range(m):
+            i = moving[j]
+            channels[j] = joints.channel[i]
+            angles[j] = current[i]
+            end[j] = target[i]
+        traj = Trajectory(angles, end, duration_ms, easing)
+        # Joints that hold still are written once, in case outputs were turned
+        # off; the PCA shadow makes this free when they are already there.
+        self.updateServoState()
+
+        sched = self.scheduler
+        sched.period_us = self.FRAME_US
+        sched.start(traj.duration_us)
+        while True:
             if self._should_abort():
                 break
-            legs[leg_index].currentAngleLower = constrain(legCurrentLower - i*0.02*legLowerDiff, -90, 90)
-            legs[leg_index].currentAngleUpper = constrain(legCurrentUpper - i*0.02*legUpperDiff, -90, 90)
-            self.updateServoState()
-            time.sleep(self.DELAY_TIME)
+            t = sched.next_frame()
+            if t < 0:
+                break
+            traj.sample(t, angles)
+            for j in range(m):
+                current[moving[j]] = angles[j]
+            self.pca.set_angles(channels, angles)
 
         if self._should_abort():
-            self.pca.all_off()
+            self.outputsOff()
             return
+        _copy(current, target)
+
+    def _legTargets(self, angles):
+        # joints.target from (upper, lower) pairs per leg; other joints hold.
+        target = self.joints.target
+        _copy(target, self.joints.current)
+        legs = self._legs
+        for n in range(min(len(legs), len(angles) // 2)):
+            target[legs[n].base] = angles[2 * n]
+            target[legs[n].base + 1] = angles[2 * n + 1]
+        return target
+
+    def dynamicServoAssignment(self,
+        leg0NewUpper, leg0NewLower,
+        leg1NewUpper, leg1NewLower,
+        leg2NewUpper, leg2NewLower,
+        leg3NewUpper, leg3NewLower, duration_ms=None, easing=None):
+        self._runMove(self._legTargets((
+            leg0NewUpper, leg0NewLower,
+            leg1NewUpper, leg1NewLower,
+            leg2NewUpper, leg2NewLower,
+            leg3NewUpper, leg3NewLower,
+        )), duration_ms, easing)
+    
+    def dynamicSingleServoAssignment(self, leg_index, new_upper, new_lower, duration_ms=None, easing=None):
+        target = self.joints.target
+        _copy(target, self.joints.current)
+        base = self._legs[leg_index].base
+        target[base] = new_upper
+        target[base + 1] = new_lower
+        self._runMove(target, duration_ms, easing)
     
     def readServoPosition(self, leg_index, joint_type):
-        legs = [self.leg0, self.leg1, self.leg2, self.leg3]
+        base = self._legs[leg_index].base
         if joint_type == "upper":
-            return legs[leg_index].currentAngleUpper
+            return self.joints.current[base]
         elif joint_type == "lower":
-            return legs[leg_index].currentAngleLower
+            return self.joints.current[base + 1]
     
-    def centeredDynamicSingleServoAssignment(self, leg_index, new_upper, new_lower):
-        legs = [self.leg0, self.leg1, self.leg2, self.leg3]
+    def centeredDynamicSingleServoAssignment(self, leg_index, new_upper, new_lower, duration_ms=None, easing=None):
+        offset = self.joints.offset
+        orientation = self.joints.orientation
+        j = self._legs[leg_index].base
         self.dynamicSingleServoAssignment(
             leg_index,
-            legs[leg_index].centerOffsetUpper + legs[leg_index].upperOrientationWRTHead * new_upper, 
-            legs[leg_index].centerOffsetLower + legs[leg_index].lowerOrientationWRTHead * new_lower
+            offset[j] + orientation[j] * new_upper,
+            offset[j + 1] + orientation[j + 1] * new_lower,
+            duration_ms, easing
         )
     
     def centeredDynamicServoAssignment(self, 
         leg0NewUpper, leg0NewLower,
         leg1NewUpper, leg1NewLower,
         leg2NewUpper, leg2NewLower,
-        leg3NewUpper, leg3NewLower):
-        self.dynamicServoAssignment(
-            self.leg0.centerOffsetUpper + self.leg0.upperOrientationWRTHead * leg0NewUpper, self.leg0.centerOffsetLower + self.leg0.lowerOrientationWRTHead * leg0NewLower,
-            self.leg1.centerOffsetUpper + self.leg1.upperOrientationWRTHead * leg1NewUpper, self.leg1.centerOffsetLower + self.leg1.lowerOrientationWRTHead * leg1NewLower,
-            self.leg2.centerOffsetUpper + self.leg2.upperOrientationWRTHead * leg2NewUpper, self.leg2.centerOffsetLower + self.leg2.lowerOrientationWRTHead * leg2NewLower,
-            self.leg3.centerOffsetUpper + self.leg3.upperOrientationWRTHead * leg3NewUpper, self.leg3.centerOffsetLower + self.leg3.lowerOrientationWRTHead * leg3NewLower
-        )
+        leg3NewUpper, leg3NewLower, duration_ms=None, easing=None):
+        target = self._legTargets((
+            leg0NewUpper, leg0NewLower,
+            leg1NewUpper, leg1NewLower,
+            leg2NewUpper, leg2NewLower,
+            leg3NewUpper, leg3NewLower,
+        ))
+        self._centerLegTargets()
+        self._runMove(target, duration_ms, easing)
+
+    def _centerLegTargets(self):
+        # Leg joints of joints.target from angles relative to each joint's
+        # center and orientation.
+        joints = self.joints
+        target = joints.target
+        for leg in self._legs:
+            for i in (leg.base, leg.base + 1):
+                target[i] = joints.offset[i] + joints.orientation[i] * target[i]
 
-    def twoPhaseGaitPropagation(self, gait, order=[1.0, 1.0, 1.0, 1.0]):
+    def twoPhaseGaitPropagation(self, gait, order=[1.0, 1.0, 1.0, 1.0], duration_ms=None, easing=None):
+        # Legs 0 and 2 show keyframe pair i, legs 1 and 3 pair i + 2.
+        target = self.joints.target
+        legs = self._legs
         for i in range(4):
             if self._should_abort():
-                self.pca.all_off()
+                self.outputsOff()
+                return
+            _copy(target, self.joints.current)
+            for n in range(min(len(legs), len(order))):
+                k = ((i + 2 * (n % 2)) * 2) % 8
+                target[legs[n].base] = order[n] * gait[k]
+                target[legs[n].base + 1] = gait[k + 1]
+            self._centerLegTargets()
+            self._runMove(target, duration_ms, easing)
+
+    def invalidateGaits(self):
+        # Call after changing offsets, orientations, pins or PCA min/max directly;
+        # Leg.setOffset does it for you.
+        self._gaitCache = {}
+        self.configVersion += 1
+
+    def compileGait(self, name, spec, duration_ms=None, easing=None):
+        # Explicit arguments win over the gait's own timing, which wins over the
+        # robot defaults.
+        if duration_ms is None:
+            duration_ms = spec.duration_ms if spec.duration_ms is not None else self.MOVE_MS
+        if easing is None:
+            easing = spec.easing if spec.easing is not None else self.EASING
+        key = (name, duration_ms, easing, self.FRAME_US)
+        compiled = self._gaitCache.get(key)
+        if compiled is None:
+            if len(self._gaitCache) >= 8:
+                self._gaitCache = {}
+            poses = gait_poses(self.joints, self._legs, spec)
+            compiled = CompiledGait(self.pca, self.joints.channel, poses, duration_ms, self.FRAME_US, easing)
+            self._gaitCache[key] = compiled
+        return compiled
+
+    def _streamPhase(self, compiled, phase):
+        ticks = compiled.frames[phase]
+        servos = compiled.channels[phase]
+        m = len(servos)
+        self.updateServoState()
+        sched = self.scheduler
+        sched.period_us = compiled.frame_us
+        sched.start(compiled.duration_us)
+        k = -1
+        while True:
+            if self._should_abort():
+                break
+            t = sched.next_frame()
+            if t < 0:
+                break
+            k = compiled.frame_index(t)
+            self.pca.set_pwm_many(servos, ticks, 0, k * m)
+
+        if self._should_abort():
+            if k >= 0:
+                compiled.pose_at(phase, k, self.joints.current)
+            self.outputsOff()
+            return
+        _copy(self.joints.current, compiled.poses[phase])
+
+    def runGait(self, name, spec, duration_ms=None, easing=None):
+        # One cycle of a GaitSpec from precompiled frames. A phase that does not
+        # start from the previous phase pose (e.g. the first step after center())
+        # is interpolated at run time instead.
+        compiled = self.compileGait(name, spec, duration_ms, easing)
+        current = self.joints.current
+        for i in range(len(compiled.poses)):
+            if self._should_abort():
+                self.outputsOff()
                 return
-            self.dynamicServoAssignment(
-              self.leg0.centerOffsetUpper + order[0]*self.leg0.upperOrientationWRTHead * gait[((i)*2+0)%8], self.leg0.centerOffsetLower + self.leg0.lowerOrientationWRTHead * gait[((i)*2+1)%8],
-              self.leg1.centerOffsetUpper + order[1]*self.leg1.upperOrientationWRTHead * gait[((i+2)*2+0)%8], self.leg1.centerOffsetLower + self.leg1.lowerOrientationWRTHead * gait[((i+2)*2+1)%8],
-              self.leg2.centerOffsetUpper + order[2]*self.leg2.upperOrientationWRTHead * gait[((i)*2+0)%8], self.leg2.centerOffsetLower + self.leg2.lowerOrientationWRTHead * gait[((i)*2+1)%8],
-              self.leg3.centerOffsetUpper + order[3]*self.leg3.upperOrientationWRTHead * gait[((i+2)*2+0)%8], self.leg3.centerOffsetLower + self.leg3.lowerOrientationWRTHead * gait[((i+2)*2+1)%8]
-            )
+            if current == compiled.poses[i - 1]:
+                self._streamPhase(compiled, i)
+            else:
+                self._runMove(compiled.poses[i], compiled.duration_ms, compiled.easing)
 
     def center(self):
-        self.leg0.currentAngleUpper = self.leg0.centerOffsetUpper
-        self.leg0.currentAngleLower = self.leg0.centerOffsetLower
-        self.leg1.currentAngleUpper = self.leg1.centerOffsetUpper
-        self.leg1.currentAngleLower = self.leg1.centerOffsetLower
-        self.leg2.currentAngleLower = self.leg2.centerOffsetLower
-        self.leg2.currentAngleUpper = self.leg2.centerOffsetUpper
-        self.leg3.currentAngleLower = self.leg3.centerOffsetLower
-        self.leg3.currentAngleUpper = self.leg3.centerOffsetUpper
+        _copy(self.joints.current, self.joints.offset)
         self.updateServoState()
         self.pca.all_off()
 
     def stop(self):
-        self.pca.all_off()
+        self.outputsOff()
 
 class Crawler(Robot):
+    # Built-in gait library, used when robot-config.json has no "gaits" section.
+    # Gaits are compiled into frame tables on first use by Robot.runGait.
+    GAITS = {
+        ## UP
+        "forward": GaitSpec([-20, -15, -20, +20, +30, +20, +30, -15]),
+        ## DOWN
+        "backward": GaitSpec([+20, -15, +20, +20, -30, +20, -30, -15]),
+        ## TURN AROUND
+        "rotate_left": GaitSpec([-30, -30, -30, 0, +30, +20, +30, 0], order=(-1.0, -1.0, 1.0, 1.0)),
+        ## TURN AROUND
+        "rotate_right": GaitSpec([-30, -30, -30, 0, +30, +20, +30, 0], order=(1.0, 1.0, -1.0, -1.0)),
+        ## SIDE WALK LEFT
+        "lateral_left": GaitSpec([-30, -30, -30, 0, +30, +20, +30, 0], order=(-1.0, 1.0, -1.0, 1.0)),
+        ## SIDE WALK RIGHT
+        "lateral_right": GaitSpec([-30, -30, -30, 0, +30, +20, +30, 0], order=(1.0, -1.0, 1.0, -1.0)),
+    }
+
+    # Continuous velocity control: each axis of setVelocity() blends the
+    # phase poses of one of these gait pairs (positive, negative).
+    VELOCITY_GAITS = (
+        ("forward", "backward"),
+        ("lateral_left", "lateral_right"),
+        ("rotate_left", "rotate_right"),
+    )
+    VELOCITY_TIMEOUT_MS = 500  # deadman: no setVelocity() for this long means stop
+
     def __init__(self, SDA=17, SCL=18):
         super().__init__(SDA=SDA, SCL=SCL)
+        self.gaits = self.GAITS
+        self._velocity = (0.0, 0.0, 0.0)
+        self._velocityAt = time.ticks_ms()
+        self._drivePhase = 0
+        self._driveSettled = True
+        self._drivePoses = None
+        try:
+            self.loadGaits()
+        except Exception as e:
+            print("WARNING: gaits in config file not loaded, using built-in gaits:", e)
         print("Crawler initialized!")
+
+    def loadGaits(self, path="/sdcard/config/robot-config.json"):
+        # (Re)load the gait library without a reset. The library is swapped in
+        # whole, so a motion in progress finishes with the gait it started with.
+        # Raises on a bad file, or a gait for another number of legs, and keeps
+        # the current gaits.
+        try:
+            gaits = load_gaits(path)
+        except OSError:
+            gaits = None
+        if gaits:
+            for name, spec in gaits.items():
+                if len(spec.order) != len(self._legs):
+                    raise ValueError("gait {}: for {} legs, robot has {}".format(name, len(spec.order), len(self._legs)))
+        self.gaits = gaits if gaits else self.GAITS
+        self.invalidateGaits()
+        return list(self.gaits)
+
+    def invalidateGaits(self):
+        super().invalidateGaits()
+        self._drivePoses = None
+
+    def setVelocity(self, vx, vy, wz):
+        # vx forward, vy left, wz counter-clockwise, each -1..1. Safe to call
+        # from another thread; also refreshes the deadman timer.
+        self._velocity = (constrain(vx, -1.0, 1.0), constrain(vy, -1.0, 1.0), constrain(wz, -1.0, 1.0))
+        self._velocityAt = time.ticks_ms()
+
+    def clearVelocity(self):
+        # Zero velocity without the settling move back to center (e-stop).
+        self._velocity = (0.0, 0.0, 0.0)
+        self._driveSettled = True
+        self._drivePhase = 0
+
+    def velocity(self):
+        if time.ticks_diff(time.ticks_ms(), self._velocityAt) > self.VELOCITY_TIMEOUT_MS:
+            return (0.0, 0.0, 0.0)
+        return self._velocity
+
+    def velocityActive(self):
+        return not self._driveSettled or self.velocity() != (0.0, 0.0, 0.0)
+
+    def _velocityPoses(self):
+        # {gait name: phase poses relative to center} for the VELOCITY_GAITS.
+        if self._drivePoses is None:
+            offset = self.joints.offset
+            poses = {}
+            for pair in self.VELOCITY_GAITS:
+                for name in pair:
+                    spec = self.gaits.get(name)
+                    if spec is None:
+                        continue
+                    deltas = gait_poses(self.joints, self._legs, spec)
+                    for pose in deltas:
+                        for i in range(len(pose)):
+                            pose[i] -= offset[i]
+                    poses[name] = deltas
+            self._drivePoses = poses
+        return self._drivePoses
+
+    def velocityStep(self, duration_ms=None, easing=None):
+        # One gait phase towards the pose blended from the current velocity, so
+        # a change of direction takes effect at the next phase instead of after
+        # a whole cycle. Upper joints scale with speed, the lift of the lower
+        # joints does not. At zero velocity it moves back to center once.
+        # Returns False when there was nothing to do. A velocity no gait can
+        # follow is cleared, so the caller does not keep retrying it.
+        v = self.velocity()
+        joints = self.joints
+        target = joints.target
+        if v == (0.0, 0.0, 0.0):
+            if self._driveSettled:
+                return False
+            self._driveSettled = True
+            self._drivePhase = 0
+            self._runMove(joints.offset, duration_ms, easing)
+            return True
+
+        try:
+            deltas = self._velocityPoses()
+        except:
+            self.clearVelocity()
+            raise
+        blend = []
+        total = 0.0
+        for axis in range(3):
+            a = v[axis]
+            if a == 0:
+                continue
+            poses = deltas.get(self.VELOCITY_GAITS[axis][0 if a > 0 else 1])
+            if poses is None:
+                continue
+            blend.append((poses[self._drivePhase % len(poses)], abs(a)))
+            total += abs(a)
+        if not blend:
+            self.clearVelocity()
+            return False
+        scale = 1.0 if total < 1.0 else 1.0 / total
+        _copy(target, joints.offset)
+        for leg in self._legs:
+            upper = leg.base
+            lower = upper + 1
+            for pose, w in blend:
+                target[upper] += w * scale * pose[upper]
+                target[lower] += w / total * pose[lower]
+        self._driveSettled = False
+        self._drivePhase += 1
+        self._runMove(target, duration_ms, easing)
+        return True
     
-    def command(self, command):
+    def command(self, command, duration_ms=None, easing=None):
+        # duration_ms and easing apply to each gait phase and override the
+        # gait's own timing.
         if command == "stop":
             self.stop()
-        elif command == "forward":
-            ## UP
-            self.twoPhaseGaitPropagation([-20, -15, -20, +20, +30, +20, +30, -15])
-        elif command == "backward":
-            ## DOWN
-            self.twoPhaseGaitPropagation([+20, -15, +20, +20, -30, +20, -30, -15])
-        elif command == "rotate_left":
-            ## TURN AROUND
-            self.twoPhaseGaitPropagation([-30, -30, -30, 0, +30, +20, +30, 0], order=[-1.0, -1.0, 1.0, 1.0])
-        elif command == "rotate_right":
-            ## TURN AROUND
-            self.twoPhaseGaitPropagation([-30, -30, -30, 0, +30, +20, +30, 0], order=[1.0, 1.0, -1.0, -1.0])
-        elif command == "lateral_left":
-            ## SIDE WALK LEFT
-            self.twoPhaseGaitPropagation([-30, -30, -30, 0, +30, +20, +30, 0], order=[-1.0, 1.0, -1.0, 1.0])
-        elif command == "lateral_right":
-            ## SIDE WALK RIGHT
-            self.twoPhaseGaitPropagation([-30, -30, -30, 0, +30, +20, +30, 0], order=[1.0, -1.0, 1.0, -1.0])
+            return
+        spec = self.gaits.get(command)
+        if spec is not None:
+            self.runGait(command, spec, duration_ms, easing)
 
 class Wheeler(Robot):
+    _DRIVE_SERVOS = (0, 1, 4, 5, 6, 7, 10, 11)
+
     def __init__(self, SDA=17, SCL=18):
         super().__init__(SDA=SDA, SCL=SCL)
+        self._driveAngles = [0] * 8
         print("Wheeler initialized!")
     
+    def drive(self, front, back, speed):
+        # steer() and throttle() in a single batched write, ordered as _DRIVE_SERVOS.
+        angles = self._driveAngles
+        angles[0] = front + 45
+        angles[1] = -speed - 10
+        angles[2] = front - 45
+        angles[3] = -speed - 10
+        angles[4] = -back + 45
+        angles[5] = speed - 10
+        angles[6] = speed - 10
+        angles[7] = -back - 45
+        self.pca.set_angles(self._DRIVE_SERVOS, angles)
+
     def throttle(self, speed):
         self.pca.set_angle(1, -speed - 10)
         self.pca.set_angle(5, -speed - 10)
@@ -251,35 +658,25 @@ class Wheeler(Robot):
         if command == "stop":
             self.stop()
         elif command == "forward_straight":
-            self.steer(0, 0)
-            self.throttle(30)
+            self.drive(0, 0, 30)
         elif command == "backward_straight":
-            self.steer(0, 0)
-            self.throttle(-30)
+            self.drive(0, 0, -30)
         elif command == "forward_diagleft":
-            self.steer(30, -30)
-            self.throttle(30)
+            self.drive(30, -30, 30)
         elif command == "forward_diagright":
-            self.steer(-30, 30)
-            self.throttle(30)
+            self.drive(-30, 30, 30)
         elif command == "backward_diagleft":
-            self.steer(30, -30)
-            self.throttle(-30)
+            self.drive(30, -30, -30)
         elif command == "backward_diagright":
-            self.steer(-30, 30)
-            self.throttle(-30)
+            self.drive(-30, 30, -30)
         elif command == "forward_left":
-            self.steer(30, 30)
-            self.throttle(30)
+            self.drive(30, 30, 30)
         elif command == "forward_right":
-            self.steer(-30, -30)
-            self.throttle(30)
+            self.drive(-30, -30, 30)
         elif command == "backward_left":
-            self.steer(30, 30)
-            self.throttle(-30)
+            self.drive(30, 30, -30)
         elif command == "backward_right":
-            self.steer(-30, -30)
-            self.throttle(-30)
+            self.drive(-30, -30, -30)
     
     def nudge(self, command, t=1.0):
         self.command(command)
@@ -0,0 +1,263 @@
+from array import array
+import math
+import time
+
+# Easing curves map move progress s in [0, 1] to position progress in [0, 1].
+
+def linear(s):
+    return s
+
+def cosine(s):
+    return 0.5 - 0.5 * math.cos(math.pi * s)
+
+def minimum_jerk(s):
+    return s * s * s * (10.0 + s * (6.0 * s - 15.0))
+
+_TRAPEZOID_RAMP = 0.25  # share of the move spent accelerating, and again decelerating
+_TRAPEZOID_VMAX = 1.0 / (1.0 - _TRAPEZOID_RAMP)
+
+def trapezoid(s):
+    # Constant acceleration, cruise, constant deceleration.
+    if s < _TRAPEZOID_RAMP:
+        return 0.5 * _TRAPEZOID_VMAX * s * s / _TRAPEZOID_RAMP
+    if s > 1.0 - _TRAPEZOID_RAMP:
+        r = 1.0 - s
+        return 1.0 - 0.5 * _TRAPEZOID_VMAX * r * r / _TRAPEZOID_RAMP
+    return _TRAPEZOID_VMAX * (s - 0.5 * _TRAPEZOID_RAMP)
+
+EASINGS = {
+    "linear": linear,
+    "cosine": cosine,
+    "minimum_jerk": minimum_jerk,
+    "trapezoid": trapezoid,
+}
+
+def get_easing(easing):
+    if callable(easing):
+        return easing
+    try:
+        return EASINGS[easing]
+    except KeyError:
+        raise ValueError("unknown easing: {}".format(easing))
+
+class Trajectory:
+    # Straight-line move of a set of joints from start to target angles over
+    # duration_ms, shaped by an easing curve. sample() is called with the frame
+    # time handed out by FrameScheduler.
+    def __init__(self, start, target, duration_ms, easing="linear"):
+        n = len(start)
+        if len(target) != n:
+            raise ValueError("start and target must have the same length")
+        self.start = array('f', start)
+        self.delta = array('f', bytes(4 * n))
+        for i in range(n):
+            self.delta[i] = target[i] - start[i]
+        self.duration_us = int(duration_ms * 1000)
+        self.ease = get_easing(easing)
+
+    def sample(self, t_us, out):
+        if t_us >= self.duration_us:
+            e = 1.0
+        elif t_us <= 0:
+            e = 0.0
+        else:
+            e = self.ease(t_us / self.duration_us)
+        start = self.start
+        delta = self.delta
+        for i in range(len(start)):
+            out[i] = start[i] + e * delta[i]
+        return out
+
+class FrameScheduler:
+    # Paces a move of a fixed duration against absolute ticks_us deadlines,
+    # one every period_us. When a frame is late (slow bus, GC pause, display
+    # update) the missed deadlines are dropped and the next frame is rendered
+    # at the latest deadline already passed, so the move still ends on time.
+    # With should_abort set, waits are cut into slice_us sleeps and the move
+    # ends as soon as it returns True instead of at the next deadline.
+    def __init__(self, period_us=4000, should_abort=None, slice_us=500):
+        self.period_us = period_us
+        self.should_abort = should_abort
+        self.slice_us = slice_us
+        self.duration_us = 0
+        self._t0 = 0
+        self._next = 0
+        self._done = True
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.moves = 0
+        self.frames = 0        # frames handed out for rendering
+        self.dropped = 0       # deadlines skipped because we were behind
+        self.overruns = 0      # frames that started after their deadline
+        self.max_late_us = 0   # worst lateness seen at a deadline
+        self.last_move_us = 0  # measured length of the last finished move
+        self.aborted = 0       # moves cut short by should_abort
+
+    def start(self, duration_us):
+        self.duration_us = duration_us
+        self._t0 = time.ticks_us()
+        self._next = self.period_us
+        self._done = False
+        self.moves += 1
+
+    def elapsed_us(self):
+        return time.ticks_diff(time.ticks_us(), self._t0)
+
+    def next_frame(self):
+        # Wait for the next deadline and return the move time (0..duration_us)
+        # the frame should show, or -1 once the final frame has been handed out.
+        if self._done:
+            return -1
+        target = self._next
+        late = self.elapsed_us() - target
+        if late < 0:
+            if not self._wait(-late):
+                return -1
+        elif late > 0:
+            self.overruns += 1
+            if late > self.max_late_us:
+                self.max_late_us = late
+            if late >= self.period_us:
+                skip = late // self.period_us
+                target += skip * self.period_us
+                self.dropped += skip
+        if target >= self.duration_us:
+            target = self.duration_us
+            self._done = True
+            self.last_move_us = self.elapsed_us()
+        self._next = target + self.period_us
+        self.frames += 1
+        return target
+
+    def _wait(self, us):
+        # Sleep for us, or until should_abort() says stop. False if aborted.
+        check = self.should_abort
+        if check is None:
+            time.sleep_us(us)
+            return True
+        deadline = time.ticks_add(time.ticks_us(), us)
+        while True:
+            if check():
+                self._done = True
+                self.aborted += 1
+                return False
+            left = time.ticks_diff(deadline, time.ticks_us())
+            if left <= 0:
+                return True
+            time.sleep_us(left if left < self.slice_us else self.slice_us)
+
+    def stats(self):
+        return {
+            "periodUs": self.period_us,
+            "moves": self.moves,
+            "frames": self.frames,
+            "dropped": self.dropped,
+            "overruns": self.overruns,
+            "maxLateUs": self.max_late_us,
+            "lastMoveUs": self.last_move_us,
+            "aborted": self.aborted,
+        }
+
+class CommandQueue:
+    # Fixed-capacity ring buffer of motion commands (cmd, steps, hold,
+    # queued_at), plus a small priority lane that get() always drains first.
+    # A command equal to the newest pending one (same cmd and hold) is merged
+    # into it by adding steps, up to max_steps, so a client repeating a button
+    # grows one entry instead of filling the queue. Not thread-safe: callers
+    # hold their own lock.
+    def __init__(self, capacity=24, max_steps=20, priority_capacity=4):
+        self.max_steps = max_steps
+        self._lanes = (_Ring(priority_capacity), _Ring(capacity))
+        self.coalesced = 0  # puts merged into a pending entry
+        self.replaced = 0   # pending entries dropped by put(replace=True)
+        self.rejected = 0   # puts refused because the lane was full
+
+    def __len__(self):
+        return len(self._lanes[0]) + len(self._lanes[1])
+
+    def put(self, cmd, steps, hold, queued_at, priority=False, replace=False):
+        # Queue a command; False if its lane is full. replace drops whatever
+        # is pending in the lane first, for joystick-style control where only
+        # the latest request matters.
+        ring = self._lanes[0 if priority else 1]
+        if replace:
+            self.replaced += len(ring)
+            ring.clear()
+        if ring.merge(cmd, steps, hold, self.max_steps):
+            self.coalesced += 1
+            return True
+        if not ring.push(cmd, steps, hold, queued_at):
+            self.rejected += 1
+            return False
+        return True
+
+    def get(self):
+        # Oldest priority command, else oldest normal one, else None.
+        for ring in self._lanes:
+            if len(ring):
+                return ring.pop()
+        return None
+
+    def clear(self, priority=True):
+        self._lanes[1].clear()
+        if priority:
+            self._lanes[0].clear()
+
+    def stats(self):
+        return {
+            "len": len(self),
+            "priorityLen": len(self._lanes[0]),
+            "capacity": self._lanes[1].capacity,
+            "coalesced": self.coalesced,
+            "replaced": self.replaced,
+            "rejected": self.rejected,
+        }
+
+class _Ring:
+    # One lane of CommandQueue: parallel preallocated slots, head and count.
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.cmd = [None] * capacity
+        self.steps = [0] * capacity
+        self.hold = [False] * capacity
+        self.queued_at = [0] * capacity
+        self.head = 0
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def clear(self):
+        for i in range(self.capacity):
+            self.cmd[i] = None
+        self.head = 0
+        self.count = 0
+
+    def merge(self, cmd, steps, hold, max_steps):
+        if not self.count:
+            return False
+        i = (self.head + self.count - 1) % self.capacity
+        if self.cmd[i] != cmd or self.hold[i] != hold:
+            return False
+        self.steps[i] = min(max_steps, self.steps[i] + steps)
+        return True
+
+    def push(self, cmd, steps, hold, queued_at):
+        if self.count == self.capacity:
+            return False
+        i = (self.head + self.count) % self.capacity
+        self.cmd[i] = cmd
+        self.steps[i] = steps
+        self.hold[i] = hold
+        self.queued_at[i] = queued_at
+        self.count += 1
+        return True
+
+    def pop(self):
+        i = self.head
+        item = (self.cmd[i], self.steps[i], self.hold[i], self.queued_at[i])
+        self.cmd[i] = None
+        self.head = (i + 1) % self.capacity
+        self.count -= 1
+        return item
@@ -8,6 +8,14 @@ from   re      import match
 import socket
 import gc
 
+try :
+    import asyncio
+except :
+    try :
+        import uasyncio as asyncio
+    except :
+        asyncio = None
+
 class MicroDNSSrv :
 
     # ============================================================================
@@ -116,9 +124,11 @@ class MicroDNSSrv :
     # ===( Constructor )==========================================================
     # ============================================================================
 
-    def __init__(self) :
-        self._domList = { }
-        self._started = False
+    def __init__(self, port=53) :
+        self._domList    = { }
+        self._started    = False
+        self._port       = port
+        self.AsyncPollMs = 50   # StartAsync: recvfrom() retry period
 
     # ============================================================================
     # ===( Server Thread )========================================================
@@ -129,46 +139,84 @@ class MicroDNSSrv :
         while True :
             try :
                 packet, cliAddr = self._server.recvfrom(256)
-                domName = MicroDNSSrv._getAskedDomainName(packet)
-                if domName :
-                    domName = domName.lower()
-                    ipB = self._domList.get(domName, None)
-                    if not ipB :
-                        for domChk in self._domList.keys() :
-                            if domChk.find('*') >= 0 :
-                                r = domChk.replace('.', '\.').replace('*', '.*') + '$'
-                                if match(r, domName) :
-                                    ipB = self._domList.get(domChk, None)
-                                    break
-                        if not ipB :
-                            ipB = self._domList.get('*', None)
-                    if ipB :
-                        packet = MicroDNSSrv._getPacketAnswerA(packet, ipB)
-                        if packet :
-                            self._server.sendto(packet, cliAddr)
+                self._answer(packet, cliAddr)
             except :
                 if not self._started :
                     break
 
+    # ----------------------------------------------------------------------------
+
+    async def _serverProcessAsync(self) :
+        # UDP has no stream in uasyncio: poll the non-blocking socket.
+        while self._started :
+            try :
+                packet, cliAddr = self._server.recvfrom(256)
+            except :
+                await asyncio.sleep(self.AsyncPollMs / 1000)
+                continue
+            try :
+                self._answer(packet, cliAddr)
+            except :
+                pass
+
+    # ----------------------------------------------------------------------------
+
+    def _answer(self, packet, cliAddr) :
+        domName = MicroDNSSrv._getAskedDomainName(packet)
+        if domName :
+            domName = domName.lower()
+            ipB = self._domList.get(domName, None)
+            if not ipB :
+                for domChk in self._domList.keys() :
+                    if domChk.find('*') >= 0 :
+                        r = domChk.replace('.', '\.').replace('*', '.*') + '$'
+                        if match(r, domName) :
+                            ipB = self._domList.get(domChk, None)
+                            break
+                if not ipB :
+                    ipB = self._domList.get('*', None)
+            if ipB :
+                packet = MicroDNSSrv._getPacketAnswerA(packet, ipB)
+                if packet :
+                    self._server.sendto(packet, cliAddr)
+
     # ============================================================================
     # ===( Functions )============================================================
     # ============================================================================
 
     def Start(self) :
         if not self._started :
-            self._server = socket.socket( socket.AF_INET,
-                                          socket.SOCK_DGRAM,
-                                          socket.IPPROTO_UDP )
-            self._server.setsockopt( socket.SOL_SOCKET,
-                                     socket.SO_REUSEADDR,
-                                     1 )
-            self._server.bind(('0.0.0.0', 53))
+            self._bind()
             self._server.setblocking(True)
             return MicroDNSSrv._tryStartThread(self._serverProcess)
         return False
 
     # ----------------------------------------------------------------------------
 
+    async def StartAsync(self) :
+        # Answer from a task on the running asyncio / uasyncio event loop
+        # instead of a thread.
+        if not self._started and asyncio :
+            self._bind()
+            self._server.setblocking(False)
+            self._started = True
+            self._task    = asyncio.create_task(self._serverProcessAsync())
+            return True
+        return False
+
+    # ----------------------------------------------------------------------------
+
+    def _bind(self) :
+        self._server = socket.socket( socket.AF_INET,
+                                      socket.SOCK_DGRAM,
+                                      socket.IPPROTO_UDP )
+        self._server.setsockopt( socket.SOL_SOCKET,
+                                 socket.SO_REUSEADDR,
+                                 1 )
+        self._server.bind(('0.0.0.0', self._port))
+
+    # ----------------------------------------------------------------------------
+
     def Stop(self) :
         if self._started :
             self._started = False
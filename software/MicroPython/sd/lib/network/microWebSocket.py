@@ -9,6 +9,14 @@ from   struct      import pack
 from   _thread     import start_new_thread, allocate_lock
 import gc
 
+try :
+    import asyncio
+except :
+    try :
+        import uasyncio as asyncio
+    except :
+        asyncio = None
+
 class MicroWebSocket :
 
     # ============================================================================
@@ -67,11 +75,13 @@ class MicroWebSocket :
     # ===( Constructor )==========================================================
     # ============================================================================
 
-    def __init__(self, socket, httpClient, httpResponse, maxRecvLen, threaded, acceptCallback) :
+    def __init__(self, socket, httpClient, httpResponse, maxRecvLen, threaded, acceptCallback, asyncMode=False) :
         self._socket            = socket
         self._httpCli           = httpClient
         self._closed            = True
         self._lock              = allocate_lock()
+        self._async             = False   # served by the event loop
+        self._wakeSender        = None
         self.RecvTextCallback   = None
         self.RecvBinaryCallback = None
         self.ClosedCallback     = None
@@ -87,6 +97,11 @@ class MicroWebSocket :
             if self._ctrlBuf and self._msgBuf :
                 self._msgType = None
                 self._msgLen  = 0
+                if asyncMode :
+                    # Frames are written to the server's stream; the event
+                    # loop sends them from _wsProcessAsync().
+                    self._async = True
+                    return
                 if threaded :
                     if MicroWebSocket._tryStartThread(self._wsProcess, (acceptCallback, )) :
                         return
@@ -144,17 +159,10 @@ class MicroWebSocket :
             if not b or len(b) != 2 :
                 return False
 
-            fin    = b[0] & 0x80 > 0
-            opcode = b[0] & 0x0F
-            masked = b[1] & 0x80 > 0
-            length = b[1] & 0x7F
-
-            if opcode == self._opContFrame and not self._msgType :
+            frame = self._frameStart(b)
+            if not frame :
                 return False
-            elif opcode == self._opTextFrame :
-                self._msgType = self._msgTypeText
-            elif opcode == self._opBinFrame :
-                self._msgType = self._msgTypeBin
+            fin, opcode, masked, length = frame
 
             if length == 0x7E :
                 b = self._socketfile.read(2)
@@ -168,56 +176,162 @@ class MicroWebSocket :
             if masked and (not mask or len(mask) != 4) :
                 return False
 
-            if opcode == self._opContFrame or \
-               opcode == self._opTextFrame or \
-               opcode == self._opBinFrame :
-
-                if length > 0 :
-                    buf = memoryview(self._msgBuf)[self._msgLen:]
-                    if length > len(buf) :
-                        return False
-                    x = self._socketfile.readinto(buf[0:length])
-                    if x != length :
-                        return False
-                    if masked :
-                        for i in range(length) :
-                            idx = self._msgLen + i
-                            self._msgBuf[idx] ^= mask[i%4]
-                    self._msgLen += length
-                    if fin :
-                        b = bytes(memoryview(self._msgBuf)[:self._msgLen])
-                        if self._msgType == self._msgTypeText :
-                            if self.RecvTextCallback :
-                                try :
-                                    self.RecvTextCallback(self, b.decode())
-                                except Exception as ex :
-                                    print("MicroWebSocket : Error on recv text callback (%s)." % str(ex))
-                        else :
-                            if self.RecvBinaryCallback :
-                                try :
-                                    self.RecvBinaryCallback(self, b)
-                                except Exception as ex :
-                                    print("MicroWebSocket : Error on recv binary callback (%s)." % str(ex))
-                        self._msgType = None
-                        self._msgLen  = 0
-                else :
+            buf = self._framePayload(opcode, length)
+            if buf is False :
+                return False
+            if buf is not None and length > 0 :
+                x = self._socketfile.readinto(buf)
+                if x != length :
                     return False
+            self._frameEnd(fin, opcode, mask, length)
 
-            elif opcode == self._opPingFrame :
+        except :
+            return False
 
-                if length > len(self._ctrlBuf) :
-                    return False
-                if length > 0 :
-                    x = self._socketfile.readinto(self._ctrlBuf[0:length])
-                    if x != length :
-                        return False
-                    pingData = memoryview(self._ctrlBuf)[:length]
+        return True
+
+    # ----------------------------------------------------------------------------
+
+    def _frameStart(self, b) :
+        # (fin, opcode, masked, length) from the first two bytes of a frame,
+        # None if a continuation frame has nothing to continue.
+        fin    = b[0] & 0x80 > 0
+        opcode = b[0] & 0x0F
+        masked = b[1] & 0x80 > 0
+        length = b[1] & 0x7F
+
+        if opcode == self._opContFrame and not self._msgType :
+            return None
+        elif opcode == self._opTextFrame :
+            self._msgType = self._msgTypeText
+        elif opcode == self._opBinFrame :
+            self._msgType = self._msgTypeBin
+        return (fin, opcode, masked, length)
+
+    # ----------------------------------------------------------------------------
+
+    def _framePayload(self, opcode, length) :
+        # Buffer the payload is read into; None if it is not read, False if
+        # it does not fit.
+        if opcode == self._opContFrame or \
+           opcode == self._opTextFrame or \
+           opcode == self._opBinFrame :
+            buf = memoryview(self._msgBuf)[self._msgLen:]
+            if length == 0 or length > len(buf) :
+                return False
+            return buf[0:length]
+        elif opcode == self._opPingFrame :
+            if length > len(self._ctrlBuf) :
+                return False
+            return memoryview(self._ctrlBuf)[:length]
+        return None
+
+    # ----------------------------------------------------------------------------
+
+    def _frameEnd(self, fin, opcode, mask, length) :
+        if opcode == self._opContFrame or \
+           opcode == self._opTextFrame or \
+           opcode == self._opBinFrame :
+
+            if mask :
+                for i in range(length) :
+                    idx = self._msgLen + i
+                    self._msgBuf[idx] ^= mask[i%4]
+            self._msgLen += length
+            if fin :
+                b = bytes(memoryview(self._msgBuf)[:self._msgLen])
+                if self._msgType == self._msgTypeText :
+                    if self.RecvTextCallback :
+                        try :
+                            self.RecvTextCallback(self, b.decode())
+                        except Exception as ex :
+                            print("MicroWebSocket : Error on recv text callback (%s)." % str(ex))
                 else :
-                    pingData = None
-                self._sendFrame(self._opPongFrame, pingData)
+                    if self.RecvBinaryCallback :
+                        try :
+                            self.RecvBinaryCallback(self, b)
+                        except Exception as ex :
+                            print("MicroWebSocket : Error on recv binary callback (%s)." % str(ex))
+                self._msgType = None
+                self._msgLen  = 0
+
+        elif opcode == self._opPingFrame :
+
+            if length > 0 :
+                if mask :
+                    for i in range(length) :
+                        self._ctrlBuf[i] ^= mask[i%4]
+                pingData = memoryview(self._ctrlBuf)[:length]
+            else :
+                pingData = None
+            self._sendFrame(self._opPongFrame, pingData)
+
+        elif opcode == self._opCloseFrame :
+            self.Close()
+
+    # ============================================================================
+    # ===( Event Loop )===========================================================
+    # ============================================================================
+
+    @staticmethod
+    def _asyncWake() :
+        # (wake, wait): wait() returns once wake() has been called since it
+        # last returned. wake() may be called from any thread.
+        if hasattr(asyncio, 'ThreadSafeFlag') :   # MicroPython
+            flag = asyncio.ThreadSafeFlag()
+            return flag.set, flag.wait
+        loop  = asyncio.get_running_loop()
+        event = asyncio.Event()
+        async def wait() :
+            await event.wait()
+            event.clear()
+        return (lambda : loop.call_soon_threadsafe(event.set)), wait
+
+    # ----------------------------------------------------------------------------
 
-            elif opcode == self._opCloseFrame :
+    async def _wsProcessAsync(self, acceptCallback, reader, writer) :
+        self._closed = False
+        self._wakeSender, waitSender = MicroWebSocket._asyncWake()
+        try :
+            acceptCallback(self, self._httpCli)
+        except Exception as ex :
+            print("MicroWebSocket : Error on accept callback (%s)." % str(ex))
+        sender = asyncio.create_task(self._sendAsync(writer, waitSender))
+        while not self._closed :
+            if not await self._receiveFrameAsync(reader) :
                 self.Close()
+            # Replies from the callbacks go out now, not on the next tick.
+            self._writeAsync(writer)
+        await sender
+        if self.ClosedCallback :
+            try :
+                self.ClosedCallback(self)
+            except Exception as ex :
+                print("MicroWebSocket : Error on closed callback (%s)." % str(ex))
+
+    # ----------------------------------------------------------------------------
+
+    async def _receiveFrameAsync(self, reader) :
+        try :
+            frame = self._frameStart(await reader.readexactly(2))
+            if not frame :
+                return False
+            fin, opcode, masked, length = frame
+
+            if length == 0x7E :
+                b      = await reader.readexactly(2)
+                length = (b[0] << 8) + b[1]
+            elif length == 0x7F :
+                return False
+
+            mask = (await reader.readexactly(4)) if masked else None
+
+            buf = self._framePayload(opcode, length)
+            if buf is False :
+                return False
+            if buf is not None and length > 0 :
+                buf[:] = await reader.readexactly(length)
+            self._frameEnd(fin, opcode, mask, length)
 
         except :
             return False
@@ -226,6 +340,38 @@ class MicroWebSocket :
 
     # ----------------------------------------------------------------------------
 
+    def _writeAsync(self, writer) :
+        # Hands the frames queued by the stream to the writer; True if any.
+        stream = self._socketfile
+        self._lock.acquire()
+        out         = stream._out
+        stream._out = [ ]
+        self._lock.release()
+        for data in out :
+            writer.write(data)
+        return len(out) > 0
+
+    # ----------------------------------------------------------------------------
+
+    async def _sendAsync(self, writer, wait) :
+        # Frames may be sent from callbacks on the loop or from other
+        # threads; they are queued by the stream, and _sendFrame() and Close()
+        # wake this task to write them out.
+        while True :
+            closed = self._closed
+            try :
+                if self._writeAsync(writer) or closed :
+                    await writer.drain()
+                if closed :
+                    writer.close()
+                    break
+                await wait()
+            except :
+                self._closed = True
+                break
+
+    # ----------------------------------------------------------------------------
+
     def _sendFrame(self, opcode, data=None, fin=True) :
         if not self._closed and opcode >= 0x00 and opcode <= 0x0F :
             dataLen = 0 if not data else len(data)
@@ -244,6 +390,8 @@ class MicroWebSocket :
                         if self._socketfile is not self._socket :
                             self._socketfile.flush()   # CPython needs flush to continue protocol
                         self._lock.release()
+                        if self._wakeSender :
+                            self._wakeSender()
                         return ret
                 except :
                     pass
@@ -277,6 +425,8 @@ class MicroWebSocket :
                 self._closed = True
             except :
                 pass
+            if self._wakeSender :
+                self._wakeSender()
 
     # ============================================================================
     # ============================================================================
@@ -6,11 +6,24 @@ Copyright © 2018 Jean-Christophe Bos & HC² (www.hc2.fr)
 
 from    json        import loads, dumps
 from    os          import stat
-from    _thread     import start_new_thread
+from    _thread     import start_new_thread, allocate_lock
 import  socket
 import  gc
 import  re
 
+try :
+    from select import poll, POLLIN
+except :
+    pass
+
+try :
+    import asyncio
+except :
+    try :
+        import uasyncio as asyncio
+    except :
+        asyncio = None
+
 try :
     from microWebTemplate import MicroWebTemplate
 except :
@@ -19,7 +32,10 @@ except :
 try :
     from microWebSocket import MicroWebSocket
 except :
-    pass
+    try :
+        from .microWebSocket import MicroWebSocket
+    except :
+        pass
 
 class MicroWebSrvRoute :
     def __init__(self, route, method, func, routeArgNames, routeRegex) :
@@ -180,9 +196,44 @@ class MicroWebSrv :
         self.WebSocketThreaded          = True
         self.AcceptWebSocketCallback    = None
         self.LetCacheStaticContentLevel = 2
+        self.GzipStaticContent          = True   # serve file.gz for file when accepted
+
+        # HTTP/1.1 persistent connections. An idle connection is closed after
+        # KeepAliveTimeout seconds, or as soon as another connection is
+        # waiting to be accepted; KeepAliveMaxRequests caps each connection.
+        self.KeepAlive                  = True
+        self.KeepAliveTimeout           = 5
+        self.KeepAliveMaxRequests       = 100
+        self.MaxDrainContentLen         = 4096
+
+        # Connection handling. With WorkerThreads 0 every connection is served
+        # on the accepting thread, one after the other. Otherwise accepted
+        # connections queue (up to MaxQueuedConns, then 503) for a pool of
+        # that many threads, and requests for FastLanePaths go to a thread of
+        # their own, so a slow client or handler can't hold them up. The
+        # accepting thread waits at most FastLanePeekMs for a request line to
+        # pick the lane; one not complete by then goes to the pool.
+        self.WorkerThreads              = 0
+        self.MaxQueuedConns             = 8
+        self.FastLanePaths              = ( )
+        self.FastLanePeekMs             = 5
+        self._pool                      = None
+        self._fastLane                  = None
+
+        # Event loop mode (StartAsync): a request's head and body are read
+        # ahead into memory, up to MaxAsyncContentLen bytes of body (beyond
+        # that, 413), then the handler runs and the response is sent.
+        self.MaxAsyncContentLen         = 8192
+        self.MaxAsyncHeadLen            = 2048
+        self._asyncServer               = None
 
         self._routeHandlers = []
-        routeHandlers += self._docoratedRouteHandlers
+        # Routes without <args> are looked up by method then literal path;
+        # only the others go through their regex, in registration order.
+        self._literalRoutes = { }
+        self._regexRoutes   = [ ]
+        self._routePrefixes = set()
+        routeHandlers = routeHandlers + self._docoratedRouteHandlers
         for route, method, func in routeHandlers :
             routeParts = route.split('/')
             # -> ['', 'users', '<uID>', 'addresses', '<addrID>', 'test', '<anotherID>']
@@ -198,7 +249,45 @@ class MicroWebSrv :
             # -> '/users/(\w*)/addresses/(\w*)/test/(\w*)$'
             routeRegex = re.compile(routeRegex)
 
-            self._routeHandlers.append(MicroWebSrvRoute(route, method, func, routeArgNames, routeRegex))
+            rh = MicroWebSrvRoute(route, method, func, routeArgNames, routeRegex)
+            self._addRouteLookup(rh, len(self._routeHandlers))
+            self._routeHandlers.append(rh)
+
+    # ----------------------------------------------------------------------------
+
+    def _addRouteLookup(self, rh, index) :
+        path = '/'.join(s for s in rh.route.split('/') if s)
+        path = '/' + path if path else ''
+        # First path segment, for the "no route can match" check. None once a
+        # route may match anything.
+        if self._routePrefixes is not None :
+            first = MicroWebSrv._firstSegment(path)
+            if first.startswith('/<') or MicroWebSrv._hasRegexChars(first) :
+                self._routePrefixes = None
+            else :
+                self._routePrefixes.add(first)
+        if rh.routeArgNames or MicroWebSrv._hasRegexChars(path) :
+            self._regexRoutes.append((index, rh))
+        else :
+            byPath = self._literalRoutes.setdefault(rh.method, { })
+            if path not in byPath :
+                byPath[path] = (index, rh)
+
+    # ----------------------------------------------------------------------------
+
+    @staticmethod
+    def _firstSegment(path) :
+        i = path.find('/', 1)
+        return path[:i] if i > 0 else path
+
+    # ----------------------------------------------------------------------------
+
+    @staticmethod
+    def _hasRegexChars(path) :
+        for c in path :
+            if c in '.^$*+?{}[]\\|()' :
+                return True
+        return False
 
     # ============================================================================
     # ===( Server Process )=======================================================
@@ -206,6 +295,10 @@ class MicroWebSrv :
 
     def _serverProcess(self) :
         self._started = True
+        if self.WorkerThreads > 0 and self._pool is None :
+            self._pool = MicroWebSrv._lane(self, self.WorkerThreads, self.MaxQueuedConns, True)
+            if self.FastLanePaths :
+                self._fastLane = MicroWebSrv._lane(self, 1, self.MaxQueuedConns, False)
         while True :
             try :
                 client, cliAddr = self._server.accept()
@@ -213,9 +306,149 @@ class MicroWebSrv :
                 if ex.args and ex.args[0] == 113 :
                     break
                 continue
-            self._client(self, client, cliAddr)
+            if self._pool :
+                self._dispatch(client, cliAddr)
+            else :
+                self._client(self, client, cliAddr)
         self._started = False
 
+    # ----------------------------------------------------------------------------
+
+    def _dispatch(self, client, cliAddr) :
+        # Pick a lane from the request line when there is a fast lane; what
+        # was read of it is handed on with the socket file that read it.
+        firstLine  = None
+        socketfile = None
+        lane       = self._pool
+        if self._fastLane and MicroWebSrv._readable(client, self.FastLanePeekMs) :
+            try :
+                firstLine, socketfile = MicroWebSrv._readArrivedLine(client)
+                if firstLine and firstLine.endswith(b'\n') :
+                    path = firstLine.split()[1].split(b'?', 1)[0].decode()
+                    if len(path) > 1 and path.endswith('/') :
+                        path = path[:-1]
+                    if path in self.FastLanePaths :
+                        lane = self._fastLane
+            except :
+                pass
+        if not lane.put((client, cliAddr, firstLine, socketfile)) :
+            try :
+                client.send(b"HTTP/1.1 503 Service Unavailable\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+                if socketfile is not None and socketfile is not client :
+                    socketfile.close()
+                client.close()
+            except :
+                pass
+
+    # ----------------------------------------------------------------------------
+
+    @staticmethod
+    def _readArrivedLine(sock) :
+        # Reads what has arrived of the first line without waiting for more.
+        # MicroPython's readline returns the partial line of a non-blocking
+        # socket; CPython's socket file would drop it, so there the line is
+        # only read once a peek shows it complete.
+        sock.settimeout(0)
+        try :
+            if hasattr(sock, 'readline') :   # MicroPython
+                return sock.readline(), sock
+            socketfile = sock.makefile('rwb')
+            if b'\n' not in sock.recv(1024, socket.MSG_PEEK) :
+                return None, socketfile
+            sock.settimeout(2)
+            return socketfile.readline(), socketfile
+        finally :
+            sock.settimeout(2)
+
+    # ----------------------------------------------------------------------------
+
+    @staticmethod
+    def _readable(sock, timeoutMs) :
+        try :
+            p = poll()
+            p.register(sock, POLLIN)
+            return len(p.poll(timeoutMs)) > 0
+        except :
+            return True
+
+    # ============================================================================
+    # ===( Event Loop )===========================================================
+    # ============================================================================
+
+    async def _asyncClient(self, reader, writer) :
+        stream   = MicroWebSrv._asyncStream()
+        client   = MicroWebSrv._client(self, stream, writer.get_extra_info('peername'))
+        upgraded = None
+        try :
+            timeout = 2
+            while await self._asyncReadRequest(reader, writer, stream, timeout) :
+                client._requests += 1
+                keep = client._processRequest()
+                await stream._send(writer)
+                if keep is None :
+                    upgraded = client._upgraded
+                    break
+                if not keep :
+                    break
+                client._resetRequest()
+                timeout = self.KeepAliveTimeout
+            if upgraded :
+                await upgraded._wsProcessAsync(self.AcceptWebSocketCallback, reader, writer)
+        except :
+            pass
+        try :
+            writer.close()
+            await writer.wait_closed()
+        except :
+            pass
+
+    # ----------------------------------------------------------------------------
+
+    async def _asyncReadHead(self, reader, head) :
+        # Request line and headers into head; the content length, or -1.
+        size = 0
+        contentLength = 0
+        while True :
+            line = await reader.readline()
+            if not line :
+                return -1
+            size += len(line)
+            if size > self.MaxAsyncHeadLen :
+                return -1
+            if line == b'\r\n' or line == b'\n' :
+                if head :
+                    return contentLength
+                continue
+            if line[:15].lower() == b'content-length:' :
+                try :
+                    contentLength = int(line[15:])
+                except :
+                    return -1
+            head.append(line)
+
+    # ----------------------------------------------------------------------------
+
+    async def _asyncReadRequest(self, reader, writer, stream, timeout) :
+        # Reads the next request (head, then body) into stream. False on
+        # timeout, closed connection or a request too large to buffer.
+        head = [ ]
+        contentLength = await asyncio.wait_for(self._asyncReadHead(reader, head), timeout)
+        if contentLength < 0 :
+            return False
+        if contentLength > self.MaxAsyncContentLen :
+            writer.write(b"HTTP/1.1 413 Request Entity Too Large\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+            await writer.drain()
+            return False
+        head.append(b'\r\n')
+        while contentLength > 0 :
+            data = await asyncio.wait_for(reader.read(min(contentLength, 1024)), 2)
+            if not data :
+                return False
+            head.append(data)
+            contentLength -= len(data)
+        stream._feed(b''.join(head))
+        return True
+
     # ============================================================================
     # ===( Functions )============================================================
     # ============================================================================
@@ -235,8 +468,26 @@ class MicroWebSrv :
 
     # ----------------------------------------------------------------------------
 
+    async def StartAsync(self) :
+        # Serve from the running asyncio / uasyncio event loop: no thread per
+        # server or per WebSocket. Handlers are called as usual, on the loop,
+        # so they must not block.
+        if not self._started and asyncio :
+            self._asyncServer = await asyncio.start_server( self._asyncClient,
+                                                            self._srvAddr[0],
+                                                            self._srvAddr[1] )
+            self._started = True
+            return True
+        return False
+
+    # ----------------------------------------------------------------------------
+
     def Stop(self) :
-        if self._started :
+        if self._asyncServer :
+            self._asyncServer.close()
+            self._asyncServer = None
+            self._started     = False
+        elif self._started :
             self._server.close()
 
     # ----------------------------------------------------------------------------
@@ -246,6 +497,25 @@ class MicroWebSrv :
 
     # ----------------------------------------------------------------------------
 
+    def GetStats(self) :
+        # Connection queue metrics; None when serving inline (WorkerThreads 0).
+        pool = self._pool
+        if not pool :
+            return None
+        fast = self._fastLane
+        return {
+            "workers"    : pool.threads,
+            "busy"       : pool.busy,
+            "queued"     : pool.queued(),
+            "maxQueued"  : pool.maxQueued,
+            "rejected"   : pool.rejected,
+            "served"     : pool.served,
+            "fastQueued" : fast.queued() if fast else 0,
+            "fastServed" : fast.served if fast else 0
+        }
+
+    # ----------------------------------------------------------------------------
+
     def SetNotFoundPageUrl(self, url=None) :
         self._notFoundUrl = url
 
@@ -265,8 +535,18 @@ class MicroWebSrv :
             #resUrl = resUrl.upper()
             if resUrl.endswith('/') :
                 resUrl = resUrl[:-1]
+            prefixes = self._routePrefixes
+            if prefixes is not None and MicroWebSrv._firstSegment(resUrl) not in prefixes :
+                return (None, None)
             method = method.upper()
-            for rh in self._routeHandlers :
+            byPath = self._literalRoutes.get(method, None)
+            hit    = byPath.get(resUrl, None) if byPath else None
+            # A regex route registered before the literal hit still wins, as
+            # it did when every route was scanned in order.
+            last = hit[0] if hit else len(self._routeHandlers)
+            for index, rh in self._regexRoutes :
+                if index > last :
+                    break
                 if rh.method == method :
                     m = rh.routeRegex.match(resUrl)
                     if m :   # found matching route?
@@ -282,6 +562,8 @@ class MicroWebSrv :
                             return (rh.func, routeArgs)
                         else :
                             return (rh.func, None)
+            if hit :
+                return (hit[1].func, None)
         return (None, None)
 
     # ----------------------------------------------------------------------------
@@ -298,6 +580,178 @@ class MicroWebSrv :
                 return physPath
         return None
 
+    # ============================================================================
+    # ===( Class Async Stream  )==================================================
+    # ============================================================================
+
+    class _asyncStream :
+
+        # Stands in for the socket of a connection served by the event loop:
+        # reads come from the request read ahead, writes are kept until the
+        # handler returns. A file response is only noted, then sent in chunks.
+
+        # ------------------------------------------------------------------------
+
+        def __init__(self) :
+            self._in   = b''
+            self._pos  = 0
+            self._out  = [ ]
+            self._file = None
+
+        # ------------------------------------------------------------------------
+
+        def _feed(self, data) :
+            self._in  = data
+            self._pos = 0
+
+        # ------------------------------------------------------------------------
+
+        async def _send(self, writer) :
+            out       = self._out
+            self._out = [ ]
+            for data in out :
+                writer.write(data)
+            await writer.drain()
+            filepath   = self._file
+            self._file = None
+            if filepath :
+                with open(filepath, 'rb') as file :
+                    while True :
+                        data = file.read(1024)
+                        if not data :
+                            break
+                        writer.write(data)
+                        await writer.drain()
+
+        # ------------------------------------------------------------------------
+
+        def readline(self) :
+            end = self._in.find(b'\n', self._pos)
+            end = len(self._in) if end < 0 else end + 1
+            data      = self._in[self._pos:end]
+            self._pos = end
+            return data
+
+        # ------------------------------------------------------------------------
+
+        def read(self, size=-1) :
+            end = len(self._in) if size < 0 else min(self._pos + size, len(self._in))
+            data      = self._in[self._pos:end]
+            self._pos = end
+            return data
+
+        # ------------------------------------------------------------------------
+
+        def readinto(self, buf) :
+            data   = self.read(len(buf))
+            n      = len(data)
+            buf[:n] = data
+            return n
+
+        # ------------------------------------------------------------------------
+
+        def write(self, data) :
+            self._out.append(bytes(data))
+            return len(data)
+
+        # ------------------------------------------------------------------------
+
+        def settimeout(self, timeout) :
+            pass
+
+        # ------------------------------------------------------------------------
+
+        def close(self) :
+            pass
+
+    # ============================================================================
+    # ===( Class Lane  )==========================================================
+    # ============================================================================
+
+    class _lane :
+
+        # Bounded FIFO of accepted connections and the threads serving them.
+
+        # ------------------------------------------------------------------------
+
+        def __init__(self, microWebSrv, threads, capacity, keepAlive) :
+            self._microWebSrv = microWebSrv
+            self._lock        = allocate_lock()
+            self._items       = [None] * capacity
+            self._head        = 0
+            self._count       = 0
+            self._idle        = [ ]   # wake locks of the workers waiting for work
+            self.keepAlive    = keepAlive
+            self.threads      = 0
+            self.busy         = 0
+            self.maxQueued    = 0
+            self.rejected     = 0
+            self.served       = 0
+            for i in range(threads) :
+                if MicroWebSrv._startThread(self._worker) :
+                    self.threads += 1
+
+        # ------------------------------------------------------------------------
+
+        def queued(self) :
+            return self._count
+
+        # ------------------------------------------------------------------------
+
+        def put(self, item) :
+            wake = None
+            self._lock.acquire()
+            try :
+                capacity = len(self._items)
+                if self._count == capacity :
+                    self.rejected += 1
+                    return False
+                self._items[(self._head + self._count) % capacity] = item
+                self._count += 1
+                if self._count > self.maxQueued :
+                    self.maxQueued = self._count
+                if self._idle :
+                    wake = self._idle.pop()
+            finally :
+                self._lock.release()
+            if wake :
+                wake.release()
+            return True
+
+        # ------------------------------------------------------------------------
+
+        def _worker(self) :
+            # A worker's wake lock is held while it is in _idle; put() releases
+            # it to hand the worker a connection.
+            wake = allocate_lock()
+            wake.acquire()
+            while True :
+                item = None
+                self._lock.acquire()
+                try :
+                    if self._count :
+                        item = self._items[self._head]
+                        self._items[self._head] = None
+                        self._head   = (self._head + 1) % len(self._items)
+                        self._count -= 1
+                        self.busy   += 1
+                    else :
+                        self._idle.append(wake)
+                finally :
+                    self._lock.release()
+                if item is None :
+                    wake.acquire()
+                    continue
+                try :
+                    client, cliAddr, firstLine, socketfile = item
+                    self._microWebSrv._client(self._microWebSrv, client, cliAddr, self, firstLine, socketfile)
+                except :
+                    pass
+                self._lock.acquire()
+                self.busy   -= 1
+                self.served += 1
+                self._lock.release()
+
     # ============================================================================
     # ===( Class Client  )========================================================
     # ============================================================================
@@ -306,11 +760,47 @@ class MicroWebSrv :
 
         # ------------------------------------------------------------------------
 
-        def __init__(self, microWebSrv, socket, addr) :
+        def __init__(self, microWebSrv, socket, addr, lane=None, firstLine=None, socketfile=None) :
             socket.settimeout(2)
             self._microWebSrv   = microWebSrv
             self._socket        = socket
             self._addr          = addr
+            self._lane          = lane
+            self._firstLine     = firstLine   # what _dispatch read of the first line
+            self._async         = isinstance(socket, MicroWebSrv._asyncStream)
+            self._upgraded      = None
+            self._requests      = 0
+            self._keepAlive     = False
+            self._resetRequest()
+            
+            if socketfile is not None :
+                self._socketfile = socketfile
+            elif hasattr(socket, 'readline'):   # MicroPython
+                self._socketfile = self._socket
+            else:   # CPython
+                self._socketfile = self._socket.makefile('rwb')
+
+            if self._async :
+                return   # the event loop feeds it requests (_asyncClient)
+                        
+            while True :
+                self._requests += 1
+                keep = self._processRequest()
+                if keep is None :   # now owned by a WebSocket
+                    return
+                if not keep or not self._waitNextRequest() :
+                    break
+                self._resetRequest()
+            try :
+                if self._socketfile is not self._socket:
+                    self._socketfile.close()
+                self._socket.close()
+            except :
+                pass
+
+        # ------------------------------------------------------------------------
+
+        def _resetRequest(self) :
             self._method        = None
             self._path          = None
             self._httpVer       = None
@@ -320,21 +810,90 @@ class MicroWebSrv :
             self._headers       = { }
             self._contentType   = None
             self._contentLength = 0
-            
-            if hasattr(socket, 'readline'):   # MicroPython
-                self._socketfile = self._socket
-            else:   # CPython
-                self._socketfile = self._socket.makefile('rwb')
-                        
-            self._processRequest()
+            self._contentRead   = 0
+            self._responded     = False
+
+        # ------------------------------------------------------------------------
+
+        def _waitNextRequest(self) :
+            # Idle between keep-alive requests. True once the next request is
+            # arriving; False on timeout, or when another connection is
+            # waiting for this thread: an idle connection must not hold the
+            # others up. A request already sent (pipelined) wins.
+            srv  = self._microWebSrv
+            lane = self._lane
+            if self._socketfile is not self._socket :
+                # CPython: requests may sit in the file's buffer, let the next
+                # readline wait for them.
+                self._socket.settimeout(srv.KeepAliveTimeout)
+                return True
+            try :
+                p = poll()
+                p.register(self._socket, POLLIN)
+                if lane is None :
+                    p.register(srv._server, POLLIN)
+                left = int(srv.KeepAliveTimeout * 1000)
+                while left > 0 :
+                    # In a pool, look at the queue every 100 ms.
+                    wait   = left if lane is None else min(left, 100)
+                    events = p.poll(wait)
+                    for ev in events :
+                        if ev[0] is self._socket :
+                            return True
+                    if events or (lane is not None and lane.queued()) :
+                        return False
+                    left -= wait
+            except :
+                pass
+            return False
+
+        # ------------------------------------------------------------------------
+
+        def _wantsKeepAlive(self) :
+            srv = self._microWebSrv
+            if not srv.KeepAlive or self._requests >= srv.KeepAliveMaxRequests :
+                return False
+            if self._lane is not None and not self._lane.keepAlive :
+                return False
+            conn = self._headers.get('connection', '').lower()
+            if self._httpVer == 'HTTP/1.1' :
+                return 'close' not in conn
+            return 'keep-alive' in conn
+
+        # ------------------------------------------------------------------------
+
+        def _drainRequestContent(self) :
+            # Skip any body the handler didn't read, so the next request on
+            # the connection starts at its first line. False if it is too big
+            # to be worth it, or the client went away.
+            try :
+                left = int(self._headers.get('content-length', 0)) - self._contentRead
+            except :
+                return False
+            if left > self._microWebSrv.MaxDrainContentLen :
+                return False
+            try :
+                while left > 0 :
+                    data = self._socketfile.read(min(left, 512))
+                    if not data :
+                        return False
+                    left -= len(data)
+            except :
+                return False
+            return True
 
         # ------------------------------------------------------------------------
 
         def _processRequest(self) :
+            # One request/response. Returns True to keep the connection for
+            # another request, False to close it, None if a WebSocket took it.
+            self._keepAlive = False
+            response = MicroWebSrv._response(self)
             try :
-                response = MicroWebSrv._response(self)
                 if self._parseFirstLine(response) :
+                    self._socket.settimeout(2)
                     if self._parseHeader(response) :
+                        self._keepAlive = self._wantsKeepAlive()
                         upg = self._getConnUpgrade()
                         if not upg :
                             routeHandler, routeArgs = self._microWebSrv.GetRouteHandler(self._resPath, self._method)
@@ -358,13 +917,14 @@ class MicroWebSrv :
                                             if self._microWebSrv.LetCacheStaticContentLevel > 0 :
                                                 if self._microWebSrv.LetCacheStaticContentLevel > 1 and \
                                                    'if-modified-since' in self._headers :
-                                                    response.WriteResponseNotModified()
+                                                    vary = { 'Vary' : 'Accept-Encoding' } if self._gzipPath(filepath) else None
+                                                    response.WriteResponseNotModified(vary)
                                                 else:
                                                     headers = { 'Last-Modified' : 'Fri, 1 Jan 2018 23:42:00 GMT', \
                                                                 'Cache-Control' : 'max-age=315360000' }
-                                                    response.WriteResponseFile(filepath, contentType, headers)
+                                                    self._writeStaticFile(response, filepath, contentType, headers)
                                             else :
-                                                response.WriteResponseFile(filepath, contentType)
+                                                self._writeStaticFile(response, filepath, contentType)
                                         else :
                                             response.WriteResponseForbidden()
                                 else :
@@ -373,31 +933,70 @@ class MicroWebSrv :
                                 response.WriteResponseMethodNotAllowed()
                         elif upg == 'websocket' and 'MicroWebSocket' in globals() \
                              and self._microWebSrv.AcceptWebSocketCallback :
-                                MicroWebSocket( socket         = self._socket,
-                                                httpClient     = self,
-                                                httpResponse   = response,
-                                                maxRecvLen     = self._microWebSrv.MaxWebSocketRecvLen,
-                                                threaded       = self._microWebSrv.WebSocketThreaded,
-                                                acceptCallback = self._microWebSrv.AcceptWebSocketCallback )
-                                return
+                                ws = MicroWebSocket( socket         = self._socket,
+                                                     httpClient     = self,
+                                                     httpResponse   = response,
+                                                     maxRecvLen     = self._microWebSrv.MaxWebSocketRecvLen,
+                                                     threaded       = self._microWebSrv.WebSocketThreaded,
+                                                     acceptCallback = self._microWebSrv.AcceptWebSocketCallback,
+                                                     asyncMode      = self._async )
+                                if self._async and ws._async :
+                                    self._upgraded = ws   # run by _asyncClient
+                                return None
                         else :
+                            self._keepAlive = False
                             response.WriteResponseNotImplemented()
                     else :
                         response.WriteResponseBadRequest()
             except :
+                self._keepAlive = False
                 response.WriteResponseInternalServerError()
-            try :
-                if self._socketfile is not self._socket:
-                    self._socketfile.close()
-                self._socket.close()
-            except :
-                pass
+            if self._keepAlive and self._responded :
+                try :
+                    if self._socketfile is not self._socket :
+                        self._socketfile.flush()
+                except :
+                    return False
+                return self._drainRequestContent()
+            return False
+
+        # ------------------------------------------------------------------------
+
+        def _gzipPath(self, filepath) :
+            # The pre-compressed sibling of filepath (filepath + '.gz', see
+            # tools/gzip_portal.py), or None. When there is one, every
+            # response for the file, 304s included, varies on Accept-Encoding.
+            if self._microWebSrv.GzipStaticContent :
+                gzpath = filepath + '.gz'
+                if MicroWebSrv._fileExists(gzpath) :
+                    return gzpath
+            return None
+
+        # ------------------------------------------------------------------------
+
+        def _writeStaticFile(self, response, filepath, contentType, headers=None) :
+            # The pre-compressed sibling goes instead to clients that take gzip.
+            gzpath = self._gzipPath(filepath)
+            if gzpath :
+                headers = dict(headers) if headers else { }
+                headers['Vary'] = 'Accept-Encoding'
+                if 'gzip' in self._headers.get('accept-encoding', '').lower() :
+                    headers['Content-Encoding'] = 'gzip'
+                    filepath = gzpath
+            return response.WriteResponseFile(filepath, contentType, headers)
 
         # ------------------------------------------------------------------------
 
         def _parseFirstLine(self, response) :
             try :
-                elements = self._socketfile.readline().decode().strip().split()
+                line = self._firstLine
+                if line is None :
+                    line = self._socketfile.readline()
+                else :
+                    self._firstLine = None
+                    if not line.endswith(b'\n') :
+                        line += self._socketfile.readline()
+                elements = line.decode().strip().split()
                 if len(elements) == 3 :
                     self._method  = elements[0].upper()
                     self._path    = elements[1]
@@ -507,13 +1106,28 @@ class MicroWebSrv :
                 size = self._contentLength
             if size > 0 :
                 try :
-                    return self._socketfile.read(size)
+                    data = self._socketfile.read(size)
+                    self._contentRead += len(data)
+                    return data
                 except :
                     pass
             return b''
 
         # ------------------------------------------------------------------------
 
+        def ReadRequestContentInto(self, buf) :
+            size = min(self._contentLength, len(buf))
+            if size > 0 :
+                try :
+                    n = self._socketfile.readinto(memoryview(buf)[:size])
+                    self._contentRead += n
+                    return n
+                except :
+                    pass
+            return 0
+
+        # ------------------------------------------------------------------------
+
         def ReadRequestPostedFormData(self) :
             res  = { }
             data = self.ReadRequestContent()
@@ -566,6 +1180,7 @@ class MicroWebSrv :
         # ------------------------------------------------------------------------
 
         def _writeFirstLine(self, code) :
+            self._client._responded = True
             reason = self._responseCodes.get(code, ('Unknown reason', ))[0]
             return self._write("HTTP/1.1 %s %s\r\n" % (code, reason))
 
@@ -603,9 +1218,20 @@ class MicroWebSrv :
                     self._writeHeader(header, headers[header])
             if contentLength > 0 :
                 self._writeContentTypeHeader(contentType, contentCharset)
+            if code != 304 :
+                # Always framed, so a kept-alive connection knows where the
+                # next response starts.
                 self._writeHeader("Content-Length", contentLength)
             self._writeServerHeader()
-            self._writeHeader("Connection", "close")
+            client = self._client
+            if client._keepAlive :
+                srv = client._microWebSrv
+                self._writeHeader("Connection", "keep-alive")
+                self._writeHeader( "Keep-Alive",
+                                   "timeout=%d, max=%d" % ( srv.KeepAliveTimeout,
+                                                            srv.KeepAliveMaxRequests - client._requests ) )
+            else :
+                self._writeHeader("Connection", "close")
             self._writeEndHeader()
 
         # ------------------------------------------------------------------------
@@ -634,9 +1260,13 @@ class MicroWebSrv :
                     contentLength = 0
                 self._writeBeforeContent(code, headers, contentType, contentCharset, contentLength)
                 if content :
-                    return self._write(content)
+                    if self._write(content) :
+                        return True
+                    self._client._keepAlive = False
+                    return False
                 return True
             except :
+                self._client._keepAlive = False
                 return False
 
         # ------------------------------------------------------------------------
@@ -666,6 +1296,11 @@ class MicroWebSrv :
             try :
                 size = stat(filepath)[6]
                 if size > 0 :
+                    if self._client._async :
+                        # Sent by the event loop once the handler returns.
+                        self._writeBeforeContent(200, headers, contentType, None, size)
+                        self._client._socket._file = filepath
+                        return True
                     with open(filepath, 'rb') as file :
                         self._writeBeforeContent(200, headers, contentType, None, size)
                         try :
@@ -675,11 +1310,14 @@ class MicroWebSrv :
                                 if x < len(buf) :
                                     buf = memoryview(buf)[:x]
                                 if not self._write(buf) :
+                                    self._client._keepAlive = False
                                     return False
                                 size -= x
                             return True
                         except :
-                            self.WriteResponseInternalServerError()
+                            # Headers are out: the only way to fail now is
+                            # to cut the connection.
+                            self._client._keepAlive = False
                             return False
             except :
                 pass
@@ -735,8 +1373,14 @@ class MicroWebSrv :
 
         # ------------------------------------------------------------------------
 
-        def WriteResponseNotModified(self) :
-            return self.WriteResponseError(304)
+        def WriteResponseNotModified(self, headers=None) :
+            # No body: a 304 ends with its headers.
+            try :
+                self._writeBeforeContent(304, headers, None, None, 0)
+                return True
+            except :
+                self._client._keepAlive = False
+                return False
 
         # ------------------------------------------------------------------------
 
@@ -3,28 +3,35 @@
 #NOTE: I tried writing 16 bit values for PWM but it crashed the controller requiring a power cycle to reset.
 
 import machine
+from array import array
 from time import sleep_us
 
-class PCA9685(object):
-  '''16 servo contoller. Use index 0-15 for the servo #.'''
+#Module level so the methods below can use them both here, where they are
+#folded at compile time, and under CPython (see tools/sim).
+_MODE1 = const(0)
+_PRESCALE = const(0xFE)
 
-  _ADDRESS = 0x43
-  _MODE1 = const(0)
-  _PRESCALE = const(0xFE)
+_LED0_ON_L = const(0x6)                         #We only use LED0 and offset 0-16 from it.
+#_LED0_ON_H = const(0x7)
+#_LED0_OFF_L = const(0x8)
+#_LED0_OFF_H = const(0x9)
+
+_ALLLED_ON_L = const(0xFA)                      #Writes here load every LEDn register at once.
+#_ALLLED_ON_H = const(0xFB)
+#_ALLLED_OFF_L = const(0xFC)
+#_ALLLED_OFF_H = const(0xFD)
 
-  _LED0_ON_L = const(0x6)                       #We only use LED0 and offset 0-16 from it.
-#  _LED0_ON_H = const(0x7)
-#  _LED0_OFF_L = const(0x8)
-#  _LED0_OFF_H = const(0x9)
+_MAXTICKS = const(4095)                         #12 bit on/off; 4096 and up set the full on/off bits.
 
-#  _ALLLED_ON_L = const(0xFA)
-#  _ALLLED_ON_H = const(0xFB)
-#  _ALLLED_OFF_L = const(0xFC)
-#  _ALLLED_OFF_H = const(0xFD)
+_DEFAULTFREQ = const(60)
+_MINPULSE = const(120)
+_MAXPULSE = const(600)
+_ANGLESTEPS = const(10)                         #Angle table entries per degree, 10 = 0.1 degree.
 
-  _DEFAULTFREQ = const(60)
-  _MINPULSE = const(120)
-  _MAXPULSE = const(600)
+class PCA9685(object):
+  '''16 servo contoller. Use index 0-15 for the servo #.'''
+
+  _ADDRESS = 0x43
 
   def __init__(self, SDA = 21, SCL = 22) :
     '''aSDA is I2C SDA pin #, aSCL is I2C SCL pin #.'''
@@ -32,6 +39,12 @@ class PCA9685(object):
     self.i2c = machine.I2C(scl = machine.Pin(SCL), sda = machine.Pin(SDA))
     self._buffer = bytearray(4)
     self._b1 = bytearray(1)
+    self._burst = bytearray(64)                 #Shadow of LED0..LED15 ON/OFF registers, also the write buffer.
+    self._burstview = memoryview(self._burst)
+    self._known = 0                             #Bit n set = shadow of servo n matches the controller.
+    self.cache_hits = 0                         #Servo writes skipped because nothing changed.
+    self.cache_misses = 0                       #Servo writes sent to the controller.
+    self._angleSteps = _ANGLESTEPS
     sleep_us(50)
     self.reset()
     self.minmax(_MINPULSE, _MAXPULSE)
@@ -41,6 +54,21 @@ class PCA9685(object):
     self._min = aMin
     self._max = aMax
     self._range = aMax - aMin
+    self._build_angle_table()
+
+  def angle_resolution( self, aSteps ) :
+    '''Set angle table entries per degree (10 = 0.1 degree) and rebuild it.
+       Angles are looked up in tenths, so more than 10 adds nothing.'''
+    self._angleSteps = int(aSteps)
+    self._build_angle_table()
+
+  def _build_angle_table( self ) :
+    '''Precompute off ticks for -90 to +90 so angle writes need no float math.'''
+    n = 180 * self._angleSteps
+    table = array('H', bytes(2 * (n + 1)))
+    for i in range(n + 1) :
+      table[i] = self._min + (2 * self._range * i + n) // (2 * n)   #Rounded to nearest tick.
+    self._angleTable = table
 
   def read( self, aLoc ) :
     '''Read 8 bit value and return.'''
@@ -58,11 +86,13 @@ class PCA9685(object):
 
   def reset( self ):
     '''Reset the controller and set default frequency.'''
+    self.invalidate()
     self.write(0, _MODE1)
     self.set_freq(_DEFAULTFREQ)
 
   def set_freq( self, aFreq ) :
     '''Set frequency for all servos.  A good value is 60hz (default).'''
+    self._period_us = int(1000000 / aFreq)
     aFreq *= 0.9  #Correct for overshoot in frequency setting.
     prescalefloat = (6103.51562 / aFreq) - 1  #25000000 / 4096 / freq.
     prescale = int(prescalefloat + 0.5)
@@ -77,40 +107,197 @@ class PCA9685(object):
 
   def set_pwm(self, aServo, aOn, aOff):
     '''aServo = 0-15.
-       aOn = 16 bit on value.
-       aOff = 16 bit off value.
+       aOn = on value 0-4095.
+       aOff = off value 0-4095.
+       Skipped if the servo already has these values.
     '''
+    self._flush(self._stage(aServo, aOn, aOff))
+
+  def _stage(self, aServo, aOn, aOff) :
+    '''Put one servo's ON/OFF values into the shadow buffer.
+       Returns the servo's mask bit if it needs writing, 0 if unchanged.'''
     if 0 <= aServo <= 15 :
+      self._check_ticks(aOn, aOff, aServo)
       #Data = on-low, on-high, off-low and off-high.  That's 4 bytes each servo.
-      loc = _LED0_ON_L + (aServo * 4)
-#    print(loc)
-      self._buffer[0] = aOn
-      self._buffer[1] = aOn >> 8
-      self._buffer[2] = aOff
-      self._buffer[3] = aOff >> 8
-      self.write_buffer(self._buffer, loc)
+      loc = aServo * 4
+      buf = self._burst
+      bit = 1 << aServo
+      onl = aOn & 0xFF
+      onh = aOn >> 8
+      offl = aOff & 0xFF
+      offh = aOff >> 8
+      if self._known & bit and buf[loc] == onl and buf[loc + 1] == onh \
+         and buf[loc + 2] == offl and buf[loc + 3] == offh :
+        self.cache_hits += 1
+        return 0
+      buf[loc] = onl
+      buf[loc + 1] = onh
+      buf[loc + 2] = offl
+      buf[loc + 3] = offh
+      self.cache_misses += 1
+      return bit
     else:
       raise Exception('Servo index {} out of range.'.format(str(aServo)))
 
+  def _check_ticks(self, aOn, aOff, aServo = 'all') :
+    '''Raise ValueError unless aOn and aOff are both 0-4095.'''
+    if not (0 <= aOn <= _MAXTICKS and 0 <= aOff <= _MAXTICKS) :
+      raise ValueError('Servo {} on/off {}/{} out of range.'.format(aServo, aOn, aOff))
+
+  def _flush(self, aMask) :
+    '''Write staged servos in aMask (bit n = servo n).
+       Each run of adjacent servos goes out as one auto-increment write.
+       A single known, unchanged servo between two runs is rewritten to join them.'''
+    known = self._known
+    s = 0
+    try :
+      while s < 16 :
+        if (aMask >> s) & 1 :
+          e = s + 1
+          while e < 16 :
+            if (aMask >> e) & 1 :
+              e += 1
+            elif e < 15 and (known >> e) & 1 and (aMask >> (e + 1)) & 1 :
+              e += 2
+            else :
+              break
+          self.write_buffer(self._burstview[s * 4:e * 4], _LED0_ON_L + (s * 4))
+          s = e
+        else:
+          s += 1
+    except :
+      self._known = known & ~aMask     #Unsure what reached the chip.
+      raise
+    self._known = known | aMask
+
+  def invalidate( self ) :
+    '''Forget the shadow registers so the next write of every servo goes out.'''
+    self._known = 0
+
+  def resync( self ) :
+    '''Reload the shadow registers from the controller.'''
+    self._known = 0
+    self.i2c.readfrom_mem_into(self._ADDRESS, _LED0_ON_L, self._burst)
+    self._known = 0xFFFF
+
+  def set_pwm_many(self, aServos, aOffs, aOn = 0, aStart = 0) :
+    '''aServos = sequence of servo indexes 0-15, any order.
+       aOffs = off values 0-4095, aOffs[aStart + i] goes to aServos[i].
+       aOn = on value 0-4095 used for all of them.
+       Adjacent servos are written together, so 0,1,4,5,6,7,10,11 takes 3 writes.
+    '''
+    mask = 0
+    try :
+      for i in range(len(aServos)) :
+        mask |= self._stage(aServos[i], aOn, aOffs[aStart + i])
+    except :
+      self._known &= ~mask             #Staged but never sent.
+      raise
+    self._flush(mask)
+
   def off( self, aServo ) :
     '''Turn off a servo.'''
     self.set_pwm(aServo, 0, 0)
 
+  def set_all_pwm( self, aOn, aOff ) :
+    '''Set all 16 servos to the same on/off values with a single write.
+       Always sent, even if the shadow says nothing changed.
+    '''
+    self._check_ticks(aOn, aOff)
+    self._buffer[0] = aOn & 0xFF
+    self._buffer[1] = aOn >> 8
+    self._buffer[2] = aOff & 0xFF
+    self._buffer[3] = aOff >> 8
+    try :
+      self.write_buffer(self._buffer, _ALLLED_ON_L)
+    except :
+      self._known = 0
+      raise
+    buf = self._burst
+    for loc in range(0, 64, 4) :
+      buf[loc:loc + 4] = self._buffer
+    self._known = 0xFFFF
+    self.cache_misses += 16
+
   def all_off( self ) :
-    '''Turn all servos off.'''
-    for x in range(0, 16):
-      self.off(x)
+    '''Turn all servos off.  One write, so it is safe to use as an emergency stop.'''
+    self.set_all_pwm(0, 0)
+
+  def _perc_to_off(self, aPerc) :
+    '''Convert 0-100% to an off value. < 0 gives 0 (servo off).'''
+    if aPerc < 0 :
+      return 0
+    return self._min + ((self._range * aPerc) // 100)
+
+  def tenths_to_ticks(self, aTenths) :
+    '''Convert an integer angle in tenths of a degree, -900 to +900, to an off
+       value from the angle table.  Integer math only.
+       < -900 gives 0 (servo off), > 900 gives the max pulse.'''
+    if aTenths < -900 :
+      return 0
+    i = ((aTenths + 900) * self._angleSteps) // 10
+    table = self._angleTable
+    if i >= len(table) :
+      i = len(table) - 1
+    return table[i]
+
+  def angle_to_ticks(self, aAngle) :
+    '''Convert angle -90 to +90 to an off value from the angle table.
+       A float is rounded once to tenths, see tenths_to_ticks().
+       < -90 gives 0 (servo off), > 90 gives the max pulse.'''
+    if type(aAngle) is int :
+      return self.tenths_to_ticks(aAngle * 10)
+    if aAngle < -90 :
+      return 0
+    return self.tenths_to_ticks(int(aAngle * 10 + 900.5) - 900)
+
+  def pulse_us_to_ticks(self, aMicros) :
+    '''Convert a pulse width in microseconds to ticks (4096 per period).
+       Clamped to 0-4095: 4096 and up would set the full-off bit.'''
+    ticks = int(aMicros * 4096) // self._period_us
+    if ticks < 0 :
+      return 0
+    if ticks > 4095 :
+      return 4095
+    return ticks
+
+  def set_ticks(self, aServo, aTicks) :
+    '''Set pulse width in ticks, 0-4095. 0 turns servo off.'''
+    self.set_pwm(aServo, 0, aTicks)
+
+  def set_pulse_us(self, aServo, aMicros) :
+    '''Set pulse width in microseconds. 0 turns servo off.'''
+    self.set_pwm(aServo, 0, self.pulse_us_to_ticks(aMicros))
 
   def set(self, aServo, aPerc) :
     '''Set the 0-100%. If < 0 turns servo off.'''
-    if aPerc < 0 :
-      self.off(aServo)
-    else:
-      val = self._min + ((self._range * aPerc) // 100)
-      self.set_pwm(aServo, 0, val)
+    self.set_pwm(aServo, 0, self._perc_to_off(aPerc))
 
   def set_angle(self, aServo, aAngle):
     '''Set angle -90 to +90.  < -90 is off.'''
-    #((a + 90.0) * 100.0) / 180.0
-    perc = int((aAngle + 90.0) * 0.5556)  #Convert angle +/- 90 to 0-100%
-    self.set(aServo, perc)
+    self.set_pwm(aServo, 0, self.angle_to_ticks(aAngle))
+
+  def set_angles_tenths(self, aServos, aTenths) :
+    '''As set_angles(), with integer angles in tenths of a degree, e.g. an
+       array('h').  No float math on the way to the controller.'''
+    mask = 0
+    try :
+      for i in range(len(aServos)) :
+        mask |= self._stage(aServos[i], 0, self.tenths_to_ticks(aTenths[i]))
+    except :
+      self._known &= ~mask             #Staged but never sent.
+      raise
+    self._flush(mask)
+
+  def set_angles(self, aServos, aAngles) :
+    '''Set several servos to angles -90 to +90 with as few writes as possible.
+       aServos and aAngles are matching sequences. < -90 is off.
+    '''
+    mask = 0
+    try :
+      for i in range(len(aServos)) :
+        mask |= self._stage(aServos[i], 0, self.angle_to_ticks(aAngles[i]))
+    except :
+      self._known &= ~mask             #Staged but never sent.
+      raise
+    self._flush(mask)
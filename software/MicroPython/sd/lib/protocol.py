@@ -0,0 +1,151 @@
+import struct
+from array import array
+
+# Binary motion commands, the compact alternative to the JSON bodies of
+# /api/crawler/cmd and /api/servo. Little-endian, sent as an HTTP body with
+# Content-Type application/octet-stream or as a WebSocket binary frame.
+#
+#   velocity  '<Bbbb'    op=OP_VELOCITY, vx, vy, wz in -100..100
+#   stop      any frame starting with OP_STOP, so '<Bbbb' 0, 0, 0, 0 works too
+#   command   '<BBBBHH'  op, arg, steps, flags, mask, durationMs
+#             followed by one int16 angle (tenths of a degree) per set bit
+#             of mask, lowest bit first (OP_JOINTS), or by the arg bytes of
+#             a gait name (OP_GAIT)
+#
+#   OP_STOP     stop and turn the outputs off
+#   OP_CENTER   center every joint
+#   OP_ALL_OFF  turn every output off
+#   OP_GAIT     run the named gait steps times (0 counts as 1); any gait the
+#               robot has loaded, config-defined ones included
+#   OP_JOINTS   move the joints (crawler) or channels (servo test) in mask to
+#               the angles over durationMs, 0 for the default; with FLAG_OFF
+#               (servo test only) turn them off instead and send no angles
+OP_STOP = 0
+OP_VELOCITY = 1
+OP_CENTER = 2
+OP_ALL_OFF = 3
+OP_GAIT = 4
+OP_JOINTS = 5
+
+FLAG_HOLD = 0x01     # keep the servos powered after the gait
+FLAG_REPLACE = 0x02  # drop pending commands first
+FLAG_OFF = 0x04      # OP_JOINTS: turn the masked outputs off
+
+VELOCITY = '<Bbbb'
+HEADER = '<BBBBHH'
+HEADER_SIZE = struct.calcsize(HEADER)
+ANGLE_SCALE = 10
+MAX_JOINTS = 16
+MAX_GAIT_NAME = 2 * MAX_JOINTS  # bytes; fits in the room of the angles
+MAX_FRAME = HEADER_SIZE + 2 * MAX_JOINTS
+
+class Command:
+    # One decoded command frame. parse() refills the same object, so a
+    # handler can keep one per connection instead of building dicts. OP_JOINTS
+    # angles are kept as int16 tenths of a degree in self.tenths; angle(k)
+    # gives degrees where they are used.
+    def __init__(self):
+        self.op = OP_STOP
+        self.arg = 0
+        self.steps = 1
+        self.flags = 0
+        self.mask = 0
+        self.duration_ms = 0
+        self.count = 0
+        self.indexes = bytearray(MAX_JOINTS)
+        self.tenths = array('h', bytes(2 * MAX_JOINTS))
+        self.name = bytearray(MAX_GAIT_NAME)
+        self.velocity = [0.0, 0.0, 0.0]
+
+    def angle(self, k):
+        # Angle k of an OP_JOINTS frame in degrees.
+        return self.tenths[k] / ANGLE_SCALE
+
+    def gait(self):
+        # Gait name for OP_GAIT.
+        return bytes(self.name[:self.arg]).decode()
+
+    def parse(self, data, length=None):
+        # Decode data[:length] into this object; ValueError on a bad frame.
+        if length is None:
+            length = len(data)
+        if length < 1:
+            raise ValueError("empty frame")
+        op = data[0]
+        if op == OP_VELOCITY:
+            if length < 4:
+                raise ValueError("short velocity frame")
+            self.op, vx, vy, wz = struct.unpack_from(VELOCITY, data)
+            v = self.velocity
+            v[0] = vx / 100
+            v[1] = vy / 100
+            v[2] = wz / 100
+            return self
+        if length < HEADER_SIZE:
+            if op != OP_STOP:
+                raise ValueError("short frame")
+            # The 4-byte stop of the velocity stream.
+            self.op = OP_STOP
+            self.arg = 0
+            self.steps = 1
+            self.flags = 0
+            self.mask = 0
+            self.duration_ms = 0
+            self.count = 0
+            return self
+        self.op, self.arg, steps, self.flags, mask, self.duration_ms = struct.unpack_from(HEADER, data)
+        if self.op > OP_JOINTS:
+            raise ValueError("unknown opcode {}".format(self.op))
+        self.steps = steps if steps else 1
+        self.mask = mask
+        count = 0
+        if self.op == OP_GAIT:
+            n = self.arg
+            if n == 0 or n > MAX_GAIT_NAME or HEADER_SIZE + n > length:
+                raise ValueError("gait name length {} does not fit the frame".format(n))
+            self.name[:n] = memoryview(data)[HEADER_SIZE:HEADER_SIZE + n]
+        elif self.op == OP_JOINTS:
+            angles = not self.flags & FLAG_OFF
+            offset = HEADER_SIZE
+            i = 0
+            while mask:
+                if mask & 1:
+                    self.indexes[count] = i
+                    if angles:
+                        if offset + 2 > length:
+                            raise ValueError("frame has fewer angles than mask bits")
+                        # int16 by hand: no tuple per angle as with unpack_from.
+                        a = data[offset] | data[offset + 1] << 8
+                        if a & 0x8000:
+                            a -= 0x10000
+                        self.tenths[count] = a
+                        offset += 2
+                    count += 1
+                mask >>= 1
+                i += 1
+        self.count = count
+        return self
+
+def pack_command(op, arg=0, steps=1, flags=0, indexes=(), angles=(), duration_ms=0):
+    # Encode a command frame; the inverse of Command.parse(), for clients and
+    # tools.
+    mask = 0
+    for i in indexes:
+        mask |= 1 << i
+    data = bytearray(struct.pack(HEADER, op, arg, steps, flags, mask, duration_ms))
+    if angles:
+        # Angles go out in bit order whatever order indexes came in.
+        pairs = sorted(zip(indexes, angles))
+        for i, angle in pairs:
+            data += struct.pack('<h', int(round(angle * ANGLE_SCALE)))
+    return bytes(data)
+
+def pack_gait(name, steps=1, flags=0):
+    # Encode an OP_GAIT frame for the named gait.
+    name = name.encode()
+    if not 0 < len(name) <= MAX_GAIT_NAME:
+        raise ValueError("gait name must be 1 to {} bytes".format(MAX_GAIT_NAME))
+    return pack_command(OP_GAIT, len(name), steps, flags) + name
+
+def pack_velocity(vx, vy, wz):
+    return struct.pack(VELOCITY, OP_VELOCITY, int(vx * 100), int(vy * 100), int(wz * 100))
@@ -0,0 +1,73 @@
+# On-robot PCA9685 write benchmark. Run from the REPL with:
+#   import lib.utils.bench_pca
+# Servos move, so lift the robot or unplug the servo power first.
+
+import time
+from lib.pca9685 import PCA9685
+
+CRAWLER_SERVOS = (0, 1, 4, 5, 6, 7, 10, 11)
+ROUNDS = 50
+
+pca = PCA9685(SDA=17, SCL=18)
+
+
+def _report(name, total_us, rounds=ROUNDS):
+    print("{:<28} {:>8} us/op".format(name, total_us // rounds))
+
+
+def bench_frame_single():
+    # One write per joint, cache cleared so every write goes out.
+    t0 = time.ticks_us()
+    for r in range(ROUNDS):
+        pca.invalidate()
+        a = 10 if r & 1 else -10
+        for ch in CRAWLER_SERVOS:
+            pca.set_angle(ch, a)
+    return time.ticks_diff(time.ticks_us(), t0)
+
+
+def bench_frame_burst():
+    angles = [0] * len(CRAWLER_SERVOS)
+    t0 = time.ticks_us()
+    for r in range(ROUNDS):
+        pca.invalidate()
+        a = 10 if r & 1 else -10
+        for i in range(len(angles)):
+            angles[i] = a
+        pca.set_angles(CRAWLER_SERVOS, angles)
+    return time.ticks_diff(time.ticks_us(), t0)
+
+
+def bench_stop_per_channel():
+    # What all_off used to cost: one write per channel.
+    total = 0
+    for r in range(ROUNDS):
+        pca.set_angles(CRAWLER_SERVOS, [r & 1] * len(CRAWLER_SERVOS))
+        pca.invalidate()
+        t0 = time.ticks_us()
+        for ch in range(16):
+            pca.off(ch)
+        total += time.ticks_diff(time.ticks_us(), t0)
+    return total
+
+
+def bench_stop_all_led():
+    total = 0
+    for r in range(ROUNDS):
+        pca.set_angles(CRAWLER_SERVOS, [r & 1] * len(CRAWLER_SERVOS))
+        t0 = time.ticks_us()
+        pca.all_off()
+        total += time.ticks_diff(time.ticks_us(), t0)
+    return total
+
+
+def run():
+    print("PCA9685 benchmark, {} rounds".format(ROUNDS))
+    _report("frame, 8 single writes", bench_frame_single())
+    _report("frame, burst writes", bench_frame_burst())
+    _report("stop, 16 channel writes", bench_stop_per_channel())
+    _report("stop, ALL_LED write", bench_stop_all_led())
+    pca.all_off()
+
+
+run()
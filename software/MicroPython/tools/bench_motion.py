@@ -0,0 +1,165 @@
+# Motion benchmark on the simulated board (tools/sim). Runs every Crawler and
+# Wheeler command plus center(), all_off() and the single-servo paths, and
+# reports per run: I2C transactions, bytes, modelled bus time, simulated
+# motion time, Python allocations and host wall time.
+#
+#   python tools/bench_motion.py                       # table
+#   python tools/bench_motion.py --json bench.json     # also save JSON
+#   python tools/bench_motion.py --compare old.json    # deltas against a saved run
+import argparse
+import contextlib
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SD = os.path.join(os.path.dirname(HERE), "sd")
+sys.path[:0] = [HERE, SD]
+
+import sim
+
+WHEELER_COMMANDS = (
+    "stop",
+    "forward_straight", "backward_straight",
+    "forward_diagleft", "forward_diagright",
+    "backward_diagleft", "backward_diagright",
+    "forward_left", "forward_right",
+    "backward_left", "backward_right",
+)
+
+# A case is (name, setup, fn). setup runs before every measured call of fn
+# and is not counted; gaits have none, so they are measured walking steadily.
+
+def crawler_cases(bot):
+    cases = [("crawler." + name, None, lambda name=name: bot.command(name)) for name in sorted(bot.gaits)]
+    cases += [
+        ("crawler.stop", bot.center, lambda: bot.command("stop")),
+        ("crawler.center", bot.center, bot.center),
+        ("crawler.all_off", bot.center, bot.pca.all_off),
+        ("crawler.dynamicSingleServoAssignment", bot.center, lambda: bot.dynamicSingleServoAssignment(0, 20, -20)),
+        ("crawler.centeredDynamicSingleServoAssignment", bot.center, lambda: bot.centeredDynamicSingleServoAssignment(1, 20, -20)),
+        ("crawler.pca.set_angle", bot.center, lambda: bot.pca.set_angle(4, 30)),
+    ]
+    return cases
+
+def wheeler_cases(bot):
+    return [("wheeler." + name, bot.stop, lambda name=name: bot.command(name)) for name in WHEELER_COMMANDS]
+
+def measure(board, bot, setup, fn, repeat):
+    # One warm-up call (compiles gaits, fills the PCA shadow), then repeat
+    # measured calls; bus, time and wall figures are per call, allocation
+    # figures the worst call.
+    if setup is not None:
+        setup()
+    fn()
+    sched = getattr(bot, "scheduler", None)
+    totals = {"transactions": 0, "bytes": 0, "busUs": 0.0, "simUs": 0, "wall": 0.0, "frames": 0, "dropped": 0}
+    alloc_peak = alloc_retained = 0
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        board.log.clear()
+        if sched is not None:
+            sched.reset_stats()
+        t_sim = board.clock.now_us()
+        tracemalloc.start()
+        t_wall = time.perf_counter()
+        fn()
+        totals["wall"] += time.perf_counter() - t_wall
+        retained, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        totals["simUs"] += board.clock.now_us() - t_sim
+        alloc_peak = max(alloc_peak, peak)
+        alloc_retained = max(alloc_retained, retained)
+        bus = board.log.stats()
+        for k in ("transactions", "bytes", "busUs"):
+            totals[k] += bus[k]
+        if sched is not None:
+            stats = sched.stats()
+            totals["frames"] += stats["frames"]
+            totals["dropped"] += stats["dropped"]
+    result = {
+        "transactions": totals["transactions"] / repeat,
+        "bytes": totals["bytes"] / repeat,
+        "busUs": round(totals["busUs"] / repeat, 1),
+        "simUs": totals["simUs"] / repeat,
+        "allocPeakBytes": alloc_peak,
+        "allocRetainedBytes": alloc_retained,
+        "wallUs": round(totals["wall"] * 1000000 / repeat, 1),
+    }
+    if sched is not None:
+        result["frames"] = totals["frames"] / repeat
+        result["dropped"] = totals["dropped"] / repeat
+    return result
+
+def run(freq=400000, repeat=5):
+    results = {}
+    for robot, cases in (("Crawler", crawler_cases), ("Wheeler", wheeler_cases)):
+        board = sim.install(sdcard=SD)
+        board.log.keep = False
+        # sd/lib can only be imported once the stand-ins are in place.
+        import machine
+        from lib import kinematics
+        cls = getattr(kinematics, robot)
+        # The robots build their own I2C; rebuild it at the frequency under test.
+        # Their start-up messages go to stderr so --json - stays clean.
+        with contextlib.redirect_stdout(sys.stderr):
+            bot = cls()
+        bot.pca.i2c = machine.I2C(scl=machine.Pin(18), sda=machine.Pin(17), freq=freq)
+        for name, setup, fn in cases(bot):
+            results[name] = measure(board, bot, setup, fn, repeat)
+    sim.uninstall()
+    return {
+        "meta": {
+            "i2cFreq": freq,
+            "repeat": repeat,
+            "python": platform.python_version(),
+        },
+        "results": results,
+    }
+
+COLUMNS = ("transactions", "bytes", "busUs", "simUs", "allocPeakBytes", "wallUs")
+
+def print_table(report, baseline=None, out=sys.stdout):
+    width = max(len(name) for name in report["results"])
+    out.write("{:<{w}}".format("case", w=width) + "".join("{:>22}".format(c) for c in COLUMNS) + "\n")
+    old = baseline["results"] if baseline else {}
+    for name, r in report["results"].items():
+        cells = []
+        for c in COLUMNS:
+            v = r[c]
+            if name in old and c in old[name]:
+                cells.append("{:>22}".format("{:g} ({:+g})".format(v, round(v - old[name][c], 1))))
+            else:
+                cells.append("{:>22g}".format(v))
+        out.write("{:<{w}}".format(name, w=width) + "".join(cells) + "\n")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Motion benchmark on the simulated board.")
+    parser.add_argument("--freq", type=int, default=400000, help="I2C clock in Hz (100000 or 400000)")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per case")
+    parser.add_argument("--json", metavar="PATH", help="write the report as JSON, - for stdout")
+    parser.add_argument("--compare", metavar="PATH", help="show deltas against a saved JSON report")
+    args = parser.parse_args(argv)
+
+    report = run(args.freq, args.repeat)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    if args.json == "-":
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write("\n")
+        print_table(report, baseline, sys.stderr)
+    else:
+        print_table(report, baseline)
+        if args.json:
+            with open(args.json, "w") as f:
+                json.dump(report, f, indent=2, sort_keys=True)
+                f.write("\n")
+
+if __name__ == "__main__":
+    main()
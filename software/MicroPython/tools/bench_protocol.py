@@ -0,0 +1,114 @@
+# Command parsing benchmark: the JSON bodies of /api/crawler/cmd and
+# /api/servo against the binary frames of lib/protocol.py. Reports per
+# command: body size, parse time and Python allocations. Parsing is pure
+# Python, so it runs on the host; the numbers compare the two formats rather
+# than predict ESP32 timings.
+#
+#   python tools/bench_protocol.py                    # table
+#   python tools/bench_protocol.py --json bench.json  # also save JSON
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SD = os.path.join(os.path.dirname(HERE), "sd")
+sys.path[:0] = [SD]
+
+from lib import protocol
+
+# (name, JSON body, binary body). No route takes joints8 as JSON; its body
+# shows what one would cost.
+CASES = (
+    ("gait",
+     json.dumps({"cmd": "forward", "steps": 4, "hold": False, "replace": True}).encode(),
+     protocol.pack_gait("forward", 4, protocol.FLAG_REPLACE)),
+    ("servo",
+     json.dumps({"channel": 5, "angle": 42.5}).encode(),
+     protocol.pack_command(protocol.OP_JOINTS, indexes=(5,), angles=(42.5,))),
+    ("servo.off",
+     json.dumps({"channel": 5, "off": True}).encode(),
+     protocol.pack_command(protocol.OP_JOINTS, flags=protocol.FLAG_OFF, indexes=(5,))),
+    ("joints8",
+     json.dumps({"joints": list(range(8)), "angles": [10.5 * i for i in range(8)], "durationMs": 200}).encode(),
+     protocol.pack_command(protocol.OP_JOINTS, indexes=range(8), angles=[10.5 * i for i in range(8)], duration_ms=200)),
+    ("velocity",
+     json.dumps({"vx": 0.5, "vy": 0, "wz": -0.25}).encode(),
+     protocol.pack_velocity(0.5, 0, -0.25)),
+)
+
+def parse_json(body):
+    # What a route does today: decode, json.loads, pull the fields out.
+    data = json.loads(body.decode())
+    if not isinstance(data, dict):
+        raise ValueError("Invalid JSON body")
+    for key in data:
+        data.get(key)
+    return data
+
+def make_parse_binary():
+    frame = protocol.Command()
+    buf = bytearray(protocol.MAX_FRAME)
+
+    def parse(body):
+        # Copy into the preallocated buffer first, as
+        # ReadRequestContentInto() does, then decode.
+        n = len(body)
+        buf[:n] = body
+        return frame.parse(buf, n)
+    return parse
+
+def measure(fn, body, repeat):
+    fn(body)
+    t = time.perf_counter()
+    for _ in range(repeat):
+        fn(body)
+    parse_us = (time.perf_counter() - t) * 1000000 / repeat
+    tracemalloc.start()
+    fn(body)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"bytes": len(body), "parseUs": round(parse_us, 2), "allocPeakBytes": peak}
+
+def run(repeat=20000):
+    results = {}
+    parse_binary = make_parse_binary()
+    for name, body_json, body_bin in CASES:
+        results[name + ".json"] = measure(parse_json, body_json, repeat)
+        results[name + ".binary"] = measure(parse_binary, body_bin, repeat)
+    return {
+        "meta": {"repeat": repeat, "python": platform.python_version()},
+        "results": results,
+    }
+
+COLUMNS = ("bytes", "parseUs", "allocPeakBytes")
+
+def print_table(report, out=sys.stdout):
+    width = max(len(name) for name in report["results"])
+    out.write("{:<{w}}".format("case", w=width) + "".join("{:>16}".format(c) for c in COLUMNS) + "\n")
+    for name, r in report["results"].items():
+        out.write("{:<{w}}".format(name, w=width) + "".join("{:>16g}".format(r[c]) for c in COLUMNS) + "\n")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="JSON vs binary command parsing benchmark.")
+    parser.add_argument("--repeat", type=int, default=20000, help="parses per case for the timing")
+    parser.add_argument("--json", metavar="PATH", help="write the report as JSON, - for stdout")
+    args = parser.parse_args(argv)
+
+    report = run(args.repeat)
+    if args.json == "-":
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write("\n")
+        print_table(report, sys.stderr)
+    else:
+        print_table(report)
+        if args.json:
+            with open(args.json, "w") as f:
+                json.dump(report, f, indent=2, sort_keys=True)
+                f.write("\n")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+# Route dispatch benchmark for MicroWebSrv.GetRouteHandler: the per-method
+# literal path table with its regex fallback, against the old linear scan of
+# every route's regex. Reports the lookup time per request for hits on the
+# first and last route, an <arg> route, and a static asset no route matches,
+# as the number of registered routes grows. Runs on the host; the numbers
+# compare the two lookups rather than predict ESP32 timings.
+#
+#   python tools/bench_routes.py                    # table
+#   python tools/bench_routes.py --json bench.json  # also save JSON
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+NETWORK = os.path.join(os.path.dirname(HERE), "sd", "lib", "network")
+sys.path[:0] = [NETWORK]
+
+from microWebSrv import MicroWebSrv
+
+def linear_route_handler(srv, resUrl, method):
+    # GetRouteHandler as it was: every route's method and regex, in order.
+    if resUrl.endswith('/'):
+        resUrl = resUrl[:-1]
+    method = method.upper()
+    for rh in srv._routeHandlers:
+        if rh.method == method:
+            m = rh.routeRegex.match(resUrl)
+            if m:
+                if rh.routeArgNames:
+                    routeArgs = {}
+                    for i, name in enumerate(rh.routeArgNames):
+                        value = m.group(i + 1)
+                        try:
+                            value = int(value)
+                        except:
+                            pass
+                        routeArgs[name] = value
+                    return (rh.func, routeArgs)
+                return (rh.func, None)
+    return (None, None)
+
+def handler(httpClient, httpResponse):
+    pass
+
+def make_routes(count):
+    # Shaped like pyboard/main.py: OPTIONS/POST pairs under /api, a few GETs,
+    # and one route with an argument.
+    routes = [("/api/item/<id>", "GET", handler)]
+    i = 0
+    while len(routes) < count:
+        path = "/api/group{}/action{}".format(i // 4, i)
+        routes.append((path, "OPTIONS", handler))
+        routes.append((path, "POST", handler))
+        routes.append((path + "/status", "GET", handler))
+        i += 1
+    return routes[:count]
+
+def requests(routes):
+    literal = [r for r in routes if "<" not in r[0]]
+    return (
+        ("firstRoute", literal[0][0], literal[0][1]),
+        ("lastRoute", literal[-1][0], literal[-1][1]),
+        ("argRoute", "/api/item/42", "GET"),
+        ("staticAsset", "/_next/static/chunks/main-3f2a9c.js", "GET"),
+    )
+
+def measure(fn, url, method, repeat):
+    fn(url, method)
+    t = time.perf_counter()
+    for _ in range(repeat):
+        fn(url, method)
+    return round((time.perf_counter() - t) * 1000000 / repeat, 3)
+
+def run(counts=(5, 10, 25, 50, 100), repeat=20000):
+    results = {}
+    for count in counts:
+        routes = make_routes(count)
+        srv = MicroWebSrv(routeHandlers=routes, webPath="/tmp")
+        for name, url, method in requests(routes):
+            expect = linear_route_handler(srv, url, method)
+            if srv.GetRouteHandler(url, method) != expect:
+                raise SystemExit("dispatch mismatch for {} {}".format(method, url))
+            results["{}.{}".format(count, name)] = {
+                "routes": count,
+                "tableUs": measure(srv.GetRouteHandler, url, method, repeat),
+                "linearUs": measure(lambda u, m: linear_route_handler(srv, u, m), url, method, repeat),
+            }
+    return {
+        "meta": {"repeat": repeat, "python": platform.python_version()},
+        "results": results,
+    }
+
+COLUMNS = ("routes", "tableUs", "linearUs")
+
+def print_table(report, out=sys.stdout):
+    width = max(len(name) for name in report["results"])
+    out.write("{:<{w}}".format("case", w=width) + "".join("{:>12}".format(c) for c in COLUMNS) + "\n")
+    for name, r in report["results"].items():
+        out.write("{:<{w}}".format(name, w=width) + "".join("{:>12g}".format(r[c]) for c in COLUMNS) + "\n")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="MicroWebSrv route dispatch benchmark.")
+    parser.add_argument("--repeat", type=int, default=20000, help="lookups per case for the timing")
+    parser.add_argument("--json", metavar="PATH", help="write the report as JSON, - for stdout")
+    args = parser.parse_args(argv)
+
+    report = run(repeat=args.repeat)
+    if args.json == "-":
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write("\n")
+        print_table(report, sys.stderr)
+    else:
+        print_table(report)
+        if args.json:
+            with open(args.json, "w") as f:
+                json.dump(report, f, indent=2, sort_keys=True)
+                f.write("\n")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,211 @@
+# Server mode benchmark for MicroWebSrv: the threaded server (inline, or a
+# worker pool) against StartAsync() on one asyncio event loop. Each case runs
+# a few keep-alive clients in parallel, each making a series of small JSON
+# requests, then opens WebSockets that echo a message. Reports requests per
+# second, WebSocket round trips per second and the most threads alive.
+# Everything runs on the host under CPython; the numbers compare the modes
+# rather than predict ESP32 timings.
+#
+#   python tools/bench_server.py                    # table
+#   python tools/bench_server.py --json bench.json  # also save JSON
+import argparse
+import asyncio
+import json
+import os
+import platform
+import socket
+import sys
+import threading
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+NETWORK = os.path.join(os.path.dirname(HERE), "sd", "lib", "network")
+sys.path[:0] = [NETWORK]
+
+from microWebSrv import MicroWebSrv
+
+WS_KEY = b"dGhlIHNhbXBsZSBub25jZQ=="
+
+def status(httpClient, httpResponse):
+    httpResponse.WriteResponseJSONOk({"ok": True, "n": len(httpClient.GetRequestQueryString())})
+
+def accept(webSocket, httpClient):
+    webSocket.RecvTextCallback = lambda ws, msg: ws.SendText(msg)
+
+def make_server(port, workers):
+    srv = MicroWebSrv(routeHandlers=[("/api/status", "GET", status)], port=port, webPath=HERE)
+    srv.WorkerThreads = workers
+    srv.AcceptWebSocketCallback = accept
+    return srv
+
+def read_response(f):
+    # Returns the body and whether the server will close the connection.
+    length = 0
+    close = False
+    while True:
+        line = f.readline()
+        if not line:
+            raise ConnectionError("connection closed")
+        if line == b"\r\n":
+            break
+        lower = line.lower()
+        if lower.startswith(b"content-length:"):
+            length = int(line[15:])
+        elif lower.startswith(b"connection:"):
+            close = lower[11:].strip() == b"close"
+    return f.read(length), close
+
+def ws_frame(payload):
+    # Client to server text frame, masked.
+    mask = b"\x11\x22\x33\x44"
+    return bytes([0x81, 0x80 | len(payload)]) + mask + bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+
+def http_client(port, requests):
+    # Reconnects whenever the server ends the connection, e.g. after
+    # KeepAliveMaxRequests requests.
+    i = 0
+    while i < requests:
+        with socket.create_connection(("127.0.0.1", port)) as s:
+            f = s.makefile("rwb")
+            close = False
+            while i < requests and not close:
+                f.write(b"GET /api/status?i=%d HTTP/1.1\r\nHost: bench\r\n\r\n" % i)
+                f.flush()
+                close = read_response(f)[1]
+                i += 1
+
+def ws_client(port, messages):
+    with socket.create_connection(("127.0.0.1", port)) as s:
+        f = s.makefile("rwb")
+        f.write(b"GET /ws HTTP/1.1\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                b"Sec-WebSocket-Key: " + WS_KEY + b"\r\n\r\n")
+        f.flush()
+        while f.readline() != b"\r\n":
+            pass
+        for i in range(messages):
+            f.write(ws_frame(b"ping %d" % i))
+            f.flush()
+            head = f.read(2)
+            f.read(head[1] & 0x7F)
+
+def timed(fn, clients, count, port):
+    # A client that fails would make the rate meaningless, so its error
+    # ends the run.
+    errors = []
+
+    def client():
+        try:
+            fn(port, count)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    t = time.perf_counter()
+    for th in threads:
+        th.start()
+    for th in threads:
+        th.join()
+    elapsed = time.perf_counter() - t
+    if errors:
+        raise RuntimeError("{} of {} {} clients failed: {!r}".format(len(errors), clients, fn.__name__, errors[0]))
+    return clients * count / elapsed
+
+def thread_count():
+    # Also counts the server's raw _thread threads, which threading doesn't.
+    return len(sys._current_frames())
+
+def run_load(port, clients, requests, base):
+    # Samples the thread count while the clients run; the clients' own
+    # threads and the sampler are taken out.
+    peak = [0]
+    done = []
+
+    def sample():
+        while not done:
+            peak[0] = max(peak[0], thread_count() - base - clients - 1)
+            time.sleep(0.002)
+
+    sampler = threading.Thread(target=sample)
+    sampler.start()
+    result = {
+        "httpRps": round(timed(http_client, clients, requests, port)),
+        "wsRtps": round(timed(ws_client, clients, requests, port)),
+    }
+    done.append(True)
+    sampler.join()
+    result["peakThreads"] = peak[0]
+    return result
+
+def run_threaded(port, workers, clients, requests):
+    # Threads the server adds: the accepting one, the pool and one per open
+    # WebSocket.
+    base = thread_count()
+    srv = make_server(port, workers)
+    srv.Start(threaded=True)
+    time.sleep(0.2)
+    result = run_load(port, clients, requests, base)
+    srv.Stop()
+    return result
+
+def run_async(port, clients, requests):
+    ready = threading.Event()
+    done = []
+
+    async def serve():
+        srv = make_server(port, 0)
+        await srv.StartAsync()
+        ready.set()
+        while not done:
+            await asyncio.sleep(0.05)
+        srv.Stop()
+
+    base = thread_count()
+    loop_thread = threading.Thread(target=asyncio.run, args=(serve(),))
+    loop_thread.start()
+    ready.wait()
+    result = run_load(port, clients, requests, base)
+    done.append(True)
+    loop_thread.join()
+    return result
+
+def run(clients=4, requests=200, port=18480):
+    results = {
+        "threaded.inline": run_threaded(port, 0, clients, requests),
+        "threaded.pool2": run_threaded(port + 1, 2, clients, requests),
+        "async": run_async(port + 2, clients, requests),
+    }
+    return {
+        "meta": {"clients": clients, "requests": requests, "python": platform.python_version()},
+        "results": results,
+    }
+
+COLUMNS = ("httpRps", "wsRtps", "peakThreads")
+
+def print_table(report, out=sys.stdout):
+    width = max(len(name) for name in report["results"])
+    out.write("{:<{w}}".format("case", w=width) + "".join("{:>14}".format(c) for c in COLUMNS) + "\n")
+    for name, r in report["results"].items():
+        out.write("{:<{w}}".format(name, w=width) + "".join("{:>14g}".format(r[c]) for c in COLUMNS) + "\n")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="MicroWebSrv threaded vs event loop benchmark.")
+    parser.add_argument("--clients", type=int, default=4, help="parallel clients per case")
+    parser.add_argument("--repeat", type=int, default=200, help="requests (and WebSocket messages) per client")
+    parser.add_argument("--port", type=int, default=18480, help="first of the three local ports used")
+    parser.add_argument("--json", metavar="PATH", help="write the report as JSON, - for stdout")
+    args = parser.parse_args(argv)
+
+    report = run(args.clients, args.repeat, args.port)
+    if args.json == "-":
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write("\n")
+        print_table(report, sys.stderr)
+    else:
+        print_table(report)
+        if args.json:
+            with open(args.json, "w") as f:
+                json.dump(report, f, indent=2, sort_keys=True)
+                f.write("\n")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+# Pre-compresses the static web files for MicroWebSrv: writes file.gz next to
+# each text asset under the portal tree (sd/portal by default), which the
+# server sends with Content-Encoding: gzip to clients that accept it. A .gz is
+# only kept when it saves at least --min-saving of the file, and is written
+# with a fixed timestamp so reruns give identical files. Reports, per file
+# type, the bytes served before and after.
+#
+#   python tools/gzip_portal.py                    # compress sd/portal
+#   python tools/gzip_portal.py --dry-run          # only report
+#   python tools/gzip_portal.py --clean            # remove the .gz files
+#   python tools/gzip_portal.py --json report.json # also save JSON
+import argparse
+import gzip
+import io
+import json
+import os
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+PORTAL = os.path.join(os.path.dirname(HERE), "sd", "portal")
+
+# Types MicroWebSrv serves that are worth compressing; images, fonts in
+# woff/woff2 and archives are compressed already.
+EXTENSIONS = (".html", ".htm", ".js", ".css", ".json", ".txt", ".svg", ".xml",
+              ".xhtml", ".csv", ".ts", ".ico", ".ttf", ".otf")
+
+def compress(data, level):
+    out = io.BytesIO()
+    with gzip.GzipFile(filename="", mode="wb", compresslevel=level, fileobj=out, mtime=0) as f:
+        f.write(data)
+    return out.getvalue()
+
+def walk(root):
+    for folder, _, files in os.walk(root):
+        for name in sorted(files):
+            yield os.path.join(folder, name)
+
+def clean(root, dry_run=False):
+    removed = 0
+    for path in walk(root):
+        if path.endswith(".gz"):
+            if not dry_run:
+                os.remove(path)
+            removed += 1
+    return removed
+
+def run(root=PORTAL, level=9, min_size=256, min_saving=0.1, dry_run=False):
+    results = {}
+    total = {"files": 0, "gzipped": 0, "bytes": 0, "servedBytes": 0}
+    for path in walk(root):
+        ext = os.path.splitext(path)[1].lower()
+        if ext == ".gz":
+            # A .gz whose file is gone would never be served.
+            if not os.path.exists(path[:-3]) and not dry_run:
+                os.remove(path)
+            continue
+        if ext not in EXTENSIONS:
+            continue
+        with open(path, "rb") as f:
+            data = f.read()
+        served = len(data)
+        gzpath = path + ".gz"
+        packed = compress(data, level) if len(data) >= min_size else None
+        if packed is not None and len(packed) <= len(data) * (1 - min_saving):
+            served = len(packed)
+            if not dry_run:
+                with open(gzpath, "wb") as f:
+                    f.write(packed)
+        elif os.path.exists(gzpath) and not dry_run:
+            os.remove(gzpath)
+        r = results.setdefault(ext[1:], {"files": 0, "gzipped": 0, "bytes": 0, "servedBytes": 0})
+        for acc in (r, total):
+            acc["files"] += 1
+            acc["gzipped"] += served < len(data)
+            acc["bytes"] += len(data)
+            acc["servedBytes"] += served
+    results["total"] = total
+    for r in results.values():
+        r["ratio"] = round(r["bytes"] / r["servedBytes"], 2) if r["servedBytes"] else 1.0
+    return {
+        "meta": {"root": root, "level": level, "minSize": min_size, "minSaving": min_saving, "dryRun": dry_run},
+        "results": results,
+    }
+
+COLUMNS = ("files", "gzipped", "bytes", "servedBytes", "ratio")
+
+def print_table(report, out=sys.stdout):
+    width = max(len(name) for name in report["results"])
+    out.write("{:<{w}}".format("type", w=width) + "".join("{:>14}".format(c) for c in COLUMNS) + "\n")
+    for name, r in report["results"].items():
+        out.write("{:<{w}}".format(name, w=width) + "".join("{:>14}".format(r[c]) for c in COLUMNS) + "\n")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Write .gz siblings of the portal's static files.")
+    parser.add_argument("root", nargs="?", default=PORTAL, help="web root, sd/portal by default")
+    parser.add_argument("--level", type=int, default=9, help="gzip level")
+    parser.add_argument("--min-size", type=int, default=256, help="leave files smaller than this alone")
+    parser.add_argument("--min-saving", type=float, default=0.1, help="keep a .gz only if it saves this fraction")
+    parser.add_argument("--dry-run", action="store_true", help="report without writing or removing files")
+    parser.add_argument("--clean", action="store_true", help="remove every .gz under root and stop")
+    parser.add_argument("--json", metavar="PATH", help="write the report as JSON, - for stdout")
+    args = parser.parse_args(argv)
+
+    if args.clean:
+        print("removed {} .gz files".format(clean(args.root, args.dry_run)))
+        return
+    report = run(args.root, args.level, args.min_size, args.min_saving, args.dry_run)
+    if args.json == "-":
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write("\n")
+        print_table(report, sys.stderr)
+    else:
+        print_table(report)
+        if args.json:
+            with open(args.json, "w") as f:
+                json.dump(report, f, indent=2, sort_keys=True)
+                f.write("\n")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+# Host-side simulation of the CYOBrain board, so sd/lib runs under CPython.
+#
+#   import sys; sys.path[:0] = ["tools", "sd"]
+#   import sim
+#   board = sim.install(sdcard="sd")
+#   from lib.kinematics import Crawler
+#   bot = Crawler()
+#   bot.command("forward")
+#   print(board.log.stats(), board.pca.pulses_us())
+#
+# install() must run before anything imports machine, neopixel or the sd/lib
+# modules that use them.
+import builtins
+import os
+import sys
+import time
+
+from . import board as _board
+from .board import Board
+from .bus import BusLog, Transaction, i2c_time_us
+from .clock import Clock
+from .devices import LSM6DSLModel, PCA9685Model
+
+_TIME_FUNCTIONS = ("sleep", "sleep_ms", "sleep_us", "ticks_ms", "ticks_us", "ticks_cpu", "ticks_diff", "ticks_add")
+_saved = None
+
+def install(virtual_time=True, sdcard=None):
+    # Make a fresh Board current and put the machine, neopixel and micropython
+    # stand-ins, the const builtin and the MicroPython time functions in
+    # place. With sdcard, paths under /sdcard are served from that directory.
+    # Returns the Board.
+    global _saved
+    from . import machine, micropython, neopixel
+    if _saved is None:
+        _saved = {
+            "modules": {name: sys.modules.get(name) for name in ("machine", "neopixel", "micropython")},
+            "time": {name: getattr(time, name, None) for name in _TIME_FUNCTIONS},
+            "const": getattr(builtins, "const", None),
+            "open": builtins.open,
+            "listdir": os.listdir,
+            "stat": os.stat,
+        }
+    _board.current = Board(virtual_time)
+    sys.modules["machine"] = machine
+    sys.modules["neopixel"] = neopixel
+    sys.modules["micropython"] = micropython
+    builtins.const = micropython.const
+    for name in _TIME_FUNCTIONS:
+        setattr(time, name, getattr(_board, name))
+    builtins.open = _saved["open"]
+    os.listdir = _saved["listdir"]
+    os.stat = _saved["stat"]
+    if sdcard is not None:
+        _mount_sdcard(os.path.abspath(sdcard))
+    return _board.current
+
+def uninstall():
+    # Undo install().
+    global _saved
+    if _saved is None:
+        return
+    for name, module in _saved["modules"].items():
+        if module is None:
+            sys.modules.pop(name, None)
+        else:
+            sys.modules[name] = module
+    for name, fn in _saved["time"].items():
+        if fn is None:
+            delattr(time, name)
+        else:
+            setattr(time, name, fn)
+    if _saved["const"] is None:
+        del builtins.const
+    else:
+        builtins.const = _saved["const"]
+    builtins.open = _saved["open"]
+    os.listdir = _saved["listdir"]
+    os.stat = _saved["stat"]
+    _board.current = None
+    _saved = None
+
+def current():
+    return _board.current
+
+def _mount_sdcard(root):
+    real_open = _saved["open"]
+    real_listdir = _saved["listdir"]
+    real_stat = _saved["stat"]
+
+    def path(p):
+        if isinstance(p, str) and (p == "/sdcard" or p.startswith("/sdcard/")):
+            return root + p[len("/sdcard"):]
+        return p
+
+    builtins.open = lambda file, *args, **kwargs: real_open(path(file), *args, **kwargs)
+    os.listdir = lambda p=".": real_listdir(path(p))
+    os.stat = lambda p, *args, **kwargs: real_stat(path(p), *args, **kwargs)
@@ -0,0 +1,57 @@
+from .bus import BusLog
+from .clock import Clock
+from .devices import LSM6DSLModel, PCA9685Model
+
+# The board the machine / neopixel stand-ins talk to, set by sim.install().
+current = None
+
+class Board:
+    # One simulated CYOBrain: a clock, the transaction log, the I2C devices by
+    # address, pin levels and the echo the ultrasonic sensor should see.
+    PCA9685_ADDRESS = 0x43
+    LSM6DSL_ADDRESS = 0x6A
+
+    def __init__(self, virtual_time=True):
+        self.clock = Clock(virtual_time)
+        self.log = BusLog(self.clock)
+        self.devices = {
+            self.PCA9685_ADDRESS: PCA9685Model(),
+            self.LSM6DSL_ADDRESS: LSM6DSLModel(),
+        }
+        self.pins = {}     # pin id -> level last written
+        self.echo_us = {}  # pin id -> pulse width for time_pulse_us, None = no echo
+        self.strips = []   # NeoPixel objects created on this board
+
+    @property
+    def pca(self):
+        return self.devices[self.PCA9685_ADDRESS]
+
+    @property
+    def imu(self):
+        return self.devices[self.LSM6DSL_ADDRESS]
+
+# time functions MicroPython adds, bound to whichever board is current.
+
+def sleep(s):
+    current.clock.sleep(s)
+
+def sleep_ms(ms):
+    current.clock.sleep_ms(ms)
+
+def sleep_us(us):
+    current.clock.sleep_us(us)
+
+def ticks_ms():
+    return current.clock.ticks_ms()
+
+def ticks_us():
+    return current.clock.ticks_us()
+
+def ticks_cpu():
+    return current.clock.ticks_us()
+
+def ticks_diff(a, b):
+    return current.clock.ticks_diff(a, b)
+
+def ticks_add(a, delta):
+    return current.clock.ticks_add(a, delta)
@@ -0,0 +1,73 @@
+# Transaction log shared by every simulated peripheral, with the time each
+# transfer would take on the wire.
+
+class Transaction:
+    # kind is "write" / "read" (register access), "writeto" / "readfrom" (raw
+    # I2C), "scan", "neopixel", "pin" or "pulse". t_us is the start time on the board
+    # clock, duration_us the modelled wire time.
+    __slots__ = ("t_us", "duration_us", "kind", "bus", "addr", "reg", "data")
+
+    def __init__(self, t_us, duration_us, kind, bus, addr, reg, data):
+        self.t_us = t_us
+        self.duration_us = duration_us
+        self.kind = kind
+        self.bus = bus
+        self.addr = addr
+        self.reg = reg
+        self.data = data
+
+    def __repr__(self):
+        reg = "" if self.reg is None else " reg=0x{:02X}".format(self.reg)
+        addr = "" if self.addr is None else " addr=0x{:02X}".format(self.addr)
+        return "<{} {}us {}{}{} {}B {}us>".format(
+            self.kind, self.t_us, self.bus, addr, reg, len(self.data), self.duration_us)
+
+def i2c_time_us(freq, nbytes, restart=False):
+    # Start, address byte, nbytes, stop; every byte is 8 bits plus ACK. A
+    # register read adds a repeated start and a second address byte.
+    bits = 2 + 9 * (1 + nbytes)
+    if restart:
+        bits += 1 + 9
+    return bits * 1000000 / freq
+
+class BusLog:
+    # With keep False only the running totals are updated, so measuring a
+    # long run does not fill memory with Transaction objects.
+    def __init__(self, clock, keep=True):
+        self.clock = clock
+        self.keep = keep
+        self.clear()
+
+    def record(self, kind, bus, addr, reg, data, duration_us):
+        # Log a transfer starting now and move the clock past it, the way the
+        # blocking machine calls do on the robot.
+        t = None
+        if self.keep:
+            t = Transaction(self.clock.now_us(), duration_us, kind, bus, addr, reg, bytes(data))
+            self.transactions.append(t)
+        total = self._totals.get(kind)
+        if total is None:
+            total = self._totals[kind] = [0, 0, 0.0]
+        total[0] += 1
+        total[1] += len(data)
+        total[2] += duration_us
+        self.clock.advance(duration_us)
+        return t
+
+    def clear(self):
+        self.transactions = []
+        self._totals = {}
+
+    def since(self, t_us):
+        return [t for t in self.transactions if t.t_us >= t_us]
+
+    def stats(self):
+        # Totals per kind plus overall since the last clear(): transaction
+        # count, payload bytes and modelled wire time.
+        out = {"transactions": 0, "bytes": 0, "busUs": 0.0, "byKind": {}}
+        for kind, (n, nbytes, us) in self._totals.items():
+            out["byKind"][kind] = {"transactions": n, "bytes": nbytes, "busUs": us}
+            out["transactions"] += n
+            out["bytes"] += nbytes
+            out["busUs"] += us
+        return out
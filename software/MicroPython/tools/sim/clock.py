@@ -0,0 +1,57 @@
+import time
+
+# MicroPython's ticks_* wrap at 2**30 on the ESP32.
+TICKS_PERIOD = 1 << 30
+_TICKS_MAX = TICKS_PERIOD - 1
+_TICKS_HALF = TICKS_PERIOD // 2
+
+class Clock:
+    # Microsecond clock of the simulated board. In virtual mode time only moves
+    # when the code sleeps or waits on a bus, so runs are repeatable and every
+    # timing comes from the models rather than from the host CPU. In real mode
+    # it follows the host clock and bus waits really sleep.
+    def __init__(self, virtual=True):
+        self.virtual = virtual
+        self._now = 0
+        self._t0 = time.perf_counter()
+
+    def now_us(self):
+        if self.virtual:
+            return self._now
+        return int((time.perf_counter() - self._t0) * 1000000)
+
+    def advance(self, us):
+        if us <= 0:
+            return
+        if self.virtual:
+            self._now += int(us)
+        else:
+            _sleep(us / 1000000)
+
+    # time module stand-ins
+
+    def ticks_us(self):
+        return self.now_us() & _TICKS_MAX
+
+    def ticks_ms(self):
+        return (self.now_us() // 1000) & _TICKS_MAX
+
+    def ticks_diff(self, a, b):
+        return ((a - b + _TICKS_HALF) & _TICKS_MAX) - _TICKS_HALF
+
+    def ticks_add(self, a, delta):
+        return (a + delta) & _TICKS_MAX
+
+    def sleep_us(self, us):
+        self.advance(us)
+
+    def sleep_ms(self, ms):
+        self.advance(ms * 1000)
+
+    def sleep(self, s):
+        self.advance(s * 1000000)
+
+    def time(self):
+        return self.now_us() // 1000000
+
+_sleep = time.sleep
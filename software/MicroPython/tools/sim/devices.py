@@ -0,0 +1,153 @@
+import struct
+
+# Register-level models of the I2C chips on the board. A model only sees the
+# bytes the driver sends; bus timing is added by machine.I2C.
+
+class PCA9685Model:
+    # 16 channel PWM controller. Honours MODE1 auto-increment, the ALL_LED
+    # registers and the rule that PRE_SCALE is only written while asleep.
+    MODE1 = 0x00
+    LED0_ON_L = 0x06
+    ALL_LED_ON_L = 0xFA
+    PRE_SCALE = 0xFE
+    OSC_HZ = 25000000
+
+    _SLEEP = 0x10
+    _AI = 0x20
+    _RESTART = 0x80
+
+    def __init__(self):
+        self.regs = bytearray(256)
+        self.reset()
+
+    def reset(self):
+        # Power-on values from the datasheet: asleep, ALLCALL, all outputs off.
+        regs = self.regs
+        for i in range(256):
+            regs[i] = 0
+        regs[0x00] = 0x11
+        regs[0x01] = 0x04
+        regs[0x02] = 0xE2
+        regs[0x03] = 0xE4
+        regs[0x04] = 0xE8
+        regs[0x05] = 0xE0
+        for ch in range(16):
+            regs[self.LED0_ON_L + 4 * ch + 3] = 0x10
+        regs[self.PRE_SCALE] = 0x1E
+
+    def _next(self, reg):
+        if reg == self.LED0_ON_L + 63:
+            return 0
+        return (reg + 1) & 0xFF
+
+    def write(self, reg, data):
+        ai = self.regs[self.MODE1] & self._AI
+        for b in data:
+            self._store(reg, b)
+            if ai:
+                reg = self._next(reg)
+
+    def _store(self, reg, b):
+        regs = self.regs
+        if reg == self.PRE_SCALE:
+            if regs[self.MODE1] & self._SLEEP:
+                regs[reg] = b
+        elif self.ALL_LED_ON_L <= reg <= self.ALL_LED_ON_L + 3:
+            for ch in range(16):
+                regs[self.LED0_ON_L + 4 * ch + reg - self.ALL_LED_ON_L] = b
+        elif reg == self.MODE1:
+            # Writing RESTART clears it.
+            regs[reg] = b & ~self._RESTART
+        else:
+            regs[reg] = b
+
+    def read(self, reg, n):
+        ai = self.regs[self.MODE1] & self._AI
+        out = bytearray(n)
+        for i in range(n):
+            # ALL_LED registers always read back as zero.
+            if not self.ALL_LED_ON_L <= reg <= self.ALL_LED_ON_L + 3:
+                out[i] = self.regs[reg]
+            if ai:
+                reg = self._next(reg)
+        return bytes(out)
+
+    def pwm(self, ch):
+        # (on, off) of a channel as 16 bit values including the full on/off bits.
+        base = self.LED0_ON_L + 4 * ch
+        on, off = struct.unpack_from("<HH", self.regs, base)
+        return on, off
+
+    def period_us(self):
+        return (self.regs[self.PRE_SCALE] + 1) * 4096 * 1000000 / self.OSC_HZ
+
+    def pulse_us(self, ch):
+        # High time per period of a channel, 0 when it is off or the chip sleeps.
+        on, off = self.pwm(ch)
+        if self.regs[self.MODE1] & self._SLEEP or off & 0x1000:
+            return 0.0
+        if on & 0x1000:
+            return self.period_us()
+        ticks = ((off & 0xFFF) - (on & 0xFFF)) % 4096
+        return ticks * self.period_us() / 4096
+
+    def pulses_us(self):
+        return [self.pulse_us(ch) for ch in range(16)]
+
+class LSM6DSLModel:
+    # Accelerometer/gyroscope. WHO_AM_I, CTRL registers, self-clearing
+    # SW_RESET, IF_INC auto-increment and settable raw output registers.
+    WHO_AM_I = 0x0F
+    CTRL1_XL = 0x10
+    CTRL2_G = 0x11
+    CTRL3_C = 0x12
+    OUT_TEMP_L = 0x20
+    OUTX_L_G = 0x22
+    OUTX_L_XL = 0x28
+    CHIP_ID = 0x6A
+
+    _SW_RESET = 0x01
+    _IF_INC = 0x04
+
+    def __init__(self):
+        self.regs = bytearray(128)
+        self.reset()
+
+    def reset(self):
+        # Output registers are left alone: the sensor keeps sampling.
+        regs = self.regs
+        for i in range(len(regs)):
+            if not self.OUT_TEMP_L <= i < self.OUTX_L_XL + 6:
+                regs[i] = 0
+        regs[self.WHO_AM_I] = self.CHIP_ID
+        regs[self.CTRL3_C] = self._IF_INC
+
+    def write(self, reg, data):
+        inc = self.regs[self.CTRL3_C] & self._IF_INC
+        for b in data:
+            if reg == self.CTRL3_C and b & self._SW_RESET:
+                self.reset()
+            elif reg != self.WHO_AM_I and reg < len(self.regs):
+                self.regs[reg] = b
+            if inc:
+                reg += 1
+
+    def read(self, reg, n):
+        inc = self.regs[self.CTRL3_C] & self._IF_INC
+        out = bytearray(n)
+        for i in range(n):
+            if reg < len(self.regs):
+                out[i] = self.regs[reg]
+            if inc:
+                reg += 1
+        return bytes(out)
+
+    def set_accel(self, x, y, z):
+        # Raw signed 16 bit counts, as the driver reads them.
+        struct.pack_into("<hhh", self.regs, self.OUTX_L_XL, x, y, z)
+
+    def set_gyro(self, x, y, z):
+        struct.pack_into("<hhh", self.regs, self.OUTX_L_G, x, y, z)
+
+    def set_temp(self, raw):
+        struct.pack_into("<h", self.regs, self.OUT_TEMP_L, raw)
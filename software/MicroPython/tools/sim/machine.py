@@ -0,0 +1,139 @@
+# Stand-in for MicroPython's machine module on the simulated board.
+from . import board as _board
+from .bus import i2c_time_us
+
+_ENODEV = 19
+
+class Pin:
+    IN = 1
+    OUT = 3
+    OPEN_DRAIN = 7
+    PULL_UP = 2
+    PULL_DOWN = 1
+    IRQ_RISING = 1
+    IRQ_FALLING = 2
+
+    def __init__(self, id, mode=-1, pull=-1, value=None, **kwargs):
+        self.id = id
+        self.init(mode, pull, value)
+
+    def init(self, mode=-1, pull=-1, value=None, **kwargs):
+        self.mode = mode
+        self.pull = pull
+        if value is not None:
+            self.value(value)
+
+    def value(self, value=None):
+        b = _board.current
+        if value is None:
+            return b.pins.get(self.id, 0)
+        value = 1 if value else 0
+        b.pins[self.id] = value
+        b.log.record("pin", self._name(), None, None, bytes((value,)), 0)
+
+    def __call__(self, value=None):
+        return self.value(value)
+
+    def on(self):
+        self.value(1)
+
+    def off(self):
+        self.value(0)
+
+    def irq(self, handler=None, trigger=IRQ_FALLING | IRQ_RISING, **kwargs):
+        self.handler = handler
+
+    def _name(self):
+        return "pin{}".format(self.id)
+
+    def __repr__(self):
+        return "Pin({})".format(self.id)
+
+class I2C:
+    # Register and raw transfers go to the board's device models and are
+    # logged with their wire time at freq. A missing device raises
+    # OSError(ENODEV) like the ESP32 port.
+    def __init__(self, id=0, *, scl=None, sda=None, freq=400000, timeout=50000):
+        self.freq = freq
+        self.name = "i2c(scl={},sda={})".format(
+            getattr(scl, "id", scl), getattr(sda, "id", sda))
+        self._pointer = {}
+
+    def _device(self, addr):
+        dev = _board.current.devices.get(addr)
+        if dev is None:
+            _board.current.log.record("writeto", self.name, addr, None, b"", i2c_time_us(self.freq, 0))
+            raise OSError(_ENODEV, "ENODEV")
+        return dev
+
+    def scan(self):
+        # Every address from 0x08 to 0x77 is probed with an address byte.
+        b = _board.current
+        b.log.record("scan", self.name, None, None, b"", i2c_time_us(self.freq, 0) * 112)
+        return sorted(a for a in b.devices if 0x08 <= a <= 0x77)
+
+    def writeto_mem(self, addr, memaddr, buf, *, addrsize=8):
+        dev = self._device(addr)
+        data = bytes(buf)
+        _board.current.log.record("write", self.name, addr, memaddr, data, i2c_time_us(self.freq, 1 + len(data)))
+        dev.write(memaddr, data)
+
+    def readfrom_mem(self, addr, memaddr, nbytes, *, addrsize=8):
+        dev = self._device(addr)
+        data = dev.read(memaddr, nbytes)
+        _board.current.log.record("read", self.name, addr, memaddr, data, i2c_time_us(self.freq, 1 + nbytes, True))
+        return data
+
+    def readfrom_mem_into(self, addr, memaddr, buf, *, addrsize=8):
+        buf[:] = self.readfrom_mem(addr, memaddr, len(buf))
+
+    def writeto(self, addr, buf, stop=True):
+        # The first byte sets the register pointer, the rest are written from it.
+        dev = self._device(addr)
+        data = bytes(buf)
+        _board.current.log.record("writeto", self.name, addr, None, data, i2c_time_us(self.freq, len(data)))
+        if data:
+            self._pointer[addr] = data[0]
+            if len(data) > 1:
+                dev.write(data[0], data[1:])
+        return len(data)
+
+    def readfrom(self, addr, nbytes, stop=True):
+        dev = self._device(addr)
+        data = dev.read(self._pointer.get(addr, 0), nbytes)
+        _board.current.log.record("readfrom", self.name, addr, None, data, i2c_time_us(self.freq, nbytes))
+        return data
+
+    def readfrom_into(self, addr, buf, stop=True):
+        buf[:] = self.readfrom(addr, len(buf))
+
+SoftI2C = I2C
+
+def time_pulse_us(pin, pulse_level, timeout_us=1000000):
+    # Width of the echo set in board.echo_us for this pin. Like the firmware,
+    # -2 when no pulse starts and -1 when it outlasts the timeout.
+    b = _board.current
+    width = b.echo_us.get(pin.id)
+    if width is None:
+        b.log.record("pulse", pin._name(), None, None, b"", timeout_us)
+        return -2
+    if width > timeout_us:
+        b.log.record("pulse", pin._name(), None, None, b"", timeout_us)
+        return -1
+    b.log.record("pulse", pin._name(), None, None, b"", width)
+    return int(width)
+
+def freq(hz=None):
+    return 240000000
+
+def unique_id():
+    return b"\x00sim\x00\x00\x01"
+
+def idle():
+    pass
+
+def disable_irq():
+    return 0
+
+def enable_irq(state=0):
+    pass
@@ -0,0 +1,26 @@
+# Stand-in for MicroPython's micropython module.
+
+def const(expr):
+    return expr
+
+def native(f):
+    return f
+
+def viper(f):
+    return f
+
+def alloc_emergency_exception_buf(size):
+    pass
+
+def opt_level(level=None):
+    return 0
+
+def mem_info(verbose=False):
+    pass
+
+def schedule(func, arg):
+    func(arg)
+    return True
+
+def kbd_intr(chr):
+    pass
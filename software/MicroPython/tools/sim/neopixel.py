@@ -0,0 +1,44 @@
+# Stand-in for MicroPython's neopixel module on the simulated board.
+from . import board as _board
+
+class NeoPixel:
+    # Colours are stored GRB(W) in buf like the firmware. write() logs the
+    # whole buffer with its WS2812 wire time: 1.25 us a bit at 800 kHz
+    # (timing=1), 2.5 us at 400 kHz, plus the 50 us latch.
+    ORDER = (1, 0, 2, 3)
+
+    def __init__(self, pin, n, bpp=3, timing=1):
+        self.pin = pin
+        self.n = n
+        self.bpp = bpp
+        self.timing = timing
+        self.buf = bytearray(n * bpp)
+        _board.current.strips.append(self)
+
+    def __len__(self):
+        return self.n
+
+    def __setitem__(self, i, v):
+        offset = i * self.bpp
+        for j in range(self.bpp):
+            self.buf[offset + self.ORDER[j]] = v[j]
+
+    def __getitem__(self, i):
+        offset = i * self.bpp
+        return tuple(self.buf[offset + self.ORDER[j]] for j in range(self.bpp))
+
+    def fill(self, v):
+        for i in range(self.n):
+            self[i] = v
+
+    def _bit_us(self):
+        if isinstance(self.timing, (tuple, list)):
+            return (self.timing[0] + self.timing[1]) / 1000
+        return 1.25 if self.timing else 2.5
+
+    def write(self):
+        duration = len(self.buf) * 8 * self._bit_us() + 50
+        _board.current.log.record("neopixel", "pin{}".format(getattr(self.pin, "id", self.pin)), None, None, self.buf, duration)
+
+    def pixels(self):
+        return [self[i] for i in range(self.n)]